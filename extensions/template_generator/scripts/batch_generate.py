@@ -0,0 +1,212 @@
+"""
+Headless batch generation of wheel templates.
+Reads template specs from a CSV/JSONL file, or expands a parameter grid definition, and produces
+wheel.svg, wheel.png and wheel.json for every template (as saved from the UI), in parallel worker processes.
+
+Usage:
+    python batch_generate.py --specs specs.jsonl --out <output dir>
+    python batch_generate.py --grid grid.json --out <output dir> [--workers N] [--chunksize N] [--force]
+                             [--verify TOLERANCE]
+
+JSONL lines are either a wheel.json / design.json config, or a flat dict of WheelTemplate.ALL_ARGS.
+CSV headers are WheelTemplate.ALL_ARGS names, where the canvas size may be given as 'canvas_size'
+("<width> <height>") or as 'canvas_width' and 'canvas_height'.
+Either may have an optional 'name' field, used as the output dir name (the specs hash by default).
+A grid definition looks like:
+    {
+        "base": {"rim_diameter": 18, ...},
+        "grid": {"spoke_count": [3, 4, 5], "spoke_central_angle": {"start": 10, "stop": 40, "num": 7}}
+    }
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate, WheelTemplateBatch, produce_wheel_outputs
+    from render_cache import template_spec_hash
+    from coverage_verify import verify_coverage
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate, WheelTemplateBatch, produce_wheel_outputs
+    from scripts.render_cache import template_spec_hash
+    from scripts.coverage_verify import verify_coverage
+
+
+OUTPUT_FILES = ("wheel.svg", "wheel.png", "wheel.json")
+PROGRESS_INTERVAL = 5.0  # Seconds between progress reports
+
+
+def _parse_value(arg, value):
+    if arg == "canvas_size":
+        if isinstance(value, str):
+            value = value.replace("x", " ").replace(",", " ").split()
+        return tuple(float(v) for v in value)
+    if arg in WheelTemplateBatch.INT_ARGS:
+        return int(float(value))
+    return float(value)
+
+
+def _specs_from_dict(d):
+    # Accept both wheel.json / design.json configs and flat spec dicts
+    specs = d.get("specs", None) or d.get("template_specs", None) or d
+    res = {}
+    for arg in WheelTemplate.ALL_ARGS:
+        if arg in specs and specs[arg] not in (None, ""):
+            res[arg] = _parse_value(arg, specs[arg])
+    if "canvas_size" not in res and specs.get("canvas_width") and specs.get("canvas_height"):
+        res["canvas_size"] = (float(specs["canvas_width"]), float(specs["canvas_height"]))
+    return d.get("name", None), res
+
+
+def read_specs_file(fpath):
+    """
+    Returns list of (name or None, specs dict)
+    """
+    res = []
+    with open(fpath, "r", newline="") as f:
+        if fpath.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                res.append(_specs_from_dict(row))
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    res.append(_specs_from_dict(json.loads(line)))
+    return res
+
+
+def _grid_axis(arg, values):
+    if isinstance(values, dict):
+        values = np.linspace(values["start"], values["stop"], int(values["num"])).tolist()
+    return [_parse_value(arg, v) for v in values]
+
+
+def expand_grid(grid_cfg):
+    """
+    Expand a grid definition to a list of (None, specs dict), keeping only geometrically valid templates.
+    Returns (list of specs, number of pruned combinations)
+    """
+    _name, base = _specs_from_dict(grid_cfg.get("base", {}))
+    axes = [(arg, _grid_axis(arg, values)) for arg, values in grid_cfg["grid"].items()]
+    for arg, _values in axes:
+        if arg not in WheelTemplate.ALL_ARGS:
+            raise Exception("Unknown template argument in grid: '%s'" % arg)
+    combos = list(itertools.product(*[values for _arg, values in axes]))
+    if not combos:
+        return [], 0
+
+    # Check all combinations at once, and drop the invalid ones before they reach the workers. Values out of their
+    # parameter's range are pruned too. Their rows get the default value instead, so the batch can be built
+    columns = dict(base)
+    defaults = WheelTemplate().to_dict()
+    out_of_range = np.zeros(len(combos), dtype=bool)
+    for i, (arg, _values) in enumerate(axes):
+        column = [combo[i] for combo in combos]
+        bad, _msg = WheelTemplateBatch.out_of_range(arg, column)
+        if bad.any():
+            out_of_range |= bad
+            column = [defaults[arg] if is_bad else value for value, is_bad in zip(column, bad.tolist())]
+        columns[arg] = column
+    valid = WheelTemplateBatch(**columns).valid_mask() & ~out_of_range
+
+    res = []
+    for combo, ok in zip(combos, valid):
+        if ok:
+            specs = dict(base)
+            specs.update({arg: combo[i] for i, (arg, _values) in enumerate(axes)})
+            res.append((None, specs))
+    return res, len(combos) - len(res)
+
+
+def _produce_one(job):
+    name, specs, out_dir, force, verify_tolerance = job
+    try:
+        wt = WheelTemplate(**specs)
+        name = name or template_spec_hash(wt)[:16]
+        dirpath = os.path.join(out_dir, name)
+        fpaths = [os.path.join(dirpath, fname) for fname in OUTPUT_FILES]
+        if not force and all(os.path.isfile(fpath) for fpath in fpaths):
+            return name, "skipped", None
+        if verify_tolerance is not None:
+            wt.validate_geometry()
+            res = verify_coverage(wt, verify_tolerance)
+            if not res["ok"]:
+                return name, "rejected", "Rendered coverage deviates by %.2f%% points" % res["max_deviation"]
+        os.makedirs(dirpath, exist_ok=True)
+        produce_wheel_outputs(wt, *fpaths)
+        return name, "done", None
+    except Exception as e:
+        return name, "failed", str(e) or str(type(e))
+
+
+def run_batch(items, out_dir, workers=None, chunksize=None, force=False, verify_tolerance=None, log=print):
+    """
+    Produce the outputs of all templates in a process pool.
+    @param items: List of (name or None, specs dict)
+    @param verify_tolerance: If not None, reject templates whose rendered coverage deviates from the analytic one
+                             by more than this (in percentage points). See coverage_verify.verify_coverage()
+    Returns dict of counts per status, and the throughput
+    """
+    workers = workers or os.cpu_count() or 1
+    if not chunksize:
+        # Enough chunks for load balancing, but not so many that the IPC overhead dominates
+        chunksize = max(1, min(64, len(items) // (workers * 8)))
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(name, specs, out_dir, force, verify_tolerance) for name, specs in items]
+
+    counts = {"done": 0, "skipped": 0, "rejected": 0, "failed": 0}
+    t_start = t_report = time.time()
+    with Pool(workers) as pool:
+        for name, status, err in pool.imap_unordered(_produce_one, jobs, chunksize=chunksize):
+            counts[status] += 1
+            if err:
+                log("%s: %s" % (name, err))
+            now = time.time()
+            if now - t_report >= PROGRESS_INTERVAL:
+                t_report = now
+                processed = sum(counts.values())
+                log("%d/%d templates, %.1f templates/s" % (processed, len(jobs), processed / (now - t_start)))
+
+    elapsed = time.time() - t_start
+    counts["seconds"] = round(elapsed, 3)
+    counts["templates_per_second"] = round(len(jobs) / elapsed, 1) if elapsed > 0 else None
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch generation of wheel templates")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--specs", help="CSV or JSONL file of template specs")
+    src.add_argument("--grid", help="JSON file of a parameter grid definition")
+    parser.add_argument("--out", required=True, help="Output dir. Each template gets its own sub-dir")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=None, help="Templates per work chunk")
+    parser.add_argument("--force", action="store_true", help="Regenerate already produced outputs")
+    parser.add_argument("--verify", type=float, default=None, metavar="TOLERANCE",
+                        help="Reject templates whose rendered coverage misses the analytic one by more than "
+                             "TOLERANCE percentage points")
+    args = parser.parse_args(argv)
+
+    if args.specs:
+        items = read_specs_file(args.specs)
+    else:
+        items, n_pruned = expand_grid(json.load(open(args.grid, "r")))
+        print("Grid: %d valid templates, %d invalid combinations pruned" % (len(items), n_pruned))
+
+    res = run_batch(items, args.out, args.workers, args.chunksize, args.force, args.verify)
+    print("Done: %(done)d, skipped: %(skipped)d, rejected: %(rejected)d, failed: %(failed)d, in %(seconds).1fs "
+          "(%(templates_per_second)s templates/s)" % res)
+    return 1 if res["failed"] or res["rejected"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Offline end-to-end benchmark of the template -> design pipeline, without a GPU, network or the WebUI.
+Every iteration constructs and validates the template, renders it (and encodes the PNG) at each canvas size,
+builds the txt2img API request, calls a txt2img stand-in, decodes its response, and saves the design
+(design.json and design.zip, as the UI's Save button does).
+Reports the latency percentiles of each stage, and the peak traced memory of each stage in one extra iteration.
+
+Usage:
+    python benchmark.py [--iterations N] [--warmup N] [--sizes 256,512,1024] [--batch-size N]
+                        [--txt2img module:function] [--json results.json]
+                        [--baseline results.json] [--max-slowdown FACTOR]
+
+The txt2img stand-in is called as function(txt2img API request dict) and returns the response dict, just like
+the /sdapi/v1/txt2img API. The default one, mock_txt2img(), draws the scaled template with a label.
+With --baseline, exits with status 1 if the median of any stage got slower than the baseline's by more than
+FACTOR (and by more than MIN_SLOWDOWN_MS).
+"""
+import argparse
+import base64
+import importlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate, WheelTemplateRenderer
+    from image_utils import pil_image_to_png_bytes
+    from design_pipeline import build_txt2img_request, apply_precomputed_hint, build_txt2img_api_request, \
+        decode_txt2img_api_response
+    from design_archive import BlobStore, save_design, BLOBS_DIR_NAME
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate, WheelTemplateRenderer
+    from scripts.image_utils import pil_image_to_png_bytes
+    from scripts.design_pipeline import build_txt2img_request, apply_precomputed_hint, build_txt2img_api_request, \
+        decode_txt2img_api_response
+    from scripts.design_archive import BlobStore, save_design, BLOBS_DIR_NAME
+
+
+EXT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_DESIGN_JSON = os.path.join(EXT_DIR, "base_design.json")
+LABEL_FONT = os.path.join(EXT_DIR, "ariblk.ttf")
+DEFAULT_SIZES = (256, 512, 1024)
+PERCENTILES = (50, 90, 99)
+MIN_SLOWDOWN_MS = 1.0  # Slowdowns below this are noise
+
+
+def mock_txt2img(txt2img_req):
+    """
+    Stand-in for the txt2img API: returns 'batch_size' images of the requested size, each the ControlNet input
+    image with a random label. Deterministic for a given seed.
+    """
+    width, height = int(txt2img_req["width"]), int(txt2img_req["height"])
+    cn_args = txt2img_req["alwayson_scripts"]["controlnet"]["args"][0]
+    template_img = Image.open(io.BytesIO(base64.b64decode(cn_args["input_image"]))).convert("RGB")
+    template_img = template_img.resize((width, height))
+    try:
+        font = ImageFont.truetype(LABEL_FONT, 15)
+    except OSError:
+        font = ImageFont.load_default()
+    rng = np.random.default_rng(None if txt2img_req["seed"] == -1 else txt2img_req["seed"])
+    chars = list("abcdefghijklmnopqrstuvwxyz0123456789")
+
+    images = []
+    for i in range(int(txt2img_req["batch_size"])):
+        image = template_img.copy()
+        draw = ImageDraw.Draw(image)
+        draw.text((5, 5), "%d %s" % (i, "".join(rng.choice(chars, 15))), font=font, align="left", fill="red")
+        images.append(base64.b64encode(pil_image_to_png_bytes(image)).decode())
+    return {"images": images, "parameters": {}, "info": ""}
+
+
+def load_txt2img_func(spec):
+    """
+    @param spec: "module:function", with the module importable from the current dir or the scripts dir
+    """
+    if ":" not in spec:
+        raise Exception("The txt2img stand-in must be given as 'module:function', not '%s'" % spec)
+    module_name, func_name = spec.split(":", 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class StageTimer(object):
+    """
+    Collects the durations of the pipeline stages, and optionally their peak traced memory
+    """
+
+    def __init__(self):
+        self.durations = {}  # stage -> list of seconds
+        self.peaks = {}  # stage -> bytes
+        self.trace_memory = False
+
+    def run(self, stage, func, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base, _peak = tracemalloc.get_traced_memory()
+            res = func(*args, **kwargs)
+            _current, peak = tracemalloc.get_traced_memory()
+            self.peaks[stage] = max(self.peaks.get(stage, 0), peak - base)
+            return res
+        t_start = time.perf_counter()
+        res = func(*args, **kwargs)
+        self.durations.setdefault(stage, []).append(time.perf_counter() - t_start)
+        return res
+
+
+def _render(wt, size):
+    specs = wt.to_dict()
+    specs["canvas_size"] = (size, size)
+    return WheelTemplateRenderer(WheelTemplate(**specs)).generate_raster("pil")
+
+
+def _validate(wt):
+    wt.validate_geometry()
+    return wt.calc_areas()
+
+
+def _decode(r, txt2img_params):
+    images = decode_txt2img_api_response(r, txt2img_params)
+    for im in images:
+        im.load()
+    return images
+
+
+def _save(out_dir, blob_store, wt, template_png, images, attr_dict, render_dict):
+    # The UI gets the designed images as the gallery's temp files
+    dirpath = tempfile.mkdtemp(dir=out_dir)
+    fpaths = []
+    for i, im in enumerate(images):
+        fpath = os.path.join(dirpath, "gallery_%d.png" % i)
+        im.save(fpath, format="PNG")
+        fpaths.append(fpath)
+    return save_design(os.path.join(dirpath, "design"), blob_store, wt, template_png, fpaths, attr_dict, render_dict)
+
+
+def run_iteration(timer, base_cfg, sizes, design_size, batch_size, seed, txt2img_func, out_dir, blob_store):
+    specs = dict(base_cfg["template_specs"], canvas_size=(design_size, design_size))
+    wt = timer.run("construct", WheelTemplate, **specs)
+    timer.run("validate", _validate, wt)
+
+    template_img = None
+    for size in sizes:
+        im = timer.run("render@%d" % size, _render, wt, size)
+        template_png = timer.run("png_encode@%d" % size, pil_image_to_png_bytes, im)
+        if size == design_size:
+            template_img, design_template_png = im, template_png
+
+    design_inputs = dict(base_cfg["design"]["render"], canvas_width=design_size, canvas_height=design_size,
+                         batch_size=batch_size, seed=seed)
+
+    def build_request():
+        txt2img_params, cn_params = build_txt2img_request(design_inputs)
+        hint = apply_precomputed_hint(wt, txt2img_params, cn_params)
+        cn_input_img = template_img if hint is None else hint
+        return txt2img_params, build_txt2img_api_request(txt2img_params, cn_params, cn_input_img)
+
+    txt2img_params, txt2img_req = timer.run("build_request", build_request)
+    r = timer.run("txt2img", txt2img_func, txt2img_req)
+    images = timer.run("decode", _decode, r, txt2img_params)
+    timer.run("save", _save, out_dir, blob_store, wt, design_template_png, images,
+              base_cfg["design"]["attr"], design_inputs)
+
+
+def summarize(timer):
+    """
+    Returns dict of stage -> dict of latency stats in milliseconds, and the peak traced memory in KiB
+    """
+    res = {}
+    for stage, durations in timer.durations.items():
+        ms = np.array(durations) * 1000
+        stats = {"n": len(ms), "mean": round(float(ms.mean()), 3), "max": round(float(ms.max()), 3)}
+        for p in PERCENTILES:
+            stats["p%d" % p] = round(float(np.percentile(ms, p)), 3)
+        if stage in timer.peaks:
+            stats["peak_kib"] = round(timer.peaks[stage] / 1024.0, 1)
+        res[stage] = stats
+    return res
+
+
+def format_summary(summary):
+    cols = ["p%d" % p for p in PERCENTILES] + ["mean", "max"]
+    lines = ["%-16s" % "stage" + "".join("%10s" % (c + " ms") for c in cols) + "%14s" % "peak KiB"]
+    for stage, stats in summary.items():
+        lines.append("%-16s" % stage + "".join("%10.2f" % stats[c] for c in cols) +
+                     "%14s" % stats.get("peak_kib", "-"))
+    return "\n".join(lines)
+
+
+def compare_to_baseline(summary, baseline, max_slowdown):
+    """
+    Returns list of messages of the stages whose median is slower than the baseline's by more than 'max_slowdown'
+    """
+    regressions = []
+    for stage, stats in summary.items():
+        base_stats = baseline.get(stage, None)
+        if base_stats is None:
+            continue
+        p50, base_p50 = stats["p50"], base_stats["p50"]
+        if p50 > base_p50 * max_slowdown and p50 - base_p50 > MIN_SLOWDOWN_MS:
+            regressions.append("%s: median %.2fms, baseline %.2fms (x%.2f)" % (stage, p50, base_p50, p50 / base_p50))
+    return regressions
+
+
+def run_benchmark(iterations=20, warmup=2, sizes=DEFAULT_SIZES, design_size=512, batch_size=4, seed=1234,
+                  txt2img_func=mock_txt2img, log=print):
+    base_cfg = json.load(open(BASE_DESIGN_JSON, "r"))
+    sizes = sorted(set(sizes) | {design_size})
+    timer = StageTimer()
+    out_dir = tempfile.mkdtemp(prefix="wheel_power_bench_")
+    try:
+        blob_store = BlobStore(os.path.join(out_dir, BLOBS_DIR_NAME))
+        for i in range(warmup):
+            run_iteration(StageTimer(), base_cfg, sizes, design_size, batch_size, seed + i, txt2img_func,
+                          out_dir, blob_store)
+        t_start = time.time()
+        for i in range(iterations):
+            # Different seeds, so the saved images aren't deduplicated by the blob store
+            run_iteration(timer, base_cfg, sizes, design_size, batch_size, seed + warmup + i, txt2img_func,
+                          out_dir, blob_store)
+        log("%d iterations in %.1fs" % (iterations, time.time() - t_start))
+
+        timer.trace_memory = True
+        tracemalloc.start()
+        try:
+            run_iteration(timer, base_cfg, sizes, design_size, batch_size, seed + warmup + iterations,
+                          txt2img_func, out_dir, blob_store)
+        finally:
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return summarize(timer)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the template -> design pipeline")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma separated canvas sizes to render the template at")
+    parser.add_argument("--design-size", type=int, default=512, help="Canvas size of the designed images")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--txt2img", default=None, metavar="MODULE:FUNCTION",
+                        help="txt2img stand-in, called with the API request dict (default: mock_txt2img)")
+    parser.add_argument("--json", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=1.5,
+                        help="Fail if a stage's median is slower than the baseline's by this factor")
+    args = parser.parse_args(argv)
+
+    txt2img_func = load_txt2img_func(args.txt2img) if args.txt2img else mock_txt2img
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    summary = run_benchmark(args.iterations, args.warmup, sizes, args.design_size, args.batch_size, args.seed,
+                            txt2img_func)
+    print(format_summary(summary))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=4)
+
+    if args.baseline:
+        regressions = compare_to_baseline(summary, json.load(open(args.baseline, "r")), args.max_slowdown)
+        for msg in regressions:
+            print("Regression: %s" % msg)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
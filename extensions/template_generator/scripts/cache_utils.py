@@ -0,0 +1,72 @@
+"""
+Bounded in-memory LRU cache, for the caches of rendered templates and the data derived from them.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LruCache(object):
+    """
+    Thread-safe LRU cache, bounded by the total cost of its entries. Least recently used entries are evicted once
+    the total exceeds 'max_cost'.
+    The cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_cost, cost_func=None, cost_name="bytes"):
+        """
+        @param cost_func: Returns the cost of a value, e.g. its size in bytes. None - every entry costs 1, so
+                          'max_cost' is the max number of entries
+        @param cost_name: What the cost is, for naming it in stats()
+        """
+        self.max_cost = max_cost
+        self.cost_func = cost_func
+        self.cost_name = cost_name if cost_func is not None else "entries"
+        self.hits = 0
+        self.misses = 0
+        self._cost = 0
+        self._entries = OrderedDict()  # key -> (value, cost)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Returns whether the value was added. It isn't if the key is already cached, or if it costs more than the
+        whole cache (as it would evict everything else)
+        """
+        cost = self.cost_func(value) if self.cost_func is not None else 1
+        with self._lock:
+            if key in self._entries or cost > self.max_cost:
+                return False
+            self._entries[key] = (value, cost)
+            self._cost += cost
+            while self._cost > self.max_cost:
+                _key, (_value, old_cost) = self._entries.popitem(last=False)
+                self._cost -= old_cost
+        return True
+
+    def stats(self):
+        with self._lock:
+            res = {"entries": len(self._entries)}
+            if self.cost_name != "entries":
+                res[self.cost_name] = self._cost
+            res["max_" + self.cost_name] = self.max_cost
+            res["hits"] = self.hits
+            res["misses"] = self.misses
+            return res
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._cost = 0
@@ -0,0 +1,330 @@
+"""
+Persistent SQLite index of the saved wheel templates and designs, so they can be listed and searched without
+scanning and parsing the saved dirs on every refresh.
+The index is kept up to date incrementally - by indexing each dir when it's saved, and by rescans that re-read
+only dirs whose mtime has changed.
+It also holds the perceptual hashes of the designed images (See phash.py), for finding near-duplicate designs.
+"""
+import os
+import re
+import json
+import sqlite3
+import threading
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate
+
+
+SCHEMA_VERSION = 2
+CATALOG_DB_NAME = "catalog.sqlite3"  # Name of the index file under the output dir
+DEFAULT_PAGE_SIZE = 15
+
+TEMPLATES = "templates"
+DESIGNS = "designs"
+KINDS = [TEMPLATES, DESIGNS]
+# Name of the JSON file describing each kind of saved dir
+JSON_FNAMES = {TEMPLATES: "wheel.json", DESIGNS: "design.json"}
+
+SPEC_COLUMNS = [arg for arg in WheelTemplate.ALL_ARGS if arg != "canvas_size"] + ["canvas_width", "canvas_height"]
+COVERAGE_COLUMNS = ["coverage", "rim_coverage", "hub_coverage", "spokes_coverage"]
+ATTR_COLUMNS = ["program_project", "model_year", "author", "tags", "name_plate", "sub_model"]
+# Columns that can be queried by range, and that are searched for text, per kind
+NUMERIC_COLUMNS = {
+    TEMPLATES: ["mtime"] + SPEC_COLUMNS + COVERAGE_COLUMNS,
+    DESIGNS: ["mtime"] + SPEC_COLUMNS + COVERAGE_COLUMNS + ["image_count"],
+}
+TEXT_COLUMNS = {
+    TEMPLATES: ["dir"],
+    DESIGNS: ["dir"] + ATTR_COLUMNS + ["prompt"],
+}
+
+_QUERY_RANGE_RE = re.compile(r"^(\w+):(\S+)$")
+_INT64_RANGE = 1 << 64  # SQLite integers are signed 64-bit, so hashes with the top bit set are stored negative
+
+
+def parse_query(query):
+    """
+    Parse a search string of space separated terms. A term is either "<column>:<value>", "<column>:<min>..<max>"
+    (where either bound may be omitted), or a word to search for in the text columns.
+    Returns (list of words, dict of column -> (min or None, max or None))
+    """
+    words = []
+    ranges = {}
+    for term in (query or "").split():
+        m = _QUERY_RANGE_RE.match(term)
+        if m is None:
+            words.append(term)
+            continue
+        column, value = m.groups()
+        low, high = value.split("..", 1) if ".." in value else (value, value)
+        try:
+            low = float(low) if low else None
+            high = float(high) if high else None
+        except ValueError:
+            raise Exception("Invalid value in search term '%s'" % term) from None
+        ranges[column] = (low, high)
+    return words, ranges
+
+
+def _spec_values(specs):
+    values = {arg: specs.get(arg, None) for arg in SPEC_COLUMNS}
+    canvas_size = specs.get("canvas_size", None) or (None, None)
+    values["canvas_width"], values["canvas_height"] = canvas_size
+    return values
+
+
+def _coverage_values(specs, areas=None):
+    if areas is None:
+        try:
+            areas = WheelTemplate(**specs).calc_areas()
+        except Exception:
+            areas = {}
+    return {k: areas.get(k, None) for k in COVERAGE_COLUMNS}
+
+
+def _template_row(cfg):
+    specs = cfg["specs"]
+    row = _spec_values(specs)
+    row.update(_coverage_values(specs, cfg.get("geometry", None)))
+    return row
+
+
+def _design_row(cfg):
+    specs = cfg["template_specs"]
+    design_cfg = cfg.get("design", {})
+    attr_cfg = design_cfg.get("attr", {})
+    row = _spec_values(specs)
+    row.update(_coverage_values(specs))
+    row.update({k: attr_cfg.get(k, None) for k in ATTR_COLUMNS})
+    row["prompt"] = design_cfg.get("render", {}).get("prompt", None)
+    # Both the current and the base64 embedding design formats
+    images = design_cfg.get("images", None) or design_cfg.get("png_raw_b64_list", None) or []
+    row["image_count"] = len([image for image in images if image])
+    # Designs saved before the hashes were added have none. They're backfilled into the catalog (See
+    # set_design_phashes()), and those hashes are kept when the design is re-read
+    phashes = [(index, int(image["phash"], 16)) for index, image in enumerate(images)
+               if isinstance(image, dict) and image.get("phash", None)]
+    row["phashes"] = phashes or None
+    return row
+
+
+def _to_int64(phash):
+    return phash - _INT64_RANGE if phash >= _INT64_RANGE // 2 else phash
+
+
+def _from_int64(value):
+    return value + _INT64_RANGE if value < 0 else value
+
+
+class Catalog(object):
+    """
+    Index of the saved dirs under the templates and designs dirs.
+    Safe to use from multiple threads.
+    """
+    _ROW_FUNCS = {TEMPLATES: _template_row, DESIGNS: _design_row}
+
+    def __init__(self, db_path, templates_dir, designs_dir):
+        self.db_path = db_path
+        self.base_dirs = {TEMPLATES: templates_dir, DESIGNS: designs_dir}
+        self._lock = threading.Lock()
+        # Incremented on every change of the design hashes, so indexes built from them know when they're stale
+        self.phash_version = 0
+        # Incremented when design hashes are removed or replaced. Otherwise the changes only add hashes, which
+        # design_phashes() can return alone
+        self.phash_removals = 0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                # It's only an index of the saved dirs, so just rebuild it
+                for kind in KINDS + ["scans", "design_phashes"]:
+                    self._conn.execute("DROP TABLE IF EXISTS %s" % kind)
+            for kind in KINDS:
+                columns = ["dir TEXT PRIMARY KEY"]
+                columns += ["%s REAL" % c for c in NUMERIC_COLUMNS[kind]]
+                columns += ["%s TEXT" % c for c in TEXT_COLUMNS[kind] if c != "dir"]
+                self._conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (kind, ", ".join(columns)))
+                self._conn.execute("CREATE INDEX IF NOT EXISTS %s_mtime ON %s (mtime)" % (kind, kind))
+            # mtime of each base dir at its last scan
+            self._conn.execute("CREATE TABLE IF NOT EXISTS scans (kind TEXT PRIMARY KEY, mtime REAL)")
+            # Perceptual hash of each designed image. NULL for images that couldn't be hashed
+            self._conn.execute("CREATE TABLE IF NOT EXISTS design_phashes (dir TEXT, image INTEGER, phash INTEGER)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS design_phashes_dir ON design_phashes (dir)")
+            self._conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def _read_row(self, kind, dirname, mtime):
+        # Returns the row of a saved dir, or None if it isn't a valid one
+        json_fpath = os.path.join(self.base_dirs[kind], dirname, JSON_FNAMES[kind])
+        try:
+            with open(json_fpath, "r") as f:
+                row = self._ROW_FUNCS[kind](json.load(f))
+        except Exception:
+            return None
+        row["dir"] = dirname
+        row["mtime"] = mtime
+        return row
+
+    def _upsert(self, kind, row):
+        phashes = row.pop("phashes", None)
+        columns = list(row.keys())
+        self._conn.execute("INSERT OR REPLACE INTO %s (%s) VALUES (%s)" % (
+            kind, ", ".join(columns), ", ".join("?" * len(columns))), [row[c] for c in columns])
+        if phashes is not None:
+            self._replace_phashes(row["dir"], phashes)
+
+    def _replace_phashes(self, dirname, phashes):
+        values = sorted([(index, None if phash is None else _to_int64(phash)) for index, phash in phashes],
+                        key=lambda value: value[0])
+        old_values = self._conn.execute("SELECT image, phash FROM design_phashes WHERE dir = ? ORDER BY image",
+                                        (dirname,)).fetchall()
+        if old_values == values:
+            return
+        if old_values:
+            self._conn.execute("DELETE FROM design_phashes WHERE dir = ?", (dirname,))
+            self.phash_removals += 1
+        self._conn.executemany("INSERT INTO design_phashes (dir, image, phash) VALUES (?, ?, ?)",
+                               [(dirname, index, value) for index, value in values])
+        self.phash_version += 1
+
+    def _delete(self, kind, dirnames):
+        self._conn.executemany("DELETE FROM %s WHERE dir = ?" % kind, [(d,) for d in dirnames])
+        if kind == DESIGNS and dirnames:
+            cursor = self._conn.executemany("DELETE FROM design_phashes WHERE dir = ?", [(d,) for d in dirnames])
+            if cursor.rowcount > 0:
+                self.phash_removals += 1
+                self.phash_version += 1
+
+    def update(self, kind, dirname):
+        """
+        (Re)index a single saved dir, e.g. right after saving it. Removes it from the index if it's gone.
+        """
+        dirpath = os.path.join(self.base_dirs[kind], dirname)
+        row = self._read_row(kind, dirname, os.stat(dirpath).st_mtime) if os.path.isdir(dirpath) else None
+        with self._lock, self._conn:
+            if row is None:
+                self._delete(kind, [dirname])
+            else:
+                self._upsert(kind, row)
+
+    def rescan(self, full=False):
+        """
+        Bring the index up to date with the saved dirs, re-reading only the dirs whose mtime has changed.
+        @param full: If False, a base dir is skipped altogether when its own mtime hasn't changed since its last
+                     scan (i.e. no dir was added or removed). Changes inside existing dirs are found only by
+                     full scans.
+        Returns the number of (re)indexed and removed dirs
+        """
+        changes = 0
+        for kind in KINDS:
+            base_dir = self.base_dirs[kind]
+            if not os.path.isdir(base_dir):
+                continue
+            base_mtime = os.stat(base_dir).st_mtime
+            with self._lock:
+                scanned = self._conn.execute("SELECT mtime FROM scans WHERE kind = ?", (kind,)).fetchone()
+                if not full and scanned is not None and scanned[0] == base_mtime:
+                    continue
+                known = dict(self._conn.execute("SELECT dir, mtime FROM %s" % kind).fetchall())
+
+            rows = []
+            present = set()
+            with os.scandir(base_dir) as it:
+                for entry in it:
+                    if not entry.is_dir():
+                        continue
+                    mtime = entry.stat().st_mtime
+                    present.add(entry.name)
+                    if known.get(entry.name, None) == mtime:
+                        continue
+                    row = self._read_row(kind, entry.name, mtime)
+                    if row is not None:
+                        rows.append(row)
+            removed = [dirname for dirname in known if dirname not in present]
+
+            with self._lock, self._conn:
+                for row in rows:
+                    self._upsert(kind, row)
+                self._delete(kind, removed)
+                self._conn.execute("INSERT OR REPLACE INTO scans (kind, mtime) VALUES (?, ?)", (kind, base_mtime))
+            changes += len(rows) + len(removed)
+        return changes
+
+    def query(self, kind, words=None, ranges=None, limit=DEFAULT_PAGE_SIZE, offset=0):
+        """
+        Find saved dirs, most recent first.
+        @param words: Words that must all appear (case insensitive) in any of the kind's TEXT_COLUMNS
+        @param ranges: Dict of column (of the kind's NUMERIC_COLUMNS) -> (min or None, max or None), inclusive
+        @param limit, offset: The page of results to return
+        Returns (list of row dicts, total number of matches)
+        """
+        where = []
+        params = []
+        for word in words or []:
+            where.append("(%s)" % " OR ".join("%s LIKE ? ESCAPE '\\'" % c for c in TEXT_COLUMNS[kind]))
+            pattern = "%%%s%%" % re.sub(r"([%_\\])", r"\\\1", word)
+            params += [pattern] * len(TEXT_COLUMNS[kind])
+        for column, (low, high) in (ranges or {}).items():
+            if column not in NUMERIC_COLUMNS[kind]:
+                raise Exception("Can't search by '%s'. Use one of: %s" % (column, ", ".join(NUMERIC_COLUMNS[kind])))
+            if low is not None:
+                where.append("%s >= ?" % column)
+                params.append(low)
+            if high is not None:
+                where.append("%s <= ?" % column)
+                params.append(high)
+        where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM %s%s" % (kind, where_sql), params).fetchone()[0]
+            cursor = self._conn.execute("SELECT * FROM %s%s ORDER BY mtime DESC LIMIT ? OFFSET ?" % (kind, where_sql),
+                                        params + [limit, offset])
+            columns = [d[0] for d in cursor.description]
+            rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+        return rows, total
+
+    def search(self, kind, query="", limit=DEFAULT_PAGE_SIZE, offset=0):
+        """
+        Like query(), with a search string as parsed by parse_query()
+        """
+        words, ranges = parse_query(query)
+        return self.query(kind, words, ranges, limit, offset)
+
+    def design_phashes(self, after_rowid=0):
+        """
+        Returns list of (row id, design dir, image index, perceptual hash) of the hashed designed images, in the
+        order they were added
+        @param after_rowid: Only the hashes added after the one with this row id. As long as phash_removals is
+                            unchanged, these are all the hashes added since
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT rowid, dir, image, phash FROM design_phashes "
+                                      "WHERE phash IS NOT NULL AND rowid > ? ORDER BY rowid", (after_rowid,)).fetchall()
+        return [(rowid, dirname, index, _from_int64(value)) for rowid, dirname, index, value in rows]
+
+    def dirs_missing_phashes(self):
+        """
+        Returns list of the design dirs with images that weren't hashed yet (See set_design_phashes())
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT dir FROM designs WHERE image_count > "
+                                      "(SELECT COUNT(*) FROM design_phashes p WHERE p.dir = designs.dir)").fetchall()
+        return [row[0] for row in rows]
+
+    def set_design_phashes(self, dirname, phashes):
+        """
+        @param phashes: List of (image index, perceptual hash or None if the image couldn't be hashed)
+        """
+        with self._lock, self._conn:
+            self._replace_phashes(dirname, phashes)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,175 @@
+import itertools
+from math import ceil, floor
+import numpy as np
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate, WheelTemplateBatch
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate, WheelTemplateBatch
+
+
+# Search range of every parameter that affects the coverage area. Same ranges as the UI sliders.
+PARAM_BOUNDS = dict(
+    rim_diameter=(10.0, 50.0),
+    rim_width=(0.1, 49.0),
+    hub_diameter=(5.0, 48.0),
+    hub_width=(1.0, 47.0),
+    lug_nut_count=(3, 9),
+    lug_nut_diameter=(0.6, 4.0),
+    bolt_circle_diameter=(2.0, 40.0),
+    spoke_count=(3, 9),
+    spoke_central_angle=(5.0, 70.0),
+)
+
+GRID_SAMPLES = 64  # Samples per continuous parameter range, used for bracketing the roots
+MAX_ITERATIONS = 60  # Bisection iterations. Each one halves the bracket
+TOLERANCE = 1e-9  # Coverage error under which a template is considered to meet the target exactly
+
+
+def _int_values(bounds):
+    lo, hi = bounds
+    return np.arange(int(ceil(lo)), int(floor(hi)) + 1, dtype=np.float64)
+
+
+def _coverage_error(columns, targets):
+    """
+    Returns (coverage - target, valid mask) for every row
+    """
+    batch = WheelTemplateBatch(**columns)
+    coverage = batch.calc_areas(rounded=False)["coverage"] / 100.0
+    return coverage - targets, batch.valid_mask()
+
+
+def solve_coverage(wt, targets=None, free_params=("spoke_central_angle", "spoke_count", "rim_width"),
+                   bounds=None, max_results=5):
+    """
+    Find the valid templates nearest to 'wt' whose coverage area meets the required one.
+    Integer parameters (counts) in 'free_params' are enumerated over their range, and for each of their
+    combinations every continuous parameter in 'free_params' is solved for (the others keep the value of 'wt')
+    using the closed-form area model and bracketed root-finding. Solutions that break any geometry constraint
+    are dropped, and the rest are ranked by their normalized distance from 'wt'.
+    Without continuous free parameters the target usually can't be met exactly, so the closest coverages win.
+    All targets are solved together in one batch.
+    @param wt: Base WheelTemplate
+    @param targets: Required coverage area (in range [0, 1]), or a sequence of them. None - use
+                    wt.required_coverage_area
+    @param free_params: Names of the parameters that may vary, out of PARAM_BOUNDS
+    @param bounds: Dict of (min, max) overriding PARAM_BOUNDS for some parameters
+    @param max_results: Max number of templates to return per target
+    Returns list of WheelTemplate, nearest first, with required_coverage_area set to the target. For a
+    sequence of targets, returns one such list per target.
+    """
+    assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
+    if targets is None:
+        targets = wt.required_coverage_area
+    single_target = np.ndim(targets) == 0
+    targets = np.atleast_1d(np.asarray(targets, dtype=np.float64))
+    if not np.all((0 <= targets) & (targets <= 1.0)):
+        raise Exception("Required coverage area must be in range [0, 1]")
+
+    all_bounds = dict(PARAM_BOUNDS)
+    all_bounds.update(bounds or {})
+    for arg in free_params:
+        if arg not in PARAM_BOUNDS:
+            raise Exception("'%s' can't be solved for, it must be one of: %s" % (arg, ", ".join(PARAM_BOUNDS)))
+    int_params = [arg for arg in free_params if arg in WheelTemplateBatch.INT_ARGS]
+    root_params = [arg for arg in free_params if arg not in WheelTemplateBatch.INT_ARGS] or [None]
+
+    # One row per (target, combination of integer values, parameter to solve for)
+    # (With no integer params, a single empty combination)
+    combos = list(itertools.product(*[_int_values(all_bounds[arg]) for arg in int_params]))
+    combos = np.array(combos, dtype=np.float64).reshape(len(combos), len(int_params))
+    t_idx, c_idx, r_idx = [a.ravel() for a in np.meshgrid(np.arange(len(targets)), np.arange(len(combos)),
+                                                          np.arange(len(root_params)), indexing="ij")]
+    n_rows = len(t_idx)
+    row_targets = targets[t_idx]
+
+    base = wt.to_dict()
+    columns = {arg: np.full(n_rows, value, dtype=np.float64) for arg, value in base.items() if arg != "canvas_size"}
+    columns["canvas_size"] = np.tile(np.asarray(base["canvas_size"], dtype=np.float64), (n_rows, 1))
+    columns["required_coverage_area"] = row_targets
+    for i, arg in enumerate(int_params):
+        columns[arg] = combos[c_idx, i]
+
+    # Per row range of the solved parameter
+    lo = np.zeros(n_rows)
+    hi = np.zeros(n_rows)
+    for i, arg in enumerate(root_params):
+        if arg is not None:
+            rows = r_idx == i
+            lo[rows], hi[rows] = all_bounds[arg]
+
+    def with_roots(cols, rows, values):
+        # Copy of the given rows of 'cols', with the solved parameter of each row set to 'values'
+        res = {arg: col[rows] for arg, col in cols.items()}
+        for i, arg in enumerate(root_params):
+            if arg is not None:
+                sel = r_idx[rows] == i
+                res[arg] = res[arg].copy()
+                res[arg][sel] = values[sel]
+        return res
+
+    # --- Bracketing: sample each range and find the sign changes of (coverage - target) between valid samples ---
+    n_samples = GRID_SAMPLES if root_params[0] is not None else 1
+    fractions = np.linspace(0.0, 1.0, n_samples)
+    xs = lo[:, None] + (hi - lo)[:, None] * fractions[None, :]
+    sample_rows = np.repeat(np.arange(n_rows), n_samples)
+    f, valid = _coverage_error(with_roots(columns, sample_rows, xs.ravel()), row_targets[sample_rows])
+    f = f.reshape(n_rows, n_samples)
+    valid = valid.reshape(n_rows, n_samples)
+
+    base_x = np.array([base[root_params[i]] if root_params[i] is not None else 0.0 for i in r_idx])
+    if n_samples > 1:
+        brackets = valid[:, :-1] & valid[:, 1:] & (np.sign(f[:, :-1]) * np.sign(f[:, 1:]) <= 0)
+        # Prefer the bracket nearest the current value
+        dist = np.abs((xs[:, :-1] + xs[:, 1:]) / 2 - base_x[:, None])
+        dist[~brackets] = np.inf
+        best = np.argmin(dist, axis=1)
+        found = np.isfinite(dist[np.arange(n_rows), best])
+        rows = np.flatnonzero(found)
+        best = best[rows]
+        a, b = xs[rows, best], xs[rows, best + 1]
+        fa = f[rows, best]
+
+        # --- Bisection, for all rows at once ---
+        for _ in range(MAX_ITERATIONS):
+            m = (a + b) / 2
+            fm, _valid = _coverage_error(with_roots(columns, rows, m), row_targets[rows])
+            same_side = np.sign(fm) == np.sign(fa)
+            a = np.where(same_side, m, a)
+            fa = np.where(same_side, fm, fa)
+            b = np.where(same_side, b, m)
+        roots = (a + b) / 2
+    else:
+        rows = np.flatnonzero(valid[:, 0])
+        roots = np.zeros(len(rows))
+
+    # --- Final check of every constraint, and ranking ---
+    final = with_roots(columns, rows, roots)
+    batch = WheelTemplateBatch(**final)
+    err = np.abs(batch.calc_areas(rounded=False)["coverage"] / 100.0 - row_targets[rows])
+    ok = batch.valid_mask()
+    distance = np.zeros(len(rows))
+    for arg in free_params:
+        lo_arg, hi_arg = all_bounds[arg]
+        distance += np.abs(final[arg] - base[arg]) / (hi_arg - lo_arg)
+
+    results = [[] for _ in targets]
+    seen = [set() for _ in targets]
+    err_rank = np.where(err <= TOLERANCE, 0.0, err)
+    for i in np.lexsort((distance, err_rank)):
+        if not ok[i]:
+            continue
+        ti = t_idx[rows[i]]
+        if len(results[ti]) >= max_results:
+            continue
+        candidate = batch.template(i)
+        key = tuple(sorted((k, str(v)) for k, v in candidate.to_dict().items()))
+        if key in seen[ti]:
+            continue
+        seen[ti].add(key)
+        results[ti].append(candidate)
+
+    return results[0] if single_target else results
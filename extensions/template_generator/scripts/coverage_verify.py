@@ -0,0 +1,178 @@
+import numpy as np
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate, WheelTemplateBatch, WheelTemplateRenderer
+    from image_utils import cairo_image_surface_to_numpy
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate, WheelTemplateBatch, WheelTemplateRenderer
+    from scripts.image_utils import cairo_image_surface_to_numpy
+
+
+DEFAULT_TOLERANCE = 0.5  # Max allowed deviation between analytic and measured coverage, in percentage points
+SOLID_ALPHA_THRESHOLD = 128  # Pixels at least this opaque count as solid in the "solid_pixels" measurement
+MONTE_CARLO_SAMPLES = 4096
+MONTE_CARLO_REJECT_ERRORS = 4  # Standard errors beyond the tolerance, for a template's estimate to clearly fail
+MONTE_CARLO_CHUNK_ELEMENTS = 1 << 22  # Max (templates x samples) evaluated at once
+
+COVERAGE_KEYS = ["coverage", "rim_coverage", "hub_coverage", "spokes_coverage"]
+# Component drawn by each WheelTemplateRenderer._draw_<name>() method, and its coverage key
+COMPONENTS = [
+    ("rim", "rim_coverage"),
+    ("hub_and_lug_nuts", "hub_coverage"),
+    ("spokes", "spokes_coverage"),
+]
+
+
+def _analytic_coverage(batch):
+    areas = batch.calc_areas(rounded=False)
+    return {k: areas[k] for k in COVERAGE_KEYS}
+
+
+def _wheel_mask(renderer, shape):
+    # Pixels whose centers are inside the wheel (rim) circle
+    h, w = shape
+    rx = renderer.rim_radius * renderer._x_pixels_per_inch
+    ry = renderer.rim_radius * renderer._y_pixels_per_inch
+    ys = (np.arange(h) + 0.5 - h / 2.0) / ry
+    xs = (np.arange(w) + 0.5 - w / 2.0) / rx
+    return ys[:, None] ** 2 + xs[None, :] ** 2 <= 1.0
+
+
+def _render_component_alpha(renderer, name):
+    surface = renderer._create_image_surface(mask=True)
+    renderer._create_context(surface)
+    getattr(renderer, "_draw_" + name)()
+    return cairo_image_surface_to_numpy(surface)[:, :, 0]
+
+
+def measure_raster_coverage(wt):
+    """
+    Render each wheel component to an A8 surface and measure its coverage of the wheel circle.
+    Returns dict with:
+        "raster" - Coverage figures (like calc_areas(), in %) from the anti-aliased alpha of the pixels
+        "solid_pixels" - Same, counting only pixels that are at least SOLID_ALPHA_THRESHOLD opaque
+    """
+    assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
+    renderer = WheelTemplateRenderer(wt)
+    renderer._prepare_render()
+
+    raster = {}
+    solid = {}
+    union = None
+    wheel_mask = None
+    for name, key in COMPONENTS:
+        alpha = _render_component_alpha(renderer, name)
+        if wheel_mask is None:
+            wheel_mask = _wheel_mask(renderer, alpha.shape)
+            n_pixels = np.count_nonzero(wheel_mask)
+        inside = alpha[wheel_mask]
+        raster[key] = 100.0 * inside.sum(dtype=np.int64) / (255.0 * n_pixels)
+        solid[key] = 100.0 * np.count_nonzero(inside >= SOLID_ALPHA_THRESHOLD) / n_pixels
+        union = inside.astype(np.uint16) if union is None else np.maximum(union, inside)
+
+    # Components may share anti-aliased edge pixels, so the total is measured on their union
+    raster["coverage"] = 100.0 * union.sum(dtype=np.int64) / (255.0 * n_pixels)
+    solid["coverage"] = 100.0 * np.count_nonzero(union >= SOLID_ALPHA_THRESHOLD) / n_pixels
+    return {"raster": raster, "solid_pixels": solid}
+
+
+def verify_coverage(wt, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare the analytic coverage of a template (calc_areas()) with the coverage measured on its rendered pixels.
+    Returns dict with the "analytic", "raster" and "solid_pixels" figures (in %), the "deviation" of the raster
+    figures from the analytic ones (in percentage points), its "max_deviation", and "ok" - whether it's within
+    'tolerance'.
+    """
+    res = measure_raster_coverage(wt)
+    analytic = {k: float(v[0]) for k, v in _analytic_coverage(WheelTemplateBatch.from_templates([wt])).items()}
+    deviation = {k: res["raster"][k] - analytic[k] for k in COVERAGE_KEYS}
+    max_deviation = max(abs(v) for v in deviation.values())
+    res.update({
+        "analytic": analytic,
+        "deviation": deviation,
+        "max_deviation": max_deviation,
+        "ok": max_deviation <= tolerance,
+    })
+    return res
+
+
+def _angular_distance(angles, init_angle, count):
+    # Degrees from each angle to the nearest of 'count' evenly spread items, starting at -init_angle
+    # (The renderer places item i at -(init_angle + i * 360 / count))
+    step = 360.0 / count
+    rel = np.mod(-angles - init_angle, step)
+    return np.minimum(rel, step - rel)
+
+
+def monte_carlo_coverage(batch, samples=MONTE_CARLO_SAMPLES, seed=0):
+    """
+    Fast estimation of the coverage figures of many templates, by classifying random points of the wheel circle
+    against the actual shapes (rather than the closed-form area model).
+    The same points (relative to the rim radius) are used for all templates.
+    @param batch: WheelTemplateBatch
+    Returns dict of arrays of the coverage figures (in %), and "std_error" - the standard error of the
+    "coverage" estimates
+    """
+    assert isinstance(batch, WheelTemplateBatch), "'batch' must be instance of WheelTemplateBatch'"
+    rng = np.random.default_rng(seed)
+    # Uniform over the unit disk
+    rel_r = np.sqrt(rng.random(samples))
+    theta = rng.random(samples) * 360.0
+    theta_rad = np.radians(theta)
+
+    n = len(batch)
+    res = {k: np.empty(n) for k in COVERAGE_KEYS}
+    rows_per_chunk = max(1, MONTE_CARLO_CHUNK_ELEMENTS // samples)
+    for start in range(0, n, rows_per_chunk):
+        rows = slice(start, min(n, start + rows_per_chunk))
+
+        def col(values):
+            return values[rows][:, None]
+
+        r = col(batch.rim_radius) * rel_r[None, :]
+        rim = r >= col(batch.rim_inner_radius)
+
+        nut_count = col(batch.lug_nut_count)
+        nut_da = np.radians(_angular_distance(theta[None, :], col(batch.lug_nuts_init_angle), nut_count))
+        bcr = col(batch.bolt_circle_radius)
+        nut_dist2 = r ** 2 + bcr ** 2 - 2 * r * bcr * np.cos(nut_da)
+        in_nut = nut_dist2 < col(batch.lug_nut_radius) ** 2
+        hub = (r >= col(batch.hub_inner_radius)) & (r <= col(batch.hub_radius)) & ~in_nut
+
+        spoke_da = _angular_distance(theta[None, :], col(batch.spokes_init_angle), col(batch.spoke_count))
+        spokes = (r > col(batch.hub_radius)) & (r < col(batch.rim_inner_radius)) & \
+                 (spoke_da <= col(batch.spoke_central_angle) / 2.0)
+
+        res["rim_coverage"][rows] = rim.mean(axis=1) * 100
+        res["hub_coverage"][rows] = hub.mean(axis=1) * 100
+        res["spokes_coverage"][rows] = spokes.mean(axis=1) * 100
+        res["coverage"][rows] = (rim | hub | spokes).mean(axis=1) * 100
+
+    p = res["coverage"] / 100
+    res["std_error"] = np.sqrt(p * (1 - p) / samples) * 100
+    return res
+
+
+def verify_coverage_batch(batch, tolerance=DEFAULT_TOLERANCE, samples=MONTE_CARLO_SAMPLES, seed=0):
+    """
+    verify_coverage() of many templates at once.
+    The Monte-Carlo estimate (See monte_carlo_coverage()) only screens out the templates that clearly fail: those
+    whose estimated coverage deviates from the analytic one by more than 'tolerance' plus
+    MONTE_CARLO_REJECT_ERRORS standard errors. Its standard error is far above a tolerance of a fraction of a
+    percentage point (about 0.8 points at 4096 samples), so it can't pass a template. The rest are measured on
+    their rendered pixels, exactly as verify_coverage() does.
+    Returns (bool array - which templates are ok, array of "coverage" deviations in percentage points, as
+             measured on the pixels, or as estimated for the screened out templates)
+    """
+    estimated = monte_carlo_coverage(batch, samples, seed)
+    analytic = _analytic_coverage(batch)
+    deviation = estimated["coverage"] - analytic["coverage"]
+    ok = np.zeros(len(batch), dtype=bool)
+    candidates = np.abs(deviation) <= tolerance + MONTE_CARLO_REJECT_ERRORS * estimated["std_error"]
+    for i in np.flatnonzero(candidates).tolist():
+        res = verify_coverage(batch.template(i), tolerance)
+        ok[i] = res["ok"]
+        deviation[i] = res["deviation"]["coverage"]
+    return ok, deviation
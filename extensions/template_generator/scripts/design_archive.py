@@ -0,0 +1,445 @@
+"""
+Saved wheel designs.
+
+A design dir holds a small design.json, its template.json and a design.zip for download. The images themselves
+are stored once, in a content-addressed BlobStore shared by all designs, and design.json refers to them by SHA-256:
+    {
+        "format_version": 2,
+        "template_specs": {...},
+        "template_image": {"sha256": "<hex>", "name": "template.png"} or null,
+        "design": {
+            "attr": {...},
+            "render": {...},
+            "images": [{"sha256": "<hex>", "name": "design_0.png", "phash": "<hex>"} or null, ...]
+        }
+    }
+The "phash" of a designed image is its 64-bit perceptual hash (See phash.py), for finding near-duplicate designs.
+Designs saved before it was added don't have it, and their hashes are computed from the images when first needed.
+design.json files of format version 1 (no "format_version") embed the images as base64 PNG instead
+("template_raw_b64" and design "png_raw_b64_list"), and are upgraded on load.
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+from io import BytesIO
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from base64 import b64decode
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate
+    from image_utils import image_file_as_png_bytes, atomic_output_path
+    from metrics import g_metrics
+    from phash import phash_file, phash_to_hex, phash_from_hex, unique_indices
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate
+    from scripts.image_utils import image_file_as_png_bytes, atomic_output_path
+    from scripts.metrics import g_metrics
+    from scripts.phash import phash_file, phash_to_hex, phash_from_hex, unique_indices
+
+
+DESIGN_FORMAT_VERSION = 2
+DESIGN_JSON = "design.json"  # Name of JSON file containing final wheel design, which also includes template configuration
+TEMPLATE_JSON = "template.json"
+TEMPLATE_PNG = "template.png"
+DESIGN_PNG_FMT = "design_%d.png"
+DESIGN_ZIP = "design.zip"
+BLOBS_DIR_NAME = "blobs"  # Dir under the output dir for the BlobStore
+COPY_CHUNK_SIZE = 1 << 20
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+SAVE_WORKERS = 8  # Threads for hashing/converting the images of a saved design
+# Compression of design archive entries by file extension. PNGs are already compressed
+ZIP_COMPRESSION = {".png": ZIP_STORED, ".json": ZIP_DEFLATED}
+ZIP_DEFAULT_COMPRESSION = ZIP_DEFLATED
+DEFAULT_ZIP_COMPRESSLEVEL = 6  # zlib's default
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of PNG files. Each distinct content is stored once, as <root>/<ab>/<sha256>.png,
+    where <ab> are the first 2 hex digits of its SHA-256. Files are written atomically and never modified.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def path(self, sha256):
+        return os.path.join(self.root_dir, sha256[:2], sha256 + ".png")
+
+    def has(self, sha256):
+        return os.path.isfile(self.path(sha256))
+
+    def put_bytes(self, data):
+        """
+        Returns the SHA-256 of the data
+        """
+        return self.put_stream(BytesIO(data))
+
+    def put_file(self, fpath, link=False):
+        """
+        @param link: Hardlink the file into the store when possible, rather than copying it. Only for files owned
+                     by the extension, that are never modified or deleted by anyone else afterwards (Not e.g. gradio's
+                     temp or upload files)
+        Returns the SHA-256 of the file content
+        """
+        if not link:
+            with open(fpath, "rb") as f:
+                return self.put_stream(f)
+
+        h = hashlib.sha256()
+        with open(fpath, "rb") as f:
+            while True:
+                chunk = f.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+        sha256 = h.hexdigest()
+        blob_fpath = self.path(sha256)
+        if os.path.isfile(blob_fpath):
+            return sha256
+        os.makedirs(os.path.dirname(blob_fpath), exist_ok=True)
+        tmp_fpath = "%s.%s.tmp" % (blob_fpath, os.urandom(4).hex())
+        try:
+            os.link(fpath, tmp_fpath)
+        except OSError:
+            # E.g. another file system, or no hardlink support
+            with open(fpath, "rb") as f:
+                return self.put_stream(f)
+        os.replace(tmp_fpath, blob_fpath)
+        return sha256
+
+    def put_stream(self, f):
+        """
+        Store the content of a file object, hashing it while copying it to a temp file next to the blobs,
+        so it's never held in memory as a whole.
+        Returns its SHA-256
+        """
+        os.makedirs(self.root_dir, exist_ok=True)
+        h = hashlib.sha256()
+        fd, tmp_fpath = tempfile.mkstemp(dir=self.root_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = f.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    tmp.write(chunk)
+            sha256 = h.hexdigest()
+            fpath = self.path(sha256)
+            if os.path.isfile(fpath):
+                os.remove(tmp_fpath)
+            else:
+                os.makedirs(os.path.dirname(fpath), exist_ok=True)
+                os.replace(tmp_fpath, fpath)
+        except BaseException:
+            if os.path.isfile(tmp_fpath):
+                os.remove(tmp_fpath)
+            raise
+        return sha256
+
+
+def is_png_file(fpath):
+    with open(fpath, "rb") as f:
+        return f.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+
+
+def _put_image_file(blob_store, link, fpath):
+    # PNG files are stored as they are. Only other formats are decoded and re-encoded
+    if is_png_file(fpath):
+        return blob_store.put_file(fpath, link)
+    return blob_store.put_bytes(image_file_as_png_bytes(fpath))
+
+
+def image_ref(sha256, name, phash=None):
+    ref = {"sha256": sha256, "name": name}
+    if phash is not None:
+        ref["phash"] = phash_to_hex(phash)
+    return ref
+
+
+def image_ref_phash(ref):
+    """
+    Returns the perceptual hash (int) of an image reference, or None if it has none
+    """
+    if not ref or not ref.get("phash", None):
+        return None
+    return phash_from_hex(ref["phash"])
+
+
+def resolve_image_path(ref, blob_store):
+    """
+    Returns the path of the image file of an image reference, or None if there's no such image
+    """
+    if not ref or not blob_store.has(ref["sha256"]):
+        return None
+    return blob_store.path(ref["sha256"])
+
+
+def upgrade_design_cfg(full_cfg, blob_store):
+    """
+    Convert a design config of format version 1 (base64 embedded images) to the current version, moving its
+    images to the blob store. Configs of the current version are returned as is.
+    """
+    version = full_cfg.get("format_version", 1)
+    if version == DESIGN_FORMAT_VERSION:
+        return full_cfg
+    if version != 1:
+        raise Exception("Unsupported design format version: %s" % str(version))
+
+    template_raw_b64 = full_cfg.pop("template_raw_b64", None)
+    full_cfg["template_image"] = None
+    if template_raw_b64:
+        full_cfg["template_image"] = image_ref(blob_store.put_bytes(b64decode(template_raw_b64)), TEMPLATE_PNG)
+
+    design_cfg = full_cfg.setdefault("design", {})
+    images = []
+    for index, png_raw_b64 in enumerate(design_cfg.pop("png_raw_b64_list", None) or []):
+        ref = None
+        if png_raw_b64:
+            ref = image_ref(blob_store.put_bytes(b64decode(png_raw_b64)), DESIGN_PNG_FMT % index)
+        images.append(ref)
+    design_cfg["images"] = images
+    full_cfg["format_version"] = DESIGN_FORMAT_VERSION
+    return full_cfg
+
+
+def _import_zip_images(z, full_cfg, blob_store):
+    # Move images of the archive that aren't in the blob store yet into it, without decoding them
+    refs = [full_cfg.get("template_image", None)] + full_cfg.get("design", {}).get("images", [])
+    names = set(z.namelist())
+    for ref in refs:
+        if not ref or blob_store.has(ref["sha256"]) or ref["name"] not in names:
+            continue
+        with z.open(ref["name"], "r") as f:
+            sha256 = blob_store.put_stream(f)
+        if sha256 != ref["sha256"]:
+            raise Exception("Content of '%s' doesn't match its SHA-256 in %s" % (ref["name"], DESIGN_JSON))
+
+
+def read_design_filedata(filedata, blob_store):
+    """
+    Parse a design, given as the content of a design.json file, or of a ZIP file that contains it (e.g. design.zip).
+    Images referred to by the design are imported to the blob store, unless they are already there.
+    Returns the design config, in the current format version
+    """
+    assert filedata is not None
+    if isinstance(filedata, bytes) and filedata.startswith(b"PK"):
+        with ZipFile(BytesIO(filedata), "r") as z:
+            full_cfg = upgrade_design_cfg(json.loads(z.read(DESIGN_JSON).decode()), blob_store)
+            _import_zip_images(z, full_cfg, blob_store)
+        return full_cfg
+    if isinstance(filedata, bytes):
+        filedata = filedata.decode()
+    return upgrade_design_cfg(json.loads(filedata), blob_store)
+
+
+class _ChunkSink(object):
+    """
+    Unseekable file object that collects what's written to it until it's taken, for streaming a ZipFile
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _open_zip_entry(z, name, compress_type):
+    if compress_type == ZIP_DEFAULT_COMPRESSION:
+        # Opened by name, the entry gets the archive's compression method and level
+        return z.open(name, "w")
+    zinfo = ZipInfo(name, time.localtime()[:6])
+    zinfo.compress_type = compress_type
+    return z.open(zinfo, "w")
+
+
+def iter_zip_stream(entries, compression=None, compresslevel=None):
+    """
+    Generator of the bytes of a ZIP archive, produced as its entries are read, so neither the archive nor the
+    file entries are ever held in memory as a whole.
+    @param entries: Iterable of (name in the archive, bytes or path of the file to read)
+    @param compression: Dict of file extension -> zipfile compression method. Default: ZIP_COMPRESSION
+    @param compresslevel: Of the entries compressed with ZIP_DEFAULT_COMPRESSION (0-9). None - zlib's default
+    """
+    compression = ZIP_COMPRESSION if compression is None else compression
+    sink = _ChunkSink()
+    with ZipFile(sink, "w", ZIP_DEFAULT_COMPRESSION, compresslevel=compresslevel) as z:
+        for name, src in entries:
+            compress_type = compression.get(os.path.splitext(name)[1].lower(), ZIP_DEFAULT_COMPRESSION)
+            with _open_zip_entry(z, name, compress_type) as zf:
+                if isinstance(src, (bytes, bytearray)):
+                    zf.write(src)
+                else:
+                    with open(src, "rb") as f:
+                        while True:
+                            chunk = f.read(COPY_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            zf.write(chunk)
+                            yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+
+def write_zip_file(zip_fpath, entries, compression=None, compresslevel=None):
+    """
+    Write a ZIP archive with iter_zip_stream(). It's written aside and then moved, so readers never see a
+    partial file
+    """
+    with atomic_output_path(zip_fpath) as tmp_fpath, open(tmp_fpath, "wb") as f:
+        for data in iter_zip_stream(entries, compression, compresslevel):
+            f.write(data)
+    return zip_fpath
+
+
+def _template_json_bytes(template_specs):
+    # As written by wheel_geometry.save_wheel_json()
+    return json.dumps({"specs": template_specs}, indent=4).encode()
+
+
+def design_zip_entries(full_cfg, blob_store, prefix=""):
+    """
+    The entries of the archive of a design (See iter_zip_stream()): template.json, the images, and design.json
+    @param prefix: Prefix of the entry names, e.g. a dir name for archives of several designs
+    """
+    entries = [(prefix + TEMPLATE_JSON, _template_json_bytes(full_cfg["template_specs"]))]
+    for ref in [full_cfg.get("template_image", None)] + full_cfg["design"].get("images", []):
+        if ref and blob_store.has(ref["sha256"]):
+            entries.append((prefix + ref["name"], blob_store.path(ref["sha256"])))
+    entries.append((prefix + DESIGN_JSON, json.dumps(full_cfg, indent=4).encode()))
+    return entries
+
+
+def read_design_dir(dirpath, blob_store):
+    """
+    Returns the config of a saved design dir, in the current format version
+    """
+    with open(os.path.join(dirpath, DESIGN_JSON), "r") as f:
+        return upgrade_design_cfg(json.load(f), blob_store)
+
+
+def iter_designs_zip_stream(designs_dir, dirnames, blob_store, compression=None, compresslevel=None):
+    """
+    Generator of the bytes of a ZIP archive of several saved designs, each in a dir named as its design dir.
+    Only one design is read at a time. Dirs that aren't valid designs are skipped.
+    """
+    def entries():
+        for dirname in dirnames:
+            try:
+                full_cfg = read_design_dir(os.path.join(designs_dir, dirname), blob_store)
+            except Exception as e:
+                print("Skipping design '%s' in export: %s" % (dirname, str(e)))
+                continue
+            for entry in design_zip_entries(full_cfg, blob_store, dirname + "/"):
+                yield entry
+
+    return iter_zip_stream(entries(), compression, compresslevel)
+
+
+def save_design(dirpath, blob_store, wt, template_png, designed_image_fpaths, attr_dict, render_dict,
+                dedup_radius=None, link_images=False):
+    """
+    Save a design to a new dir, with its images in the blob store.
+    @param template_png: PNG bytes of the template image
+    @param designed_image_fpaths: List of paths of the designed image files. A path may be None for a missing image
+    @param dedup_radius: If not None, designed images whose perceptual hash is within this Hamming distance of an
+                         earlier image's are dropped, and not saved at all
+    @param link_images: Hardlink the designed PNG files into the blob store (See BlobStore.put_file()), rather than
+                        copying them. Only if the extension owns the files
+    Returns (path of design.json, path of design.zip, number of dropped near-duplicate images)
+    """
+    assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
+    os.makedirs(dirpath)
+    template_json = _template_json_bytes(wt.to_dict())
+    with open(os.path.join(dirpath, TEMPLATE_JSON), "wb") as f:
+        f.write(template_json)
+
+    num_dropped = 0
+    with g_metrics.span("save_blobs"):
+        template_ref = image_ref(blob_store.put_bytes(template_png), TEMPLATE_PNG)
+        fpaths = [fpath for fpath in designed_image_fpaths if fpath is not None]
+        if fpaths:
+            # Hashing, decoding and converting release the GIL
+            with ThreadPoolExecutor(max_workers=min(SAVE_WORKERS, len(fpaths))) as executor:
+                with g_metrics.span("phash"):
+                    phashes = dict(zip(fpaths, executor.map(phash_file, fpaths)))
+                if dedup_radius is not None:
+                    kept = unique_indices([phashes[fpath] for fpath in fpaths], dedup_radius)
+                    num_dropped = len(fpaths) - len(kept)
+                    fpaths = [fpaths[i] for i in kept]
+                    designed_image_fpaths = [fpath for fpath in designed_image_fpaths
+                                             if fpath is None or fpath in fpaths]
+                sha256s = dict(zip(fpaths, executor.map(partial(_put_image_file, blob_store, link_images), fpaths)))
+        images = []
+        for index, fpath in enumerate(designed_image_fpaths):
+            ref = None
+            if fpath is not None:
+                ref = image_ref(sha256s[fpath], DESIGN_PNG_FMT % index, phashes[fpath])
+            images.append(ref)
+
+    full_cfg = {
+        "format_version": DESIGN_FORMAT_VERSION,
+        "template_specs": wt.to_dict(),
+        "template_image": template_ref,
+        "design": {
+            "attr": attr_dict,
+            "render": render_dict,
+            "images": images,
+        },
+    }
+    design_json = json.dumps(full_cfg, indent=4).encode()
+    d_json_fpath = os.path.join(dirpath, DESIGN_JSON)
+    with open(d_json_fpath, "wb") as f:
+        f.write(design_json)
+
+    # The JSON entries come from memory, and the images are copied from the blob store
+    entries = [(TEMPLATE_JSON, template_json)]
+    entries += [(ref["name"], blob_store.path(ref["sha256"])) for ref in [template_ref] + images if ref is not None]
+    entries.append((DESIGN_JSON, design_json))
+    with g_metrics.span("zip_write"):
+        zip_fpath = write_zip_file(os.path.join(dirpath, DESIGN_ZIP), entries)
+    return d_json_fpath, zip_fpath, num_dropped
+
+
+def backfill_design_phashes(catalog, designs_dir, blob_store):
+    """
+    Compute the perceptual hashes of the images of saved designs that don't have them in their design.json (e.g.
+    saved before they were added), and add them to the catalog. The design dirs aren't modified.
+    Returns the number of designs updated
+    """
+    count = 0
+    for dirname in catalog.dirs_missing_phashes():
+        try:
+            full_cfg = read_design_dir(os.path.join(designs_dir, dirname), blob_store)
+        except Exception as e:
+            print("Skipping design '%s' in hashing: %s" % (dirname, str(e)))
+            continue
+        phashes = []
+        for index, ref in enumerate(full_cfg["design"].get("images", [])):
+            if not ref:
+                continue
+            phash = image_ref_phash(ref)
+            fpath = resolve_image_path(ref, blob_store)
+            if phash is None and fpath is not None:
+                phash = phash_file(fpath)
+            # None is recorded too, for images missing from the blob store, so they aren't looked for again
+            phashes.append((index, phash))
+        catalog.set_design_phashes(dirname, phashes)
+        count += 1
+    return count
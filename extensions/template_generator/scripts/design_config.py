@@ -0,0 +1,144 @@
+"""
+Cached loading of the base and user default wheel designs (base_design.json and user_default.json).
+A config file is parsed once and re-read only when its mtime or size changes, and values derived from it (e.g. the
+initial template image) are cached along with it. Callers get copy-on-write views of the cached config, which they
+may modify without affecting the cache or each other, without deep-copying it on every use.
+"""
+import os
+import json
+import threading
+from collections.abc import Mapping, MutableMapping
+
+
+class CowDict(MutableMapping):
+    """
+    Copy-on-write view of a dict that is never modified. Reads go to the shared dict, and writes only to this view.
+    Nested dicts are returned as views of their own, and lists as shallow copies, made on first access.
+    """
+
+    def __init__(self, shared):
+        self._shared = shared
+        self._own = {}
+        self._deleted = set()
+
+    def __getitem__(self, key):
+        if key in self._own:
+            return self._own[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        value = self._shared[key]
+        if isinstance(value, dict):
+            value = self._own[key] = CowDict(value)
+        elif isinstance(value, list):
+            value = self._own[key] = list(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._own[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._own.pop(key, None)
+        if key in self._shared:
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self._own or (key in self._shared and key not in self._deleted)
+
+    def __iter__(self):
+        for key in self._shared:
+            if key not in self._deleted:
+                yield key
+        for key in self._own:
+            if key not in self._shared:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _key in self)
+
+    def to_dict(self):
+        """
+        Returns a plain (deep) copy, e.g. for JSON serialization
+        """
+        return _to_plain(self)
+
+
+def _to_plain(value):
+    if isinstance(value, Mapping):
+        return {k: _to_plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+class CachedJsonConfig(object):
+    """
+    A JSON config file, parsed (and post-processed by 'load_func') only when it changed since it was last read
+    """
+
+    def __init__(self, fpath, load_func=None):
+        """
+        @param load_func: Called with the parsed JSON, returns the config to cache. It may modify its argument
+        """
+        self.fpath = fpath
+        self.load_func = load_func
+        self.loads = 0
+        self._stamp = None
+        self._cfg = None
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        st = os.stat(self.fpath)
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self):
+        # Must be called with the lock held
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        with open(self.fpath, "r") as f:
+            cfg = json.load(f)
+        if self.load_func is not None:
+            cfg = self.load_func(cfg)
+        self._cfg = cfg
+        # load_func may have rewritten the file
+        self._stamp = self._file_stamp()
+        self._derived = {}
+        self.loads += 1
+
+    def exists(self):
+        return os.path.isfile(self.fpath)
+
+    def get(self):
+        """
+        Returns a copy-on-write view of the config
+        """
+        with self._lock:
+            self._load()
+            return CowDict(self._cfg)
+
+    def get_shared(self):
+        """
+        Returns the cached config itself, which must not be modified
+        """
+        with self._lock:
+            self._load()
+            return self._cfg
+
+    def derived(self, name, func):
+        """
+        Returns func(config), computed once per version of the config file. The result is shared and must not be
+        modified
+        """
+        with self._lock:
+            self._load()
+            if name not in self._derived:
+                self._derived[name] = func(self._cfg)
+            return self._derived[name]
+
+    def invalidate(self):
+        with self._lock:
+            self._stamp = None
@@ -0,0 +1,234 @@
+import time
+import uuid
+import threading
+from collections import deque, OrderedDict
+
+try:
+    # For standalone mode
+    from metrics import g_metrics
+except ImportError:
+    # For 'webui' mode
+    from scripts.metrics import g_metrics
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+FINISHED_JOB_STATUSES = (JOB_DONE, JOB_CANCELLED, JOB_FAILED)
+
+DEFAULT_CHUNK_SIZE = 4  # Images generated per call, so they can be delivered as they complete
+MAX_FINISHED_JOBS = 32  # Finished jobs kept for status queries
+PROGRESS_POLL_INTERVAL = 0.5  # Seconds
+
+
+class DesignJob(object):
+    """
+    A queued generation of designed wheel images. Its attributes are updated by the DesignJobQueue worker.
+    """
+
+    def __init__(self, generate_func, total, chunk_size=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.total = total
+        self.chunk_size = chunk_size
+        self.status = JOB_QUEUED
+        self.images = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0  # Incremented on every change
+        self.chunk_images = 0  # Number of images of the chunk being generated
+        self._generate_func = generate_func
+        self._cancel_requested = False
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_JOB_STATUSES
+
+
+class DesignJobQueue(object):
+    """
+    FIFO queue of design jobs, run one at a time by a worker thread (as they all share the GPU).
+    Each job is generated in chunks of up to 'chunk_size' images, which are added to the job as they complete.
+    """
+
+    def __init__(self, progress_func=None, interrupt_func=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        @param progress_func: Returns the progress (0 to 1) of the running generation call, or None if unknown
+        @param interrupt_func: Interrupts the running generation call
+        """
+        self.progress_func = progress_func
+        self.interrupt_func = interrupt_func
+        self.chunk_size = chunk_size
+        self._pending = deque()
+        self._jobs = OrderedDict()  # job id -> job, in submission order
+        self._running = None
+        self._worker = None
+        self._cond = threading.Condition()
+
+    def submit(self, generate_func, total, chunk_size=None):
+        """
+        Queue a job.
+        @param generate_func: Called as generate_func(start, n) to generate the n images that follow the first
+            'start' ones. Returns list of images
+        @param total: Number of images to generate
+        @param chunk_size: Images per call of this job, instead of the queue's
+        Returns the DesignJob
+        """
+        job = DesignJob(generate_func, total, chunk_size)
+        with self._cond:
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._forget_finished_jobs()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name="design-jobs", daemon=True)
+                self._worker.start()
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id, None)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job, or interrupt a running one. Images completed so far are kept.
+        Returns False if there's no such unfinished job
+        """
+        with self._cond:
+            job = self._jobs.get(job_id, None)
+            if job is None or job.is_finished:
+                return False
+            job._cancel_requested = True
+            if job.status == JOB_QUEUED:
+                self._pending.remove(job)
+                self._finish(job, JOB_CANCELLED)
+                return True
+        if self.interrupt_func is not None:
+            self.interrupt_func()
+        return True
+
+    def position(self, job):
+        """
+        Returns the number of jobs that will run before the given queued job
+        """
+        with self._cond:
+            if job.status != JOB_QUEUED:
+                return 0
+            return list(self._pending).index(job) + (1 if self._running is not None else 0)
+
+    def progress(self, job):
+        """
+        Returns the progress of a job (0 to 1)
+        """
+        if job.is_finished:
+            return 1.0
+        done = len(job.images)
+        if job.status == JOB_RUNNING and self.progress_func is not None:
+            try:
+                done += (self.progress_func() or 0) * job.chunk_images
+            except Exception:
+                pass
+        return min(1.0, float(done) / max(1, job.total))
+
+    def status_text(self, job):
+        if job.status == JOB_QUEUED:
+            return "Job %s is queued, %d job(s) ahead" % (job.id, self.position(job))
+        text = "Job %s %s: %d/%d images" % (job.id, job.status, len(job.images), job.total)
+        if job.status == JOB_RUNNING:
+            text += " (%d%%)" % round(self.progress(job) * 100)
+        elif job.finished is not None and job.started is not None:
+            text += " in %.1fs" % (job.finished - job.started)
+        if job.error:
+            text += ". %s" % job.error
+        return text
+
+    def follow(self, job, poll_interval=PROGRESS_POLL_INTERVAL):
+        """
+        Generator that yields the job whenever it changes, and at least every 'poll_interval' seconds
+        while it's unfinished (for the progress). The last yield is of the finished job.
+        """
+        version = -1
+        while True:
+            with self._cond:
+                if job.version == version and not job.is_finished:
+                    self._cond.wait(poll_interval)
+                version = job.version
+                finished = job.is_finished
+            yield job
+            if finished:
+                return
+
+    def stats(self):
+        with self._cond:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _changed(self, job):
+        # Must be called with the lock held
+        job.version += 1
+        self._cond.notify_all()
+
+    def _finish(self, job, status, error=None):
+        # Must be called with the lock held
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        job.chunk_images = 0
+        job._generate_func = None
+        self._changed(job)
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.is_finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.popleft()
+                self._running = job
+                job.status = JOB_RUNNING
+                job.started = time.time()
+                self._changed(job)
+            g_metrics.record("design_job_wait", job.started - job.created)
+            try:
+                with g_metrics.trace("design_job"):
+                    self._run(job)
+            finally:
+                with self._cond:
+                    self._running = None
+                    self._cond.notify_all()
+
+    def _run(self, job):
+        try:
+            while len(job.images) < job.total:
+                with self._cond:
+                    if job._cancel_requested:
+                        self._finish(job, JOB_CANCELLED)
+                        return
+                    job.chunk_images = min(job.chunk_size or self.chunk_size, job.total - len(job.images))
+                    self._changed(job)
+                images = job._generate_func(len(job.images), job.chunk_images)
+                with self._cond:
+                    if job._cancel_requested:
+                        # The chunk was interrupted, so its images are unfinished
+                        self._finish(job, JOB_CANCELLED)
+                        return
+                    if not images:
+                        raise Exception("No images were generated")
+                    job.images = job.images + list(images)[:job.chunk_images]
+                    self._changed(job)
+            with self._cond:
+                self._finish(job, JOB_DONE)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            with self._cond:
+                self._finish(job, JOB_FAILED, "Error with image renderer: %s" % (str(e) or str(type(e))))
@@ -0,0 +1,273 @@
+import io
+import base64
+from math import ceil, sqrt
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+try:
+    # For standalone mode
+    from image_utils import pil_image_to_png_bytes
+    from hint_maps import g_hint_cache, hint_type_for_module, HINT_MODULE
+    from metrics import g_metrics
+except ImportError:
+    # For 'webui' mode
+    from scripts.image_utils import pil_image_to_png_bytes
+    from scripts.hint_maps import g_hint_cache, hint_type_for_module, HINT_MODULE
+    from scripts.metrics import g_metrics
+
+
+TXT2IMG_MODE_IN_PROCESS = "In-process"
+TXT2IMG_MODE_REMOTE = "Remote API"
+TXT2IMG_MODES = [TXT2IMG_MODE_IN_PROCESS, TXT2IMG_MODE_REMOTE]
+DEFAULT_REMOTE_URL = "http://localhost:7860"
+TXT2IMG_API_PATH = "/sdapi/v1/txt2img"
+PROGRESS_API_PATH = "/sdapi/v1/progress"
+OPTIONS_API_PATH = "/sdapi/v1/options"
+INTERRUPT_API_PATH = "/sdapi/v1/interrupt"
+STATUS_API_TIMEOUT = 5  # Seconds
+HTTP_POOL_SIZE = 8
+MAX_RUN_PIXELS = 1024 * 1024  # Canvas size of a multi-template generation, in which the templates are tiled
+MAX_GRID_ASPECT = 2  # Of the grid of tiled templates
+MAX_PROCESSOR_RES = 2048
+
+# Same order as ControlNet's ControlMode enum, whose index the remote API expects
+CONTROL_MODES = ["Balanced", "My prompt is more important", "ControlNet is more important"]
+
+_g_http_session = None
+_g_http_session_lock = threading.Lock()
+
+
+def remove_newlines(s):
+    return s.replace("\r", "").replace("\n", "")
+
+
+def build_txt2img_request(design_inputs):
+    """
+    Build the generation parameters of a wheel design.
+    Returns (txt2img params, as in the /sdapi/v1/txt2img API, ControlNet unit params without the input image)
+    """
+    # Basic render params
+    prompt = remove_newlines(design_inputs.get("prompt", "No entry sign"))
+    width = design_inputs.get("canvas_width", 256)
+    height = design_inputs.get("canvas_height", 256)
+    batch_size = design_inputs.get("batch_size")
+    creativity = design_inputs.get("creativity")
+
+    sampler_index = design_inputs.get("sampler_index", 0)
+    steps = design_inputs.get("steps", 20)
+    seed = int(design_inputs.get("seed", -1))
+
+    # Advanced render params
+    neg_prompt = remove_newlines(design_inputs.get("neg_prompt", "No entry sign"))
+    prompt_shadow = remove_newlines(design_inputs.get("prompt_shadow", ""))
+    neg_prompt_shadow = remove_newlines(design_inputs.get("neg_prompt_shadow", ""))
+
+    txt2img_params = {
+        "enable_hr": False,
+        "denoising_strength": 0,
+        "firstphase_width": 0,
+        "firstphase_height": 0,
+        "prompt": "%s %s" % (prompt, prompt_shadow),
+        "styles": [],
+        "seed": seed,
+        "subseed": -1,
+        "subseed_strength": 0,
+        "seed_resize_from_h": -1,
+        "seed_resize_from_w": -1,
+        "batch_size": batch_size,
+        "n_iter": 1,
+        "steps": steps,
+        "cfg_scale": creativity,
+        "width": width,
+        "height": height,
+        "restore_faces": False,
+        "tiling": False,
+        "negative_prompt": "%s %s" % (neg_prompt, neg_prompt_shadow),
+        "eta": 0,
+        "s_churn": 0,
+        "s_tmax": 0,
+        "s_tmin": 0,
+        "s_noise": 1,
+        "sampler_index": sampler_index,
+    }
+
+    # Advanced ControlNet render params
+    cn_params = {
+        "enabled": design_inputs.get("cn_enabled", True),
+        "lowvram": design_inputs.get("lowvram", False),
+        "pixel_perfect": design_inputs.get("pixel_perfect", False),
+
+        "module": design_inputs.get("module", None),
+        "model": design_inputs.get("model", None),
+
+        "guidance_start": design_inputs.get("guidance_start", 0),
+        "guidance_end": design_inputs.get("guidance_end", 1),
+        "weight": design_inputs.get("weight", 1.0),
+
+        "processor_res": design_inputs.get("processor_res", 512),
+        "threshold_a": design_inputs.get("threshold_a", 64.0),
+        "threshold_b": design_inputs.get("threshold_b", 64.0),
+
+        "control_mode": design_inputs.get("control_mode", CONTROL_MODES[0]),
+        "resize_mode": design_inputs.get("resize_mode", None),
+    }
+    return txt2img_params, cn_params
+
+
+def apply_precomputed_hint(wt, txt2img_params, cn_params):
+    """
+    If the ControlNet preprocessor has a hint map that can be computed from the template geometry, get it
+    (cached) and switch the preprocessor to HINT_MODULE, as the hint map replaces its output.
+    Returns the hint map as PIL image, or None if the template image should be sent as is
+    """
+    hint_type = hint_type_for_module(cn_params["module"])
+    if hint_type is None:
+        return None
+    resolution = cn_params["processor_res"]
+    if cn_params["pixel_perfect"]:
+        resolution = min(txt2img_params["width"], txt2img_params["height"])
+    with g_metrics.span("hint_map"):
+        hint = g_hint_cache.get_hint(wt, hint_type, int(resolution))
+    cn_params["module"] = HINT_MODULE
+    return hint
+
+
+def templates_per_run(tile_width, tile_height):
+    """
+    Returns the number of templates whose designs fit in a single generation, as tiles of the canvas
+    """
+    return max(1, MAX_RUN_PIXELS // int(tile_width * tile_height))
+
+
+def template_grid(count):
+    """
+    Returns (columns, rows) of the grid with 'count' tiles that has the fewest unused tiles, and is the most square
+    of those. Its aspect ratio is at most MAX_GRID_ASPECT.
+    """
+    candidates = []
+    for cols in range(1, count + 1):
+        rows = int(ceil(count / float(cols)))
+        if max(cols, rows) <= MAX_GRID_ASPECT * min(cols, rows):
+            candidates.append((cols * rows - count, abs(cols - rows), cols, rows))
+    if not candidates:
+        cols = int(ceil(sqrt(count)))
+        return cols, int(ceil(count / float(cols)))
+    _unused, _diff, cols, rows = min(candidates)
+    return cols, rows
+
+
+def pack_template_tiles(images, grid):
+    """
+    Tile the ControlNet input images of several templates (all of the same size and mode) into one image, in
+    row-major order. Unused tiles are left black (or transparent).
+    """
+    cols, rows = grid
+    tile_w, tile_h = images[0].size
+    packed = Image.new(images[0].mode, (tile_w * cols, tile_h * rows))
+    for i, image in enumerate(images):
+        packed.paste(image, ((i % cols) * tile_w, (i // cols) * tile_h))
+    return packed
+
+
+def unpack_design_tiles(images, count, grid):
+    """
+    Cut the images generated from a pack_template_tiles() input back into the designs of each template.
+    Returns list of the designed images of each template, in the order of the packed templates
+    """
+    cols, rows = grid
+    res = [[] for _i in range(count)]
+    for image in images:
+        tile_w, tile_h = image.width // cols, image.height // rows
+        for i in range(count):
+            x, y = (i % cols) * tile_w, (i // cols) * tile_h
+            res[i].append(image.crop((x, y, x + tile_w, y + tile_h)))
+    return res
+
+
+def generated_images_only(images, txt2img_params):
+    # The results are followed by extras, such as ControlNet's detected maps
+    return images[:txt2img_params["batch_size"] * txt2img_params["n_iter"]]
+
+
+def _get_http_session():
+    global _g_http_session
+    with _g_http_session_lock:
+        if _g_http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _g_http_session = session
+        return _g_http_session
+
+
+def build_txt2img_api_request(txt2img_params, cn_params, template_img):
+    """
+    Returns the body of a /sdapi/v1/txt2img request, with the template image as the ControlNet input
+    """
+    with g_metrics.span("png_encode"):
+        template_png = pil_image_to_png_bytes(template_img)
+    with g_metrics.span("base64_encode"):
+        template_img_b64 = base64.b64encode(template_png).decode('utf-8')
+    cn_args = dict(cn_params)
+    if cn_args["control_mode"] in CONTROL_MODES:
+        cn_args["control_mode"] = CONTROL_MODES.index(cn_args["control_mode"])
+    cn_args["input_image"] = template_img_b64
+
+    txt2img_req = dict(txt2img_params)
+    txt2img_req["alwayson_scripts"] = {"controlnet": {"args": [cn_args]}}
+    return txt2img_req
+
+
+def decode_txt2img_api_response(r, txt2img_params):
+    """
+    @param r: The parsed JSON of a /sdapi/v1/txt2img response
+    Returns list of PIL images
+    """
+    images = list()
+    with g_metrics.span("result_decode"):
+        for img in generated_images_only(r['images'], txt2img_params):
+            image = Image.open(io.BytesIO(base64.b64decode(img.split(",", 1)[0])))
+            # Decoded now rather than lazily, so it's timed here
+            image.load()
+            images.append(image)
+    return images
+
+
+def txt2img_remote(base_url, txt2img_params, cn_params, template_img, timeout=None):
+    """
+    Generate the designed wheel images through the txt2img API of a (possibly remote) WebUI
+    Returns list of PIL images
+    """
+    txt2img_req = build_txt2img_api_request(txt2img_params, cn_params, template_img)
+    with g_metrics.span("txt2img_http"):
+        res = _get_http_session().post(base_url.rstrip("/") + TXT2IMG_API_PATH, json=txt2img_req, timeout=timeout)
+        res.raise_for_status()
+        r = res.json()
+    return decode_txt2img_api_response(r, txt2img_params)
+
+
+def progress_remote(base_url):
+    """
+    Returns the progress (0 to 1) of the generation running on a (possibly remote) WebUI
+    """
+    res = _get_http_session().get(base_url.rstrip("/") + PROGRESS_API_PATH, params={"skip_current_image": True},
+                                  timeout=STATUS_API_TIMEOUT)
+    res.raise_for_status()
+    return res.json()["progress"]
+
+
+def interrupt_remote(base_url):
+    res = _get_http_session().post(base_url.rstrip("/") + INTERRUPT_API_PATH, timeout=STATUS_API_TIMEOUT)
+    res.raise_for_status()
+
+
+def remote_model_checkpoint(base_url):
+    """
+    Returns the title (name and hash) of the checkpoint loaded in a (possibly remote) WebUI
+    """
+    res = _get_http_session().get(base_url.rstrip("/") + OPTIONS_API_PATH, timeout=STATUS_API_TIMEOUT)
+    res.raise_for_status()
+    return res.json().get("sd_model_checkpoint", None)
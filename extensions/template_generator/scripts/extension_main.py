@@ -1,24 +1,44 @@
 import os
 import importlib
 from functools import partial
-import json
-import requests
-import io
-import base64
+import numpy as np
 from PIL import Image
 import PIL.ImageOps
+import gradio as gr
 
-from modules import script_callbacks
+import modules.scripts
+from modules import script_callbacks, shared
+from modules.call_queue import queue_lock
+from modules.processing import StableDiffusionProcessingTxt2Img, process_images
 from modules.paths import data_path
 from modules.scripts import basedir
 
-from scripts import gradio_ui, wheel_geometry, image_utils, controlnet_extracts
+from scripts import gradio_ui, wheel_geometry, image_utils, controlnet_extracts, coverage_solver, \
+    render_cache, hint_maps, design_pipeline, design_archive, catalog, \
+    thumbnails, rest_api, live_updates, design_jobs, result_cache, metrics, sweep, phash, \
+    design_config, cache_utils
 # import gradio_ui, wheel_geometry
 # Must reload all our internal modules when the WebUI reloads, and in reverse dependency order!
 
+metrics = importlib.reload(metrics)
+design_config = importlib.reload(design_config)
+cache_utils = importlib.reload(cache_utils)
 image_utils = importlib.reload(image_utils)
 controlnet_extracts = importlib.reload(controlnet_extracts)
 wheel_geometry = importlib.reload(wheel_geometry)
+coverage_solver = importlib.reload(coverage_solver)
+render_cache = importlib.reload(render_cache)
+result_cache = importlib.reload(result_cache)
+hint_maps = importlib.reload(hint_maps)
+design_pipeline = importlib.reload(design_pipeline)
+phash = importlib.reload(phash)
+design_archive = importlib.reload(design_archive)
+catalog = importlib.reload(catalog)
+thumbnails = importlib.reload(thumbnails)
+live_updates = importlib.reload(live_updates)
+rest_api = importlib.reload(rest_api)
+sweep = importlib.reload(sweep)
+design_jobs = importlib.reload(design_jobs)
 gradio_ui = importlib.reload(gradio_ui)
 
 
@@ -45,161 +65,311 @@ def on_ui_tabs():
     ui.render = partial(_gradio_blocks_render_patch_use_child_css, ui)
     return [(ui, "Wheel Power", "ford_template_generator_tab")]
 
-def remove_newlines(s):
-    return s.replace("\r", "").replace("\n", "")
+def _zip_compresslevel():
+    return int(shared.opts.data.get("wheel_power_zip_compresslevel", design_archive.DEFAULT_ZIP_COMPRESSLEVEL))
 
-def on_generate_designed_wheel(template_wheel_img, design_inputs):    
-    print(json.dumps(design_inputs, indent=1))
-    
-    # Basic render params
-    prompt = remove_newlines(design_inputs.get("prompt", "No entry sign"))
-    opts1 = list(map(str.lower, design_inputs.get("opts1", [])))
+def on_app_started(demo, app):
+    # Served with the WebUI API only, which has its own auth, as they expose all saved designs
+    if not shared.cmd_opts.api:
+        return
+    rest_api.mount_routes(app, gradio_ui.g_catalog,
+                          os.path.join(gradio_ui.g_output_dir_path, gradio_ui.TEMPLATES_DIR_NAME),
+                          os.path.join(gradio_ui.g_output_dir_path, gradio_ui.DESIGNS_DIR_NAME),
+                          gradio_ui.g_blob_store, shared.cmd_opts.api_auth, _zip_compresslevel)
+
+def on_ui_settings():
+    section = ("wheel_power", "Wheel Power")
+    shared.opts.add_option("wheel_power_txt2img_mode", shared.OptionInfo(
+        design_pipeline.TXT2IMG_MODE_IN_PROCESS, "Design generation mode", gr.Radio,
+        {"choices": design_pipeline.TXT2IMG_MODES}, section=section))
+    shared.opts.add_option("wheel_power_remote_url", shared.OptionInfo(
+        design_pipeline.DEFAULT_REMOTE_URL, "WebUI URL for the 'Remote API' generation mode", section=section))
+    shared.opts.add_option("wheel_power_precomputed_hints", shared.OptionInfo(
+        True, "Compute ControlNet hint maps (canny, scribble, seg) from the template geometry, "
+              "instead of running the preprocessor", section=section))
+    shared.opts.add_option("wheel_power_result_cache", shared.OptionInfo(
+        False, "Cache the generated designs on disk, and reuse them for repeated generations with a fixed seed "
+               "(in-process mode only)",
+        section=section))
+    shared.opts.add_option("wheel_power_result_cache_size_mb", shared.OptionInfo(
+        result_cache.DEFAULT_MAX_BYTES // (1024 * 1024), "Design cache size limit (MB)", gr.Number, section=section))
+    shared.opts.add_option("wheel_power_zip_compresslevel", shared.OptionInfo(
+        design_archive.DEFAULT_ZIP_COMPRESSLEVEL,
+        "Compression level of the ZIP archives exported over the API (0 - none, 9 - best; PNG images are always "
+        "stored as they are)", gr.Slider,
+        {"minimum": 0, "maximum": rest_api.MAX_ZIP_COMPRESSLEVEL, "step": 1}, section=section))
+    shared.opts.add_option("wheel_power_log_timings", shared.OptionInfo(
+        False, "Log the timings of the stages of every design generation to the console", section=section))
+
+def log_timings_sink(name, seconds, spans, error):
+    if shared.opts.data.get("wheel_power_log_timings", False):
+        print("[Wheel Power] %s" % metrics.format_trace(name, seconds, spans, error))
+
+def _txt2img_default_script_args(script_runner):
+    # Default values of the args of all scripts, just like the API builds them
+    global _g_txt2img_default_script_args
+    if _g_txt2img_default_script_args is None:
+        last_arg_index = 1
+        for script in script_runner.scripts:
+            if last_arg_index < script.args_to:
+                last_arg_index = script.args_to
+        script_args = [None] * last_arg_index
+        script_args[0] = 0
+        with gr.Blocks():  # Calling the scripts' ui functions without it throws errors
+            for script in script_runner.scripts:
+                if script.ui(script.is_img2img):
+                    ui_default_values = []
+                    for elem in script.ui(script.is_img2img):
+                        ui_default_values.append(elem.value)
+                    script_args[script.args_from:script.args_to] = ui_default_values
+        _g_txt2img_default_script_args = script_args
+    return list(_g_txt2img_default_script_args)
+
+_g_txt2img_default_script_args = None
+
+
+def txt2img_in_process(txt2img_params, cn_params, template_wheel_img):
+    """
+    Generate the designed wheel images directly in this WebUI process, with PIL images in and out
+    Returns (list of PIL images, whether the generation was interrupted or skipped, from any client)
+    """
+    script_runner = modules.scripts.scripts_txt2img
+    external_code = controlnet_extracts.controlnet_get_module("external_code")
+    cn_script = controlnet_extracts.controlnet_get_script()
+
+    cn_unit = external_code.ControlNetUnit(
+        enabled=cn_params["enabled"],
+        module=cn_params["module"],
+        model=cn_params["model"],
+        weight=cn_params["weight"],
+        image=np.array(template_wheel_img),
+        low_vram=cn_params["lowvram"],
+        processor_res=cn_params["processor_res"],
+        threshold_a=cn_params["threshold_a"],
+        threshold_b=cn_params["threshold_b"],
+        guidance_start=cn_params["guidance_start"],
+        guidance_end=cn_params["guidance_end"],
+        pixel_perfect=cn_params["pixel_perfect"],
+        control_mode=external_code.ControlMode(cn_params["control_mode"]),
+    )
+    if cn_params["resize_mode"]:
+        cn_unit.resize_mode = external_code.ResizeMode(cn_params["resize_mode"])
+
+    script_args = _txt2img_default_script_args(script_runner)
+    script_args[cn_script.args_from] = cn_unit
+
+    args = dict(txt2img_params)
+    args["sampler_name"] = args.pop("sampler_index")
+    with metrics.span("queue_lock_wait"):
+        queue_lock.acquire()
+    try:
+        p = StableDiffusionProcessingTxt2Img(sd_model=shared.sd_model, do_not_save_samples=True,
+                                             do_not_save_grid=True, **args)
+        p.scripts = script_runner
+        p.script_args = tuple(script_args)
+        p.outpath_grids = shared.opts.outdir_txt2img_grids
+        p.outpath_samples = shared.opts.outdir_txt2img_samples
+
+        shared.state.begin()
+        try:
+            with metrics.span("txt2img_in_process"):
+                processed = process_images(p)
+        finally:
+            # An interrupted generation still returns the partly denoised images. Taken before end() resets it
+            interrupted = shared.state.interrupted or shared.state.skipped
+            shared.state.end()
+            p.close()
+    finally:
+        queue_lock.release()
+
+    return design_pipeline.generated_images_only(processed.images, txt2img_params), interrupted
+
+
+def _remote_url():
+    if shared.opts.data.get("wheel_power_txt2img_mode", design_pipeline.TXT2IMG_MODE_IN_PROCESS) != \
+            design_pipeline.TXT2IMG_MODE_REMOTE:
+        return None
+    return shared.opts.data.get("wheel_power_remote_url", design_pipeline.DEFAULT_REMOTE_URL)
+
+
+def generation_progress():
+    """
+    Returns the progress (0 to 1) of the running designed wheel generation, or None if unknown
+    """
+    remote_url = _remote_url()
+    if remote_url is not None:
+        return design_pipeline.progress_remote(remote_url)
+    state = shared.state
+    if state.job_count <= 0:
+        return None
+    progress = state.job_no / state.job_count
+    if state.sampling_steps > 0:
+        progress += state.sampling_step / (state.sampling_steps * state.job_count)
+    return min(1.0, progress)
+
+
+def interrupt_generation():
+    remote_url = _remote_url()
+    if remote_url is not None:
+        design_pipeline.interrupt_remote(remote_url)
+    else:
+        shared.state.interrupt()
+
+
+def _model_hash(remote_url):
+    """
+    Returns an identifier of the loaded checkpoint, or None if unknown
+    """
+    if remote_url is not None:
+        return design_pipeline.remote_model_checkpoint(remote_url)
+    if shared.sd_model is None:
+        return None
+    info = shared.sd_model.sd_checkpoint_info
+    return getattr(info, "sha256", None) or getattr(shared.sd_model, "sd_model_hash", None) or info.title
+
+
+def _get_result_cache():
+    """
+    Returns the design result cache, or None if it's disabled
+    """
+    global _g_result_cache
+    if not shared.opts.data.get("wheel_power_result_cache", False):
+        return None
+    if _g_result_cache is None:
+        _g_result_cache = result_cache.DesignResultCache(
+            os.path.join(gradio_ui.g_output_dir_path, result_cache.RESULT_CACHE_DIR_NAME))
+        metrics.g_metrics.register_stats("result_cache", _g_result_cache.stats)
+    max_mb = shared.opts.data.get("wheel_power_result_cache_size_mb", result_cache.DEFAULT_MAX_BYTES // (1024 * 1024))
+    _g_result_cache.max_bytes = int(max_mb) * 1024 * 1024
+    return _g_result_cache
+
+_g_result_cache = None
+
+
+def on_generate_designed_wheel(template_wheel_img, design_inputs, wt=None):
+    """
+    @param wt: The WheelTemplate the template image was rendered from, or None for custom template images
+    """
+    with metrics.trace("design_generation"):
+        return _generate_designed_wheel(template_wheel_img, design_inputs, wt)
+
+
+def _generate_designed_wheel(template_wheel_img, design_inputs, wt):
     opts2 = list(map(str.lower, design_inputs.get("opts2", [])))
-    height = design_inputs.get("canvas_width", 256)
-    width = design_inputs.get("canvas_height", 256)
-    batch_size = design_inputs.get("batch_size")
-    creativity = design_inputs.get("creativity")
-    
-    sampler_index = design_inputs.get("sampler_index", 0)
-    steps = design_inputs.get("steps", 20)
-    
-    # Advanced render params
-    neg_prompt = remove_newlines(design_inputs.get("neg_prompt", "No entry sign"))
-    prompt_shadow = remove_newlines(design_inputs.get("prompt_shadow", ""))
-    neg_prompt_shadow = remove_newlines(design_inputs.get("neg_prompt_shadow", ""))
-    
-    # Advanced ControlNet render params
-    cn_enabled = design_inputs.get("cn_enabled", True)
-    lowvram = design_inputs.get("lowvram", False)
-    pixel_perfect = design_inputs.get("pixel_perfect", False)
-    
-    module = design_inputs.get("module", None)
-    model = design_inputs.get("model", None)    
-    weight = design_inputs.get("weight", 1.0)
-    guidance_start = design_inputs.get("guidance_start", 0)
-    guidance_end = design_inputs.get("guidance_end", 1)
-    processor_res = design_inputs.get("processor_res", 512)
-    threshold_a = design_inputs.get("threshold_a", 64.0)
-    threshold_b = design_inputs.get("threshold_b", 64.0)
-        
-    if 'invert template color' in opts2:
+    txt2img_params, cn_params = design_pipeline.build_txt2img_request(design_inputs)
+
+    hint = None
+    if wt is not None and shared.opts.data.get("wheel_power_precomputed_hints", True):
+        hint = design_pipeline.apply_precomputed_hint(wt, txt2img_params, cn_params)
+    if hint is not None:
+        # The hint maps don't depend on the template colors, so there's nothing to invert
+        template_wheel_img = hint
+    elif 'invert template color' in opts2:
         template_wheel_img = PIL.ImageOps.invert(template_wheel_img)
+    return _txt2img(txt2img_params, cn_params, template_wheel_img)
 
-    template_wheel_img_raw = image_utils.pil_image_to_png_bytes(template_wheel_img)
-    template_wheel_img_b64 = base64.b64encode(template_wheel_img_raw).decode('utf-8')
-
-    url_txt2img = "http://localhost:7860/sdapi/v1/txt2img"
-    txt2img_req = {
-        "enable_hr": False,
-        "denoising_strength": 0,
-        "firstphase_width": 0,
-        "firstphase_height": 0,
-        "prompt": "%s %s" % (prompt, prompt_shadow),
-        "styles": [],
-        "seed": -1,
-        "subseed": -1,
-        "subseed_strength": 0,
-        "seed_resize_from_h": -1,
-        "seed_resize_from_w": -1,
-        "batch_size": batch_size,
-        "n_iter": 1,
-        "steps": steps,
-        "cfg_scale": creativity,
-        "width": width,
-        "height": height,
-        "restore_faces": False,
-        "tiling": False,
-        "negative_prompt": "%s %s" % (neg_prompt, neg_prompt_shadow),
-        "eta": 0,
-        "s_churn": 0,
-        "s_tmax": 0,
-        "s_tmin": 0,
-        "s_noise": 1,
-        "sampler_index": sampler_index,
-        "alwayson_scripts": {
-            "controlnet": {
-                "args": [
-                    {
-                        "enabled": cn_enabled,
-                        "lowvram": lowvram,
-                        "pixel_perfect": pixel_perfect,
-                        
-                        "module": module,
-                        # "model": "control_v11p_sd15_canny [d14c016b]",
-                        "model": model,
-                        
-                        "guidance_start": guidance_start,
-                        "guidance_end": guidance_end,
-                        "weight": weight,
-                        
-                        "processor_res": processor_res,
-                        "threshold_a": threshold_a,
-                        "threshold_b": threshold_b,
-
-                        "control_mode": 0,
-                        
-                        "input_image": template_wheel_img_b64,                        
-                    }
-                ]
-            }
-        }
-    }
-    
-    print(json.dumps(txt2img_req, indent=1))
-    
-    if "mock" in opts2:
-        return test_create_random_images(template_wheel_img, batch_size)        
-    
-    res = requests.post(url_txt2img, json=txt2img_req)
-    r = res.json()
-    images = list()
-    for img in r['images']:
-        images.append(Image.open(io.BytesIO(base64.b64decode(img.split(",", 1)[0]))))
-    # img = r['images'][0]
-    # image = Image.open(io.BytesIO(base64.b64decode(img.split(",", 1)[0])))
-    return images[:len(images)-1]
-
-def test_create_random_images(template_wheel_img, n=1):
-    # print(template_wheel_img)
-    from PIL import Image, ImageDraw, ImageFont
-    import random
-    
-    # Define the size of the square image
-    image_size = 256
-    
-    # Create a new image with a white background
-    images = []
-    template_wheel_img2 = template_wheel_img.resize((image_size, image_size))
-    for i in range(n):
-        image = Image.new("RGB", (image_size, image_size), "white")
-        images.append(image)
-        # pixels = image.load()
-        
-        # # Add random noise to each pixel in the image
-        # for i in range(image_size):
-            # for j in range(image_size):
-                # # Generate random RGB values for each pixel
-                # red = random.randint(0, 255)
-                # green = random.randint(0, 255)
-                # blue = random.randint(0, 255)
-                # pixels[i, j] = (red, green, blue)
-                
-        image.paste(template_wheel_img2, (0, 0, image_size, image_size))
-        draw = ImageDraw.Draw(image) 
-        font = ImageFont.truetype(os.path.join(BASE_DIR, "ariblk.ttf"), 15)
-        from random import choice
-        rand_text = "".join([choice("abcdefghijklmnopqrstuvwxyz0123456789") for i in range(15)])
-          
-        # drawing text size
-        draw.text((5, 5), "%d %s" % (i, rand_text), font=font, align="left", fill="red")
 
+def _txt2img(txt2img_params, cn_params, template_wheel_img):
+    remote_url = _remote_url()
+    # Generations with a random seed are never repeated, so they aren't cached. Neither are remote ones, as there's
+    # no telling whether they were interrupted (by any client of the remote WebUI)
+    cache = _get_result_cache() if txt2img_params["seed"] != -1 and remote_url is None else None
+    cache_key = None
+    if cache is not None:
+        model_hash = _model_hash(remote_url)
+        if model_hash is not None:
+            with metrics.span("result_cache_get"):
+                cache_key = result_cache.generation_key(template_wheel_img, txt2img_params, cn_params, model_hash)
+                images = cache.get(cache_key)
+            if images is not None:
+                return images
+
+    interrupted = False
+    if remote_url is not None:
+        images = design_pipeline.txt2img_remote(remote_url, txt2img_params, cn_params, template_wheel_img)
+    else:
+        images, interrupted = txt2img_in_process(txt2img_params, cn_params, template_wheel_img)
+    if cache_key is not None and not interrupted and len(images) == txt2img_params["batch_size"]:
+        with metrics.span("result_cache_put"):
+            cache.put(cache_key, images)
     return images
 
 
+def on_generate_multi_template_designs(wts, design_inputs, tiled=False):
+    """
+    Generate the designs of several templates, with the same prompt and params.
+    @param wts: List of WheelTemplates
+    @param tiled: If False, each template gets a run of its own, exactly as a single template design, so the
+                  templates aren't batched together on the GPU. ControlNet takes a single input image for the whole
+                  batch (batch_size and n_iter alike), so templates can't be batch items with a hint each.
+                  If True, they share a single diffusion run: the templates are tiled into one canvas, and every
+                  generated image is cut back into the designs of each template (See
+                  design_pipeline.templates_per_run()). It's faster, but the model sees the whole grid, so the
+                  designs differ from single template ones.
+    Returns list of the designed images of each template
+    """
+    with metrics.trace("multi_template_generation"):
+        if tiled:
+            return _generate_tiled_template_designs(wts, design_inputs)
+        return [_generate_designed_wheel(_template_image(wt), design_inputs, wt) for wt in wts]
+
+
+def _template_image(wt, size=None):
+    """
+    Render a template just like the UI sends it: No alpha channel, so the shapes are on black background
+    @param size: (width, height) to render at, if not the template's canvas size
+    """
+    if size is None:
+        image, _areas = gradio_ui.g_render_cache.render(wt, alpha_channel=False)
+        return image
+    (image,), _areas = gradio_ui.g_render_cache.render_sizes(wt, [size], alpha_channel=False)
+    return image
+
+
+def _generate_tiled_template_designs(wts, design_inputs):
+    opts2 = list(map(str.lower, design_inputs.get("opts2", [])))
+    txt2img_params, cn_params = design_pipeline.build_txt2img_request(design_inputs)
+    tile_size = int(txt2img_params["width"]), int(txt2img_params["height"])
+    grid = design_pipeline.template_grid(len(wts))
+
+    use_hints = shared.opts.data.get("wheel_power_precomputed_hints", True)
+    tiles = []
+    hint = None
+    for wt in wts:
+        if use_hints:
+            # At the resolution of a single template, as it's a tile of the canvas. All templates use the same
+            # preprocessor, so they all get a hint map, or none
+            hint = design_pipeline.apply_precomputed_hint(wt, txt2img_params, dict(cn_params))
+        if hint is not None:
+            if hint.size != tile_size:
+                # Interpolating would blend the seg map's class colors into other classes, and blur the edges
+                hint = hint.resize(tile_size, Image.NEAREST)
+            tiles.append(hint)
+            continue
+        image = _template_image(wt, tile_size)
+        if 'invert template color' in opts2:
+            image = PIL.ImageOps.invert(image)
+        tiles.append(image)
+    if hint is not None:
+        cn_params["module"] = design_pipeline.HINT_MODULE
+    elif not cn_params["pixel_perfect"]:
+        # The preprocessor runs on all tiles at once
+        cn_params["processor_res"] = min(design_pipeline.MAX_PROCESSOR_RES, cn_params["processor_res"] * max(grid))
+
+    txt2img_params["width"], txt2img_params["height"] = tile_size[0] * grid[0], tile_size[1] * grid[1]
+    with metrics.span("template_tiles"):
+        packed = design_pipeline.pack_template_tiles(tiles, grid)
+    images = _txt2img(txt2img_params, cn_params, packed)
+    return design_pipeline.unpack_design_tiles(images, len(wts), grid)
+
 
 BASE_DIR = basedir()
 gradio_ui.init_cfg(data_path, BASE_DIR,
                    os.path.join(data_path, "outputs", "generated_wheels"),
                    os.path.join(BASE_DIR, "images"),
-                   on_generate_designed_wheel)
+                   on_generate_designed_wheel, generation_progress, interrupt_generation,
+                   on_generate_multi_template_designs)
 script_callbacks.on_ui_tabs(on_ui_tabs)
+script_callbacks.on_ui_settings(on_ui_settings)
+script_callbacks.on_app_started(on_app_started)
+metrics.g_metrics.add_sink(log_timings_sink)
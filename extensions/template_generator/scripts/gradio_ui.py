@@ -3,15 +3,15 @@ import os
 import time
 # from functools import partial
 import shutil
-from base64 import b64encode, b64decode
+from base64 import b64encode
 import json
-from io import BytesIO
-from zipfile import ZipFile
 import sys
 from operator import itemgetter
 import copy
+import uuid
+from functools import partial
 
-from modules.ui import create_refresh_button, save_style_symbol
+from modules.ui import refresh_symbol, save_style_symbol
 from modules.ui_components import ToolButton, FormRow
 from modules.sd_samplers import samplers as sd_samplers
 import gradio as gr
@@ -19,14 +19,40 @@ import gradio as gr
 try:
     # For standalone mode
     from wheel_geometry import WheelTemplate, WheelTemplateRenderer, produce_wheel_outputs, \
-        save_wheel_json, load_wheel_template_from_json
-    from image_utils import image_file_as_png_bytes, pil_image_to_png_bytes, image_b64_to_pil
+        save_wheel_json, load_wheel_template_from_json, TILED_RENDER_MIN_PIXELS
+    from image_utils import pil_image_to_png_bytes, atomic_output_path
+    from design_archive import BlobStore, read_design_filedata, upgrade_design_cfg, resolve_image_path, \
+        save_design, DESIGN_JSON, BLOBS_DIR_NAME, DESIGN_FORMAT_VERSION
+    from phash import DEFAULT_RADIUS as PHASH_DEDUP_RADIUS
+    from catalog import Catalog, CATALOG_DB_NAME, TEMPLATES, DESIGNS
+    from thumbnails import write_thumbnail, thumbnail_size, template_previews, PREVIEW_PAGE_SIZE
+    from live_updates import LatestWinsCoalescer
+    from design_jobs import DesignJobQueue, JOB_FAILED, JOB_CANCELLED
+    from design_pipeline import templates_per_run
+    from coverage_solver import solve_coverage
+    from render_cache import TemplateRenderCache
+    from sweep import TemplateSweep, parse_sweep, sweep_fname, SWEEPS_DIR_NAME
+    from design_config import CachedJsonConfig
+    from metrics import g_metrics
     from controlnet_extracts import *
 except ImportError:
     # For 'webui' mode
     from scripts.wheel_geometry import WheelTemplate, WheelTemplateRenderer, produce_wheel_outputs, \
-        save_wheel_json, load_wheel_template_from_json
-    from scripts.image_utils import image_file_as_png_bytes, pil_image_to_png_bytes, image_b64_to_pil
+        save_wheel_json, load_wheel_template_from_json, TILED_RENDER_MIN_PIXELS
+    from scripts.image_utils import pil_image_to_png_bytes, atomic_output_path
+    from scripts.design_archive import BlobStore, read_design_filedata, upgrade_design_cfg, resolve_image_path, \
+        save_design, DESIGN_JSON, BLOBS_DIR_NAME, DESIGN_FORMAT_VERSION
+    from scripts.phash import DEFAULT_RADIUS as PHASH_DEDUP_RADIUS
+    from scripts.catalog import Catalog, CATALOG_DB_NAME, TEMPLATES, DESIGNS
+    from scripts.thumbnails import write_thumbnail, thumbnail_size, template_previews, PREVIEW_PAGE_SIZE
+    from scripts.live_updates import LatestWinsCoalescer
+    from scripts.design_jobs import DesignJobQueue, JOB_FAILED, JOB_CANCELLED
+    from scripts.design_pipeline import templates_per_run
+    from scripts.coverage_solver import solve_coverage
+    from scripts.render_cache import TemplateRenderCache
+    from scripts.sweep import TemplateSweep, parse_sweep, sweep_fname, SWEEPS_DIR_NAME
+    from scripts.design_config import CachedJsonConfig
+    from scripts.metrics import g_metrics
     from scripts.controlnet_extracts import *
     
 
@@ -77,7 +103,7 @@ DESIGN_ATTR_PARAMS = [
 DESIGN_BASE_RENDER_PARAMS = [
     "prompt",
     "opts1", "opts2", "canvas_width", "canvas_height",
-    "batch_size", "creativity", "sampler_index", "steps",
+    "batch_size", "creativity", "sampler_index", "steps", "seed",
 ]
 
 DESIGN_ADV_RENDER_PARAMS = [
@@ -105,21 +131,38 @@ g_user_default_design_json_path = None # Path to user controlled default design.
 g_base_default_design_json_path = None # Path to base default design.json file (readonly)
 g_img_dir_path = None # Dir for static images (e.g. Ford logo)
 g_cb_generate_wheel = None # Callback to invoke on generation of final designed wheel
+g_cb_generate_multi_template = None # Callback to invoke on generation of the designs of several templates at once
 g_base_design = None # Base wheel design, containing all default values. This is NOT the default design that the user may set.
+g_user_default_design = None # The default design that the user may set, with the missing values from the base design
+g_blob_store = None # Content-addressed store of the images of all saved designs
+g_catalog = None # Index of the saved templates and designs
+g_design_jobs = None # Queue of designed wheel generations, shared by all users
+g_render_cache = TemplateRenderCache() # Rendered templates, for slider changes that revisit a previous configuration
+g_live_coalescer = LatestWinsCoalescer() # Drops live update renders that a later change of the same session supersedes
+
+FIT_COVERAGE_FREE_PARAMS = ["spoke_central_angle", "spoke_count", "rim_width"] # Params varied to meet the requested coverage
 
 TEMPLATES_DIR_NAME = "templates" # Dir under g_output_dir_path to save wheel templates
 DESIGNS_DIR_NAME = "designs" # Dir under g_output_dir_path to save final designed wheels
 WHEEL_JSON = "wheel.json" # Name of JSON file containing wheel template configuration
-DESIGN_JSON = "design.json" # Name of JSON file containing final wheel design, which also includes template configuration
+MAX_MULTI_TEMPLATES = 64 # Saved templates designed by a single multi-template generation
+SAVED_TEMPLATES_LIST_SIZE = 15 # Max number of saved templates to list in the dropdown
+SAVED_TEMPLATES_LABEL = "Load Saved Template"
 
 REFRESH_SYMBOL = '\U0001f504'  # 🔄
+PREV_PAGE_SYMBOL = '\u25c0'  # ◀
+NEXT_PAGE_SYMBOL = '\u25b6'  # ▶
+SWEEP_SYMBOL = '\u25a6'  # ▦
 # SAVE_STYLE_SYMBOL = '\U0001f4be'  # 💾
 SAVE_STYLE_SYMBOL = '\U0001f4be'
 
 
-def init_cfg(webui_dir_path, ext_dir_path, output_dir_path, img_dir_path, cb_generate_wheel):
+def init_cfg(webui_dir_path, ext_dir_path, output_dir_path, img_dir_path, cb_generate_wheel,
+             cb_generation_progress=None, cb_interrupt_generation=None, cb_generate_multi_template=None):
     global g_webui_dir_path, g_ext_dir_path, g_output_dir_path, g_img_dir_path, \
-           g_cb_generate_wheel, g_user_default_design_json_path, g_base_default_design_json_path
+           g_cb_generate_wheel, g_cb_generate_multi_template, g_user_default_design_json_path, \
+           g_base_default_design_json_path, g_blob_store, \
+           g_catalog, g_design_jobs, g_base_design, g_user_default_design
        
     g_webui_dir_path = webui_dir_path
     g_ext_dir_path = ext_dir_path
@@ -128,27 +171,61 @@ def init_cfg(webui_dir_path, ext_dir_path, output_dir_path, img_dir_path, cb_gen
     g_base_default_design_json_path = os.path.join(g_ext_dir_path, "base_design.json")
     g_img_dir_path = img_dir_path
     g_cb_generate_wheel = cb_generate_wheel
+    g_cb_generate_multi_template = cb_generate_multi_template
+    # This file is the base and always exists, and cannot be modified by the user.
+    g_base_design = CachedJsonConfig(g_base_default_design_json_path)
+    g_user_default_design = CachedJsonConfig(g_user_default_design_json_path, _load_user_default_design)
+    g_blob_store = BlobStore(os.path.join(g_output_dir_path, BLOBS_DIR_NAME))
+    g_catalog = Catalog(os.path.join(g_output_dir_path, CATALOG_DB_NAME),
+                        os.path.join(g_output_dir_path, TEMPLATES_DIR_NAME),
+                        os.path.join(g_output_dir_path, DESIGNS_DIR_NAME))
+    g_catalog.rescan()
+    g_design_jobs = DesignJobQueue(cb_generation_progress, cb_interrupt_generation)
+    g_metrics.register_stats("design_jobs", g_design_jobs.stats)
+    g_metrics.register_stats("render_cache", g_render_cache.stats)
+    g_metrics.register_stats("live_updates", g_live_coalescer.stats)
     
     if not os.path.isfile(g_user_default_design_json_path):
         shutil.copy2(g_base_default_design_json_path, g_user_default_design_json_path)
     
 def get_base_wheel_design(make_copy=True):
-    global g_base_design
-    if g_base_design is None:
-        # This file is the base and always exists, and cannot be modified by the user.  
-        g_base_design = json.load(open(g_base_default_design_json_path))
+    """
+    @param make_copy: Return a copy-on-write view that may be modified, rather than the cached design itself
+    """
     if make_copy:
-        return copy.deepcopy(g_base_design)
+        return g_base_design.get()
+    return g_base_design.get_shared()
+
+def _load_user_default_design(full_cfg):
+    version = full_cfg.get("format_version", 1)
+    full_cfg = upgrade_design_cfg(full_cfg, g_blob_store)
+    if version != DESIGN_FORMAT_VERSION:
+        # Save it upgraded, so its embedded images aren't decoded again
+        with atomic_output_path(g_user_default_design_json_path) as tmp_fpath, open(tmp_fpath, "w") as f:
+            f.write(json.dumps(full_cfg, indent=4))
+    fill_wheel_design_defaults(full_cfg)
+    return full_cfg
+
+def _default_design_config():
+    # The user default design, and if it doesn't exist the base design
+    if g_user_default_design.exists():
+        return g_user_default_design
     return g_base_design
-    
+
 def load_default_wheel_design():
-    # Try to load the user default design, and if it doesn't exist load the base design
-    if os.path.isfile(g_user_default_design_json_path):
-        def_cfg = json.load(open(g_user_default_design_json_path, "r"))
-        fill_wheel_design_defaults(def_cfg)
-    else:
-        def_cfg = get_base_wheel_design()
-    return def_cfg
+    """
+    Returns a copy-on-write view of the default design (re-read only when its file changes)
+    """
+    return _default_design_config().get()
+
+def _initial_template(full_cfg):
+    # The template image of a design, or a default template if it has none.
+    # Returns (PIL image or file path, the specs it was rendered from or None)
+    fpath = resolve_image_path(full_cfg["template_image"], g_blob_store)
+    if fpath is not None:
+        return fpath, None
+    wt = WheelTemplate()
+    return WheelTemplateRenderer(wt).generate_raster("pil", color_errors=True), wt.to_dict()
     
 def fill_dict_defaults(d, defaults):
     for k,v in defaults.items():
@@ -164,14 +241,8 @@ def fill_wheel_design_defaults(full_cfg):
     fill_dict_defaults(full_cfg, base_cfg)
 
 def load_wheel_design_from_filedata(filedata):
-    assert filedata is not None
-    if isinstance(filedata, bytes):
-        if filedata.startswith(b"PK"):
-            # It's a zip file that should contain DESIGN_JSON
-            with ZipFile(BytesIO(filedata), "r") as z:
-                filedata = z.read(DESIGN_JSON)
-        filedata = filedata.decode()
-    full_cfg = json.loads(filedata)
+    # Either DESIGN_JSON data, or a zip file that contains it
+    full_cfg = read_design_filedata(filedata, g_blob_store)
     fill_wheel_design_defaults(full_cfg)
     return full_cfg    
 
@@ -181,6 +252,15 @@ def gr_hide():
 def gr_show():
     return gr.update(visible=True)
 
+def gr_time_postprocess(component, span_name):
+    # Time the conversion of the component's output values for the browser
+    postprocess = component.postprocess
+    def timed_postprocess(y):
+        with g_metrics.span(span_name):
+            return postprocess(y)
+    component.postprocess = timed_postprocess
+    return component
+
 def gr_create_image_from_file(fpath):
     img_b64 = b64encode(open(fpath, "rb").read()).decode()
     return gr.HTML('<img src="data:image/jpeg;base64,%s" alt="">' % img_b64)
@@ -238,9 +318,12 @@ def on_generate_wheel_template(user_state, live_update, *inputs):
     coverage = gr.Slider.update()
     try:
         wt, err_msg = create_wheel_template_from_ui_inputs(inputs)
-        png_image = WheelTemplateRenderer(wt).generate_svg(png="PIL", color_errors=True)
+        with g_metrics.span("template_render"):
+            png_image, areas = g_render_cache.render(wt, color_errors=True)
         if not err_msg:
-            coverage = wt.calc_areas()["coverage"]
+            coverage = areas["coverage"]
+        # The specs of the displayed template, for generating from its geometry rather than its image
+        user_state["template_specs"] = wt.to_dict()
     except Exception as e:
         err_msg = str(e) or str(type(e))
         png_image = gr.Image.update()
@@ -252,7 +335,12 @@ def on_generate_wheel_template_live(user_state, live_update, *inputs):
     if not live_update or user_state.get("custom_template", False):
         # Do nothing
         return [user_state, gr.Image.update(), gr.Slider.update()] + make_ui_no_output_msg()
-    return on_generate_wheel_template(user_state, live_update, *inputs)
+    session_id = user_state.setdefault("session_id", uuid.uuid4().hex)
+    done, outputs = g_live_coalescer.run(session_id, on_generate_wheel_template, user_state, live_update, *inputs)
+    if not done:
+        # Superseded by a later change of this session, which delivers its own output
+        return [user_state, gr.Image.update(), gr.Slider.update()] + make_ui_no_output_msg()
+    return outputs
 
 
 def on_live_update_toggled(user_state, live_update, *inputs):
@@ -263,26 +351,59 @@ def on_live_update_toggled(user_state, live_update, *inputs):
         # Enable the "Generate" button and don't change any output
         return [gr.Button.update(interactive=True), gr.update(), gr.Image.update(), gr.Slider.update()] + make_ui_no_output_msg()
 
+
+def on_fit_coverage_area(user_state, live_update, *inputs):
+    """
+    Change the template so its coverage area meets the requested one, varying only FIT_COVERAGE_FREE_PARAMS
+    """
+    try:
+        wt, _err_msg = create_wheel_template_from_ui_inputs(inputs)
+        solutions = solve_coverage(wt, free_params=FIT_COVERAGE_FREE_PARAMS, max_results=1)
+        if not solutions:
+            raise Exception("No valid template meets the requested coverage area")
+        outputs = _wheel_template_to_ui_value_list(solutions[0])
+    except Exception as e:
+        return [gr.update() for i in range(NUM_TEMPLATE_INPUTS + 3)] + make_ui_output_msg(
+            err="Error fitting coverage area: %s" % str(e))
+    return outputs + on_generate_wheel_template(user_state, live_update, *outputs)
+
     
-def get_server_saved_template_dirs(max_recent=15):
-    dir_path = os.path.join(g_output_dir_path, TEMPLATES_DIR_NAME)
-    fnames = os.listdir(dir_path)
-    res = []
-    mtimes = {}
-    for fname in fnames:
-        fpath = os.path.join(dir_path, fname)
-        if not os.path.isdir(fpath):
-            continue
-        if not os.path.isfile(os.path.join(fpath, WHEEL_JSON)):
-            continue
-        res.append(fname)
-        mtimes[fname] = os.stat(fpath).st_mtime
-    res.sort(key=lambda fname:mtimes[fname], reverse=True)
-    return res[:max_recent]
+def get_server_saved_template_dirs(max_recent=SAVED_TEMPLATES_LIST_SIZE, search=""):
+    """
+    Returns (list of the most recent saved template dirs that match the search string, total number of matches).
+    See catalog.parse_query() for the search string syntax.
+    """
+    rows, total = g_catalog.search(TEMPLATES, search, limit=max_recent)
+    return [row["dir"] for row in rows], total
+
+def saved_templates_dropdown_args(search=""):
+    # Choices of the saved templates dropdown, with the number of matches in its label when not all are listed
+    dirnames, total = get_server_saved_template_dirs(search=search)
+    label = SAVED_TEMPLATES_LABEL
+    if len(dirnames) < total:
+        label = "%s (%d of %d)" % (SAVED_TEMPLATES_LABEL, len(dirnames), total)
+    return {"choices": dirnames, "label": label}
+
+def on_search_saved_templates(search):
+    try:
+        dropdown_args = saved_templates_dropdown_args(search)
+    except Exception as e:
+        return [gr.update()] + make_ui_output_msg(err="Error searching saved templates: %s" % str(e))
+    return [gr.Dropdown.update(**dropdown_args)] + make_ui_no_output_msg()
+
+def on_refresh_saved_templates(search):
+    # Also pick up dirs that were changed on the server by others
+    try:
+        g_catalog.rescan(full=True)
+    except Exception as e:
+        return [gr.update()] + make_ui_output_msg(err="Error refreshing saved templates: %s" % str(e))
+    return on_search_saved_templates(search)
 
 def on_save_wheel_template(live_update, *inputs):
+    # The template inputs are followed by the template name and the saved templates search
+    template_name, search = inputs[-2:]
     try:
-        wt, geo_err_msg = create_wheel_template_from_ui_inputs(inputs[:len(inputs)-1])
+        wt, geo_err_msg = create_wheel_template_from_ui_inputs(inputs[:len(inputs)-2])
         if geo_err_msg:
             raise Exception(geo_err_msg)
     except Exception as e:
@@ -290,19 +411,61 @@ def on_save_wheel_template(live_update, *inputs):
 
     try:
         # Separate date/time dir for each execution
-        dirname = "%s_%s" % ('_'.join(inputs[-1].split()), time.strftime("%Y_%m_%d_%H_%M_%S"))
-        dirpath = os.path.join(g_output_dir_path, "templates", dirname)
+        dirname = "%s_%s" % ('_'.join(template_name.split()), time.strftime("%Y_%m_%d_%H_%M_%S"))
+        dirpath = os.path.join(g_output_dir_path, TEMPLATES_DIR_NAME, dirname)
         os.makedirs(dirpath)
         png_fpath = os.path.join(dirpath, "wheel.png")
         svg_fpath = os.path.join(dirpath, "wheel.svg")
         json_fpath = os.path.join(dirpath, WHEEL_JSON)
-        produce_wheel_outputs(wt, svg_fpath, png_fpath, json_fpath)
+        w, h = wt.canvas_size
+        if w * h > TILED_RENDER_MIN_PIXELS:
+            produce_wheel_outputs(wt, svg_fpath, png_fpath, json_fpath)
+            write_thumbnail(wt, dirpath)
+        else:
+            # Both from a single recording of the drawing
+            (png_image, thumb_image), _areas = g_render_cache.render_sizes(wt, [(w, h), thumbnail_size(wt)])
+            produce_wheel_outputs(wt, svg_fpath, None, json_fpath)
+            png_image.save(png_fpath, format="PNG")
+            write_thumbnail(wt, dirpath, thumb_image)
+        g_catalog.update(TEMPLATES, dirname)
     except Exception as e:
         return [gr.update()] + make_ui_output_msg(err="Error producing outputs: %s" % str(e))
 
-    return [gr.Dropdown.update(choices=get_server_saved_template_dirs())] + \
+    try:
+        # Keep the search the list is filtered by
+        dropdown_update = gr.Dropdown.update(**saved_templates_dropdown_args(search))
+    except Exception:
+        dropdown_update = gr.update()
+    return [dropdown_update] + \
         make_ui_output_msg(success="Outputs saved in '%s'" % os.path.relpath(dirpath, g_webui_dir_path))
 
+def on_sweep_templates(sweep_text, live_update, *inputs):
+    try:
+        # The swept parameters are checked per combination, so the base template doesn't have to be valid
+        wt, _geo_err_msg = create_wheel_template_from_ui_inputs(inputs)
+        template_sweep = TemplateSweep(wt, parse_sweep(sweep_text))
+        dirpath = os.path.join(g_output_dir_path, SWEEPS_DIR_NAME)
+        os.makedirs(dirpath, exist_ok=True)
+        fpath = os.path.join(dirpath, sweep_fname(template_sweep.axes))
+    except Exception as e:
+        yield [gr.update(), gr.update()] + make_ui_output_msg(err="Error with sweep: %s" % str(e))
+        return
+
+    status = "%d combinations, %d valid" % (template_sweep.num_cells, template_sweep.num_valid)
+    t_start = time.perf_counter()
+    try:
+        # Stream the contact sheet into the UI a row at a time
+        for rows_done, sheet in template_sweep.iter_contact_sheet(fpath):
+            yield [sheet, "%s, rendered %d/%d rows" % (status, rows_done, template_sweep.num_rows)] + \
+                make_ui_no_output_msg()
+    except Exception as e:
+        yield [gr.update(), status] + make_ui_output_msg(err="Error rendering sweep: %s" % str(e))
+        return
+    seconds = time.perf_counter() - t_start
+    g_metrics.record("template_sweep", seconds)
+    yield [gr.update(), "%s, rendered in %.1fs" % (status, seconds)] + \
+        make_ui_output_msg(success="Contact sheet saved in '%s'" % os.path.relpath(fpath, g_webui_dir_path))
+
 def _wheel_template_to_ui_value_list(wt):
     assert isinstance(wt, WheelTemplate)
     rim_diam = wt.rim_diameter
@@ -332,15 +495,61 @@ def on_load_wheel_template_from_dropdown(user_state, selected_template_folder):
     Load from a chosen file saved on the server
     """
     try:
-        template_json_filename = os.path.join(g_output_dir_path, TEMPLATES_DIR_NAME, selected_template_folder, WHEEL_JSON)
+        dirpath = os.path.join(g_output_dir_path, TEMPLATES_DIR_NAME, selected_template_folder)
+        template_json_filename = os.path.join(dirpath, WHEEL_JSON)
         with open(template_json_filename, 'rb') as template_json_handler:
             filedata = template_json_handler.read()
         wt = load_wheel_template_from_json(filedata)
         outputs = _wheel_template_to_ui_value_list(wt)
+        png_fpath = os.path.join(dirpath, "wheel.png")
+        coverage = wt.calc_areas()["coverage"]
     except Exception as e:
         return [gr.update() for i in range(NUM_TEMPLATE_INPUTS + 3)] + make_ui_output_msg(
             err="Error loading wheel template: %s" % str(e))
-    return outputs + on_generate_wheel_template(user_state, False, *outputs)
+    if not os.path.isfile(png_fpath):
+        return outputs + on_generate_wheel_template(user_state, False, *outputs)
+
+    # Show the image saved with the template (as a file path, so it's not even decoded) instead of rendering it.
+    # Saved templates have no geometric errors, so it's the same image.
+    user_state["custom_template"] = False
+    user_state["template_specs"] = wt.to_dict()
+    return outputs + [user_state, png_fpath, coverage] + make_ui_output_msg()
+
+
+def on_browse_saved_templates(gallery_state, search, page):
+    """
+    Show a page of the saved templates gallery
+    """
+    try:
+        previews, total = template_previews(g_catalog, os.path.join(g_output_dir_path, TEMPLATES_DIR_NAME),
+                                            search, page, PREVIEW_PAGE_SIZE)
+    except Exception as e:
+        return [gallery_state, gr.update(), gr.update()] + make_ui_output_msg(
+            err="Error browsing saved templates: %s" % str(e))
+    num_pages = max(1, (total + PREVIEW_PAGE_SIZE - 1) // PREVIEW_PAGE_SIZE)
+    gallery_state = {"search": search, "page": page, "num_pages": num_pages,
+                     "dirs": [row["dir"] for _fpath, row in previews]}
+    gallery = [(fpath, "%s (%.1f%%)" % (row["dir"], row["coverage"] or 0)) for fpath, row in previews]
+    page_info = "Page %d of %d (%d templates)" % (page + 1, num_pages, total)
+    return [gallery_state, gallery, page_info] + make_ui_no_output_msg()
+
+
+def on_search_templates_gallery(gallery_state, search):
+    return on_browse_saved_templates(gallery_state, search, 0)
+
+
+def on_templates_gallery_prev_page(gallery_state):
+    page = max(0, gallery_state["page"] - 1)
+    return on_browse_saved_templates(gallery_state, gallery_state["search"], page)
+
+
+def on_templates_gallery_next_page(gallery_state):
+    page = min(gallery_state["num_pages"] - 1, gallery_state["page"] + 1)
+    return on_browse_saved_templates(gallery_state, gallery_state["search"], page)
+
+
+def on_select_templates_gallery(user_state, gallery_state, evt: gr.SelectData):
+    return on_load_wheel_template_from_dropdown(user_state, gallery_state["dirs"][evt.index])
 
 
 def on_load_wheel_template_from_file(user_state, filedata):
@@ -362,7 +571,7 @@ def on_upload_custom_template_image(user_state, template_image):
     return [user_state, template_image] + make_ui_output_msg(success="uploaded user template")
 
 
-def on_generate_designed_wheel(template_image, *inputs):
+def on_generate_designed_wheel(user_state, template_image, *inputs):
     # print(len(inputs), inputs)
     design_inputs = inputs
     
@@ -376,21 +585,113 @@ def on_generate_designed_wheel(template_image, *inputs):
         # return [gr.update()] + make_ui_output_msg(err="Error with template: %s" % str(e))
 
     if g_cb_generate_wheel is None:
-        return [gr_hide()] + [gr.update() for i in range(3)]
+        yield [gr_hide(), user_state] + [gr.update() for i in range(4)]
+        return
+
+    try:
+        design_input_dict = {DESIGN_INPUT_NAMES[i]: value for i, value in enumerate(design_inputs)}
+        wt = None
+        template_specs = user_state.get("template_specs", None)
+        if template_specs and not user_state.get("custom_template", False):
+            wt = WheelTemplate(**template_specs)
+        generate_func = partial(_generate_designed_wheel_chunk, template_image, design_input_dict, wt)
+        job = g_design_jobs.submit(generate_func, int(design_input_dict["batch_size"]))
+    except Exception as e:
+        yield [gr_hide(), user_state, gr.update(), gr.update()] + make_ui_output_msg(
+            err="Error with image renderer: %s" % str(e))
+        return
+    user_state["design_job_id"] = job.id
+
+    # Stream the images into the gallery as they complete, sending them only when there are new ones
+    num_images = 0
+    for job in g_design_jobs.follow(job):
+        images = gr.update()
+        if len(job.images) != num_images:
+            num_images = len(job.images)
+            images = job.images
+        yield [gr_hide(), user_state, images, g_design_jobs.status_text(job)] + make_ui_no_output_msg()
+
+    if job.status == JOB_FAILED:
+        msgs = make_ui_output_msg(err=job.error)
+    elif job.status == JOB_CANCELLED:
+        msgs = make_ui_output_msg(success="Cancelled")
+    else:
+        msgs = make_ui_output_msg(success="Cool!")
+    yield [gr_hide(), user_state, gr.update(), g_design_jobs.status_text(job)] + msgs
+
+
+def _generate_designed_wheel_chunk(template_image, design_input_dict, wt, start, batch_size):
+    chunk_input_dict = dict(design_input_dict, batch_size=batch_size)
+    seed = int(design_input_dict.get("seed", -1))
+    if seed != -1:
+        # The images of a batch get consecutive seeds, so the chunks give the same images as a single batch
+        chunk_input_dict["seed"] = seed + start
+    return g_cb_generate_wheel(template_image, chunk_input_dict, wt)
+
+
+def on_generate_multi_template_designs(user_state, search, tiled, *design_inputs):
+    if g_cb_generate_multi_template is None:
+        yield [user_state, gr.update(), gr.update()] + make_ui_output_msg(
+            err="Multi-template designs aren't supported in this mode")
+        return
 
     try:
         design_input_dict = {DESIGN_INPUT_NAMES[i]: value for i, value in enumerate(design_inputs)}
-        # designed_image = g_cb_generate_wheel(wt, design_input_dict)
-        designed_images = g_cb_generate_wheel(template_image, design_input_dict)
+        rows, total = g_catalog.search(TEMPLATES, search, limit=MAX_MULTI_TEMPLATES)
+        if not rows:
+            raise Exception("No saved templates match the search")
+        names, wts = [], []
+        for row in rows:
+            with open(os.path.join(g_output_dir_path, TEMPLATES_DIR_NAME, row["dir"], WHEEL_JSON), "rb") as f:
+                wts.append(load_wheel_template_from_json(f.read()))
+            names.append(row["dir"])
+        batch_size = int(design_input_dict["batch_size"])
+        # Every call generates the designs of a template, or of as many as fit in a single run when tiled. The
+        # calls run back to back in a single job, so the model stays loaded between templates
+        per_run = 1
+        if tiled:
+            per_run = templates_per_run(design_input_dict["canvas_width"], design_input_dict["canvas_height"])
+        generate_func = partial(_generate_multi_template_chunk, wts, design_input_dict, batch_size, tiled)
+        job = g_design_jobs.submit(generate_func, len(wts) * batch_size, chunk_size=per_run * batch_size)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return [gr_hide(), gr.update()] + make_ui_output_msg(err="Error with image renderer: %s" % str(e))
+        yield [user_state, gr.update(), gr.update()] + make_ui_output_msg(
+            err="Error starting multi-template generation: %s" % str(e))
+        return
+    user_state["design_job_id"] = job.id
+
+    # Stream the images into the gallery as they complete, captioned by their templates
+    num_images = 0
+    for job in g_design_jobs.follow(job):
+        images = gr.update()
+        if len(job.images) != num_images:
+            num_images = len(job.images)
+            images = [(image, names[i // batch_size]) for i, image in enumerate(job.images)]
+        yield [user_state, images, g_design_jobs.status_text(job)] + make_ui_no_output_msg()
+
+    if job.status == JOB_FAILED:
+        msgs = make_ui_output_msg(err=job.error)
+    elif job.status == JOB_CANCELLED:
+        msgs = make_ui_output_msg(success="Cancelled")
+    else:
+        msgs = make_ui_output_msg(success="Designed %d of %d matching templates" % (len(wts), total))
+    yield [user_state, gr.update(), g_design_jobs.status_text(job)] + msgs
 
-    return [gr_hide(), designed_images] + make_ui_output_msg(success="Cool!")
 
+def _generate_multi_template_chunk(wts, design_input_dict, batch_size, tiled, start, n):
+    # The chunks are whole multiples of the batch size, so each one is the designs of some templates
+    first = start // batch_size
+    designs = g_cb_generate_multi_template(wts[first:first + n // batch_size], design_input_dict, tiled)
+    return [image for template_images in designs for image in template_images]
 
-def on_save_designed_wheel(template_image, designed_images, *inputs):
+
+def on_cancel_design_job(user_state):
+    job_id = user_state.get("design_job_id", None)
+    if job_id is None or not g_design_jobs.cancel(job_id):
+        return make_ui_output_msg(err="No design generation to cancel")
+    return make_ui_output_msg(success="Cancelling...")
+
+
+def on_save_designed_wheel(template_image, designed_images, drop_duplicates, *inputs):
     # print(designed_images)
     # return [gr.update()] + make_ui_output_msg(err="sdfg")
     
@@ -412,56 +713,23 @@ def on_save_designed_wheel(template_image, designed_images, *inputs):
         # Separate date/time dir for each execution
         dirname = time.strftime("%Y_%m_%d_%H_%M_%S")
         dirpath = os.path.join(g_output_dir_path, DESIGNS_DIR_NAME, dirname)
-        os.makedirs(dirpath)
-        # t_png_fpath = os.path.join(dirpath, "template.png")
-        # t_svg_fpath = os.path.join(dirpath, "template.svg")
-        t_json_fpath = os.path.join(dirpath, "template.json")
-        save_wheel_json(wt, t_json_fpath)
-        # template_cfg = produce_wheel_outputs(wt, t_svg_fpath, t_png_fpath, t_json_fpath)
-
-        template_raw = pil_image_to_png_bytes(template_image)
-        template_png_fpath = os.path.join(dirpath, "template.png")
-        open(template_png_fpath, "wb").write(template_raw)
-        template_raw_b64 = b64encode(template_raw).decode()        
-
-        png_raw_b64_list = []
-        d_png_paths = []
-        for index, image in enumerate(designed_images):
-            d_png_fpath = os.path.join(dirpath, "design_%s.png" % index)
-            d_png_paths.append(d_png_fpath)
-            tmp_png_fname = image.get('name', None)
-            if tmp_png_fname is not None:
-                png_raw = image_file_as_png_bytes(tmp_png_fname)
-                open(d_png_fpath, "wb").write(png_raw)
-                png_raw_b64 = b64encode(png_raw).decode()
-            else:
-                png_raw_b64 = None
-            png_raw_b64_list.append(png_raw_b64)
-        full_cfg = {
-            "template_specs": wt.to_dict(),
-            "template_raw_b64": template_raw_b64,
-            "design": {
-                "attr": attr_dict,
-                "render": render_dict,
-                "png_raw_b64_list": png_raw_b64_list
-            },
-        }
-        d_json_fpath = os.path.join(dirpath, DESIGN_JSON)
-        open(d_json_fpath, "w").write(json.dumps(full_cfg, indent=4))
-
+        # The gallery images come as gradio's temp files, so save_design() copies them rather than linking them
+        designed_image_fpaths = [image.get('name', None) for image in designed_images]
+        dedup_radius = PHASH_DEDUP_RADIUS if drop_duplicates else None
+        with g_metrics.span("save_design"):
+            _d_json_fpath, output_zip_fpath, num_dropped = save_design(dirpath, g_blob_store, wt,
+                                                                       pil_image_to_png_bytes(template_image),
+                                                                       designed_image_fpaths, attr_dict, render_dict,
+                                                                       dedup_radius)
+        g_catalog.update(DESIGNS, dirname)
     except Exception as e:
         return [gr_hide()] + make_ui_output_msg(err="Error producing outputs: %s" % str(e))
 
-    output_zip_fpath = os.path.join(dirpath, "design.zip")
-    with ZipFile(output_zip_fpath, 'w') as z:
-        z.write(t_json_fpath, os.path.basename(t_json_fpath))
-        z.write(template_png_fpath, os.path.basename(template_png_fpath))
-        for d_png_fpath in d_png_paths:
-            z.write(d_png_fpath, os.path.basename(d_png_fpath))
-        z.write(d_json_fpath, os.path.basename(d_json_fpath))
-    
     down_btn_update = gr.update(value=gr_create_local_file_href_html(output_zip_fpath), visible=True)
-    return [down_btn_update] + make_ui_output_msg(success="Outputs saved in '%s'" % os.path.relpath(dirpath, g_webui_dir_path))
+    msg = "Outputs saved in '%s'" % os.path.relpath(dirpath, g_webui_dir_path)
+    if num_dropped:
+        msg += " (%d near-duplicate images dropped)" % num_dropped
+    return [down_btn_update] + make_ui_output_msg(success=msg)
 
 def on_load_designed_wheel(user_state, filedata=None):
     reset_to_default = False
@@ -476,25 +744,23 @@ def on_load_designed_wheel(user_state, filedata=None):
         except Exception as e:
             raise Exception("Error parsing as JSON data or as ZIP file with %s file: %s" % (DESIGN_JSON, str(e))) from None
         template_specs = full_cfg["template_specs"]
-        template_raw_b64 = full_cfg["template_raw_b64"]
         design_cfg = full_cfg["design"]
         d_attr_cfg = design_cfg["attr"]
         d_render_cfg = design_cfg["render"]
-        png_raw_b64_list = design_cfg["png_raw_b64_list"]
         wt = WheelTemplate(**template_specs)
         template_outputs = _wheel_template_to_ui_value_list(wt)
         design_outputs = [d_attr_cfg[k] for k in DESIGN_ATTR_PARAMS]
         design_outputs += [d_render_cfg[k] for k in DESIGN_RENDER_PARAMS]
         designed_images = []
-        template_image = image_b64_to_pil(template_raw_b64)
+        # Images are given to gradio as file paths, so they're never decoded here
+        template_image = resolve_image_path(full_cfg["template_image"], g_blob_store)
         
         # When reseting, dont load the designed images
         if not reset_to_default:
-            for png_raw_b64 in png_raw_b64_list:
-                if png_raw_b64 is None:
-                    continue
-                bio = BytesIO(b64decode(png_raw_b64))
-                designed_images.append(Image.open(bio))
+            for ref in design_cfg["images"]:
+                fpath = resolve_image_path(ref, g_blob_store)
+                if fpath is not None:
+                    designed_images.append(fpath)
             
     except Exception as e:
         return [gr_hide()] + [gr.update() for i in range(NUM_TEMPLATE_INPUTS + NUM_DESIGN_INPUTS + 4)] + make_ui_output_msg(
@@ -511,7 +777,7 @@ def on_upload_default_wheel_design(filedata):
             raise Exception("Error parsing as JSON data or as ZIP file with %s file: %s" % (DESIGN_JSON, str(e))) from None
             
         # Remove designed images
-        full_cfg["design"]["png_raw_b64_list"] = []
+        full_cfg["design"]["images"] = []
         open(g_user_default_design_json_path, "w").write(json.dumps(full_cfg, indent=4))
     except Exception as e:
         return make_ui_output_msg(err="Error uploading default design: %s" % str(e))
@@ -609,15 +875,14 @@ def init_gradio_ui_v2(standalone=False):
     design_cfg = full_cfg["design"]
     da_cfg = design_cfg["attr"]
     dr_cfg = design_cfg["render"]
-    initial_template_image = image_b64_to_pil(full_cfg["template_raw_b64"])
-    is_custom_template = True
-    if initial_template_image is None:
-        wt = WheelTemplate()
-        initial_template_image = WheelTemplateRenderer(wt).generate_svg(png="PIL", color_errors=True)
-        is_custom_template = False
+    # Cached with the default design, so reloading the tab doesn't render it again
+    initial_template_image, initial_template_specs = _default_design_config().derived("initial_template",
+                                                                                      _initial_template)
+    is_custom_template = initial_template_specs is None
 
     with gr.Blocks(css=CSS, analytics_enabled=standalone) as ui:
-        user_state = gr.State(value={"custom_template": is_custom_template})
+        user_state = gr.State(value={"custom_template": is_custom_template,
+                                     "template_specs": copy.deepcopy(initial_template_specs)})
         with gr.Row(variant="compact").style(equal_height=False):
             with gr.Column():
                 with gr.Row(variant="compact").style(equal_height=False):
@@ -637,8 +902,10 @@ def init_gradio_ui_v2(standalone=False):
                         spoke0_angle = gr.Slider(0, 360.0, step=1, value=ts_cfg["spokes_init_angle"], label='Spokes initial angle')
                         nut_count = gr.Slider(3, 9, step=1, value=ts_cfg["lug_nut_count"], label='Lug nut count')
                         nut0_angle = gr.Slider(0, 360.0, step=1, value=ts_cfg["lug_nuts_init_angle"], label='Lug nuts initial angle')
-                        req_coverage_area = gr.Slider(0, 100, value=ts_cfg["required_coverage_area"], step=1,
-                                                      label='Requested coverage area [%]', visible=False)
+                        with FormRow():
+                            req_coverage_area = gr.Slider(0, 100, value=ts_cfg["required_coverage_area"] * 100, step=1,
+                                                          label='Requested coverage area [%]')
+                            fit_coverage_btn = ToolButton(value="\U0001F3AF", elem_id='fit_coverage_button')
                         # TODO: Calc real coverage area from defaults, if applicable
                         real_coverage_area = gr.Slider(0, 100, value=0.0, step=0.1, interactive=False,
                                                        label='Actual coverage area [%]')
@@ -664,12 +931,31 @@ def init_gradio_ui_v2(standalone=False):
                                                interactive=True)
                     save_template_btn = ToolButton(value=save_style_symbol, elem_id='save_template_button')
                     # save_template_btn = gr.Button("Save template", lable='Save Wheel Template', show_lable=True)
-                    saved_templates = gr.Dropdown(label='Load Saved Template', multiselect=False, show_label=True,
-                                                  interactive=True, visible=True, choices=get_server_saved_template_dirs(),
+                    saved_templates = gr.Dropdown(multiselect=False, show_label=True,
+                                                  interactive=True, visible=True, **saved_templates_dropdown_args(),
                                                   elem_id='saved_templates_dropdown')
-                    create_refresh_button(saved_templates, dir,
-                                          refreshed_args=lambda: {"choices": get_server_saved_template_dirs()},
-                                          elem_id='refresh_saved_templates')
+                    refresh_saved_templates_btn = ToolButton(value=refresh_symbol, elem_id='refresh_saved_templates')
+                with gr.Row(variant="compact").style(equal_height=True):
+                    template_search = gr.Textbox(value="", label='Search Saved Templates', max_lines=1,
+                                                 placeholder='Words of the name, and/or ranges, '
+                                                             'e.g. "alloy spoke_count:5 coverage:40..60"')
+                with gr.Accordion("Saved Templates Gallery", open=False):
+                    gallery_state = gr.State(value={"search": "", "page": 0, "num_pages": 1, "dirs": []})
+                    templates_gallery = gr.Gallery(show_label=False, elem_id="saved_templates_gallery").style(
+                        grid=6, height="auto")
+                    with gr.Row(variant="compact").style(equal_height=True):
+                        gallery_refresh_btn = ToolButton(value=REFRESH_SYMBOL, elem_id="saved_templates_gallery_refresh")
+                        gallery_prev_btn = ToolButton(value=PREV_PAGE_SYMBOL, elem_id="saved_templates_gallery_prev")
+                        gallery_page_info = gr.Markdown("Press %s to browse" % REFRESH_SYMBOL)
+                        gallery_next_btn = ToolButton(value=NEXT_PAGE_SYMBOL, elem_id="saved_templates_gallery_next")
+                with gr.Accordion("Parameter Sweep", open=False):
+                    with gr.Row(variant="compact").style(equal_height=True):
+                        sweep_spec = gr.Textbox(value="", label='Sweep', max_lines=1,
+                                                placeholder='Parameters and their values, e.g. "spoke_count:3..8 '
+                                                            'spoke_central_angle:10..40/4 lug_nut_count:4,5,6"')
+                        sweep_btn = ToolButton(value=SWEEP_SYMBOL, elem_id="template_sweep_button")
+                    sweep_status = gr.Markdown("")
+                    sweep_image = gr.Image(type="pil", interactive=False, show_label=False)
 
                 output_err_textbox = gr.Textbox(show_label=False, visible=False, interactive=False,
                                                 elem_classes="error-textbox")
@@ -702,21 +988,40 @@ def init_gradio_ui_v2(standalone=False):
                         with FormRow():
                             sampler_index = gr.Dropdown(label='Sampling method', choices=[x.name for x in sd_samplers], value=dr_cfg["sampler_index"])
                             steps = gr.Slider(minimum=1, maximum=150, step=1, label="Render quality", value=dr_cfg["steps"])
+                        seed = gr.Number(value=dr_cfg["seed"], label="Seed (-1 for random)", precision=0,
+                                         elem_classes="compact-input")
 
                     with gr.Column():
                         # logo_image = gr.Image(os.path.join(g_img_dir_path, "ford_logo.jpg"), interactive=False)
                         logo_image = gr_create_image_from_file(os.path.join(g_img_dir_path, "wheel_power_logo.jpg"))
                         with gr.Row(variant="compact", elem_classes="image-buttons", equal_height=True):
                             design_generate_btn = gr.Button("Generate", variant="primary")
+                            cancel_design_btn = gr.Button("Cancel")
                             load_design_btn = gr.UploadButton("Load", file_types=[".json", ".zip"], file_count="single",
                                                               type="bytes")
                             save_design_btn = gr.Button("Save")
                             # download_design_btn = gr.File(interactive=False, visible=False, \
                                                         # show_label=False, elem_classes="compact-file")
                             download_design_btn = gr.HTML("<p></p>", elem_classes="lg secondary tool compact-file", visible=False)
+                        drop_duplicates_cb = gr.Checkbox(label="Drop near-duplicate images on save", value=False)
                         designed_image = gr.Gallery(show_label=False).style(columns=2)
+                        # The gallery writes the generated images to temp files for the browser
+                        gr_time_postprocess(designed_image, "gallery_write")
+                        design_job_status = gr.Markdown("")
                         # designed_image = gr.Image(type="pil", interactive=True)
                         designed_image.style(width=350, height=350)
+                with gr.Accordion("Multi-Template Designs", open=False):
+                    with gr.Row(variant="compact").style(equal_height=True):
+                        multi_template_search = gr.Textbox(
+                            value="", label='Design Saved Templates', max_lines=1,
+                            placeholder='Search, e.g. "alloy spoke_count:5 coverage:40..60"')
+                        multi_template_generate_btn = gr.Button("Generate", variant="primary")
+                        multi_template_cancel_btn = gr.Button("Cancel")
+                    multi_template_tiled = gr.Checkbox(
+                        label="Tile several templates into each run (faster, but the designs differ from "
+                              "single template ones)", value=False)
+                    multi_template_gallery = gr.Gallery(show_label=False).style(columns=4)
+                    multi_template_status = gr.Markdown("")
                 with gr.Accordion("More txt2img options", open=False):
                     neg_prompt = gr.Textbox(dr_cfg["neg_prompt"], label="Negative prompt", show_label=True, lines=3, placeholder="")
                     prompt_shadow = gr.Textbox(dr_cfg["prompt_shadow"], label="Prompt (Shadow)", show_label=True, lines=3, placeholder="")
@@ -806,10 +1111,28 @@ def init_gradio_ui_v2(standalone=False):
                                   outputs=[make_template_btn, user_state] + all_template_outputs)
         make_template_btn.click(fn=on_generate_wheel_template, inputs=[user_state] + template_inputs, 
                                 outputs=[user_state] + all_template_outputs)
-        save_template_btn.click(fn=on_save_wheel_template, inputs=template_inputs + [template_name],
+        save_template_btn.click(fn=on_save_wheel_template, inputs=template_inputs + [template_name, template_search],
                                 outputs=[saved_templates] + output_msgs)
+        refresh_saved_templates_btn.click(fn=on_refresh_saved_templates, inputs=[template_search],
+                                          outputs=[saved_templates] + output_msgs)
         # load_template_btn.upload(on_load_wheel_template_from_file, inputs=load_template_btn,
         #                          outputs=template_inputs[1:] + [user_state, template_image, real_coverage_area] + output_msgs)
+        fit_coverage_btn.click(fn=on_fit_coverage_area, inputs=[user_state] + template_inputs,
+                               outputs=template_inputs[1:] + [user_state] + all_template_outputs)
+        template_search.submit(fn=on_search_saved_templates, inputs=[template_search],
+                               outputs=[saved_templates] + output_msgs)
+        gallery_outputs = [gallery_state, templates_gallery, gallery_page_info] + output_msgs
+        template_search.submit(fn=on_search_templates_gallery, inputs=[gallery_state, template_search],
+                               outputs=gallery_outputs)
+        gallery_prev_btn.click(fn=on_templates_gallery_prev_page, inputs=[gallery_state], outputs=gallery_outputs)
+        gallery_next_btn.click(fn=on_templates_gallery_next_page, inputs=[gallery_state], outputs=gallery_outputs)
+        sweep_outputs = [sweep_image, sweep_status] + output_msgs
+        sweep_btn.click(fn=on_sweep_templates, inputs=[sweep_spec] + template_inputs, outputs=sweep_outputs)
+        sweep_spec.submit(fn=on_sweep_templates, inputs=[sweep_spec] + template_inputs, outputs=sweep_outputs)
+        templates_gallery.select(fn=on_select_templates_gallery, inputs=[user_state, gallery_state],
+                                 outputs=template_inputs[1:] + [user_state, template_image, real_coverage_area] + output_msgs)
+        gallery_refresh_btn.click(fn=on_search_templates_gallery, inputs=[gallery_state, template_search],
+                                  outputs=gallery_outputs)
         saved_templates.change(fn=on_load_wheel_template_from_dropdown, inputs=[user_state, saved_templates],
                                outputs=template_inputs[1:] + [user_state, template_image, real_coverage_area] + output_msgs)
         template_image.upload(fn=on_upload_custom_template_image, inputs=[user_state, template_image],
@@ -829,10 +1152,18 @@ def init_gradio_ui_v2(standalone=False):
         full_inputs = template_inputs[1:] + design_inputs
 
         # Design generate/save/load
-        design_generate_btn.click(fn=on_generate_designed_wheel, inputs=[template_image] + design_inputs,
-                                  outputs=[download_design_btn, designed_image] + output_msgs)
-        save_design_btn.click(fn=on_save_designed_wheel, inputs=[template_image, designed_image] + full_inputs, 
-                                outputs=[download_design_btn] + output_msgs)
+        design_generate_btn.click(fn=on_generate_designed_wheel, inputs=[user_state, template_image] + design_inputs,
+                                  outputs=[download_design_btn, user_state, designed_image, design_job_status] + output_msgs)
+        cancel_design_btn.click(fn=on_cancel_design_job, inputs=[user_state], outputs=output_msgs)
+        multi_template_outputs = [user_state, multi_template_gallery, multi_template_status] + output_msgs
+        multi_template_generate_btn.click(fn=on_generate_multi_template_designs,
+                                          inputs=[user_state, multi_template_search, multi_template_tiled] +
+                                                 design_inputs,
+                                          outputs=multi_template_outputs)
+        multi_template_cancel_btn.click(fn=on_cancel_design_job, inputs=[user_state], outputs=output_msgs)
+        save_design_btn.click(fn=on_save_designed_wheel,
+                              inputs=[template_image, designed_image, drop_duplicates_cb] + full_inputs,
+                              outputs=[download_design_btn] + output_msgs)
         load_design_btn.upload(fn=on_load_designed_wheel, inputs=[user_state, load_design_btn],
                                outputs=[download_design_btn, user_state] + full_inputs + [template_image, designed_image] + output_msgs)
                                
@@ -0,0 +1,153 @@
+import numpy as np
+from PIL import Image
+from cairo import ANTIALIAS_NONE
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplateRenderer
+    from image_utils import cairo_image_surface_to_numpy
+    from render_cache import template_render_hash
+    from cache_utils import LruCache
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplateRenderer
+    from scripts.image_utils import cairo_image_surface_to_numpy
+    from scripts.render_cache import template_render_hash
+    from scripts.cache_utils import LruCache
+
+
+HINT_CANNY = "canny"
+HINT_SCRIBBLE = "scribble"
+HINT_SEG = "seg"
+HINT_TYPES = [HINT_CANNY, HINT_SCRIBBLE, HINT_SEG]
+
+# ControlNet preprocessors whose output is replaced by a hint map computed from the template geometry
+HINT_TYPE_BY_MODULE = {
+    "canny": HINT_CANNY,
+    "scribble_hed": HINT_SCRIBBLE,
+    "scribble_pidinet": HINT_SCRIBBLE,
+    "scribble_xdog": HINT_SCRIBBLE,
+    "seg_ofade20k": HINT_SEG,
+    "seg_ofcoco": HINT_SEG,
+    "seg_ufade20k": HINT_SEG,
+}
+HINT_MODULE = "none"  # Preprocessor to send the hint maps with
+
+SCRIBBLE_WIDTH_RATIO = 1 / 256.0  # Half width of the scribble lines, relative to the hint resolution
+# Component drawn by each WheelTemplateRenderer._draw_<name>() method, and its color in segmentation maps.
+# The colors are taken from the ADE20K palette, which ControlNet's seg models were trained on.
+SEG_COMPONENTS = [
+    ("rim", (180, 120, 120)),
+    ("hub_and_lug_nuts", (6, 230, 230)),
+    ("spokes", (80, 50, 50)),
+]
+DEFAULT_MAX_ENTRIES = 64
+
+
+def hint_type_for_module(module):
+    """
+    Returns the hint type that replaces the given ControlNet preprocessor, or None if it has none
+    """
+    return HINT_TYPE_BY_MODULE.get(module, None)
+
+
+def _outline(mask):
+    # Pixels of the mask that touch (4-connectivity) a pixel outside of it
+    padded = np.pad(mask, 1, constant_values=False)
+    interior = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+    return mask & ~interior
+
+
+def _dilate(mask, radius):
+    # Binary dilation by a disk
+    h, w = mask.shape
+    padded = np.pad(mask, radius, constant_values=False)
+    res = np.zeros_like(mask)
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx * dx + dy * dy <= radius * radius:
+                res |= padded[radius + dy:radius + dy + h, radius + dx:radius + dx + w]
+    return res
+
+
+class WheelTemplateHintRenderer(WheelTemplateRenderer):
+    """
+    Renders ControlNet hint maps of a wheel template directly from its geometry, instead of having a
+    ControlNet preprocessor detect them in the rendered template image.
+    The maps have the aspect ratio of the template canvas, with the shorter side at the given resolution
+    (like ControlNet's 'processor_res').
+    """
+
+    def __init__(self, wt, resolution):
+        super().__init__(wt)
+        scale = float(resolution) / min(self._canvas_w, self._canvas_h)
+        self._canvas_w = max(1, int(round(self._canvas_w * scale)))
+        self._canvas_h = max(1, int(round(self._canvas_h * scale)))
+        self._x_pixels_per_inch = self._canvas_w / self._scene_length
+        self._y_pixels_per_inch = self._canvas_h / self._scene_length
+        self._resolution = resolution
+
+    def _render_component_mask(self, name):
+        # Aliased, so the maps are crisp like the preprocessors' binary outputs
+        surface = self._create_image_surface(mask=True)
+        ctx = self._create_context(surface)
+        ctx.set_antialias(ANTIALIAS_NONE)
+        getattr(self, "_draw_" + name)()
+        return cairo_image_surface_to_numpy(surface)[:, :, 0] > 0
+
+    def generate_hint(self, hint_type):
+        """
+        @param hint_type: One of HINT_TYPES
+                          HINT_CANNY - 1px white outlines of the solid shapes, on black
+                          HINT_SCRIBBLE - Thick white outlines of the solid shapes, on black
+                          HINT_SEG - Each wheel component filled with its SEG_COMPONENTS color, on black
+        Returns RGB PIL image
+        """
+        if hint_type not in HINT_TYPES:
+            raise Exception("Unknown hint type: '%s'" % hint_type)
+        self._prepare_render()
+        masks = [(self._render_component_mask(name), color) for name, color in SEG_COMPONENTS]
+
+        if hint_type == HINT_SEG:
+            rgb = np.zeros(masks[0][0].shape + (3,), dtype=np.uint8)
+            for mask, color in masks:
+                rgb[mask] = color
+            return Image.fromarray(rgb, "RGB")
+
+        union = masks[0][0]
+        for mask, _color in masks[1:]:
+            union = union | mask
+        lines = _outline(union)
+        if hint_type == HINT_SCRIBBLE:
+            lines = _dilate(lines, max(1, int(round(self._resolution * SCRIBBLE_WIDTH_RATIO))))
+        return Image.fromarray(lines.astype(np.uint8) * 255, "L").convert("RGB")
+
+
+class HintMapCache(object):
+    """
+    Bounded LRU cache of hint maps, keyed by the canonical hash of the template specs, hint type and resolution.
+    The cached images are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self._entries = LruCache(max_entries)  # key -> image
+
+    def get_hint(self, wt, hint_type, resolution):
+        """
+        Returns the hint map of the template as RGB PIL image. See WheelTemplateHintRenderer.generate_hint()
+        """
+        key = template_render_hash(wt, hint_type=hint_type, resolution=resolution)
+        image = self._entries.get(key)
+        if image is None:
+            image = WheelTemplateHintRenderer(wt, resolution).generate_hint(hint_type)
+            self._entries.put(key, image)
+        return image
+
+    def stats(self):
+        return self._entries.stats()
+
+    def clear(self):
+        self._entries.clear()
+
+
+g_hint_cache = HintMapCache()
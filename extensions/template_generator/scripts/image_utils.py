@@ -1,7 +1,13 @@
 from PIL import Image
+import numpy as np
+import cairo
 from io import BytesIO
 import os
+import sys
 from base64 import b64encode, b64decode
+import struct
+import zlib
+from contextlib import contextmanager
 
 def pil_image_to_png_bytesio(im):
     bio = BytesIO()
@@ -11,35 +17,71 @@ def pil_image_to_png_bytesio(im):
 def pil_image_to_png_bytes(im):
     return pil_image_to_png_bytesio(im).getvalue()
     
-def cairo_svg_surface_to_png(svg_surface, fmt, alpha_channel=True):
+def cairo_image_surface_to_numpy(surface):
     """
-    @param format: Format of output PNG.
+    Zero-copy NumPy view of the pixels of a cairo ImageSurface, with shape (height, width, channels).
+    A8 surfaces have a single channel. ARGB32/RGB24 surfaces have 4 channels, in cairo's native-endian
+    order (BGRA on little-endian machines), with premultiplied alpha.
+    The view is valid as long as the surface isn't drawn on anymore.
+    """
+    surface.flush()
+    w, h, stride = surface.get_width(), surface.get_height(), surface.get_stride()
+    channels = 1 if surface.get_format() == cairo.FORMAT_A8 else 4
+    buf = np.ndarray(shape=(h, stride // channels, channels), dtype=np.uint8, buffer=surface.get_data())
+    return buf[:, :w, :]
+
+
+def cairo_image_surface_to_pil(surface):
+    """
+    Convert a cairo ImageSurface to a PIL image, without going through PNG.
+    A8 surfaces become a read-only "L" image that shares the surface's pixels (zero-copy). ARGB32 becomes "RGBA"
+    and RGB24 becomes "RGB": their pixels are unpacked into a copy, as PIL has no mode for cairo's native-endian
+    layout or its premultiplied alpha.
+    """
+    surface.flush()
+    fmt = surface.get_format()
+    size = (surface.get_width(), surface.get_height())
+    stride = surface.get_stride()
+    data = surface.get_data()
+    if fmt == cairo.FORMAT_A8:
+        return Image.frombuffer("L", size, data, "raw", "L", stride, 1)
+    if sys.byteorder == "little":
+        # Un-premultiplies the alpha while unpacking
+        rawmodes = {cairo.FORMAT_ARGB32: ("RGBA", "BGRa"), cairo.FORMAT_RGB24: ("RGB", "BGRX")}
+    else:
+        rawmodes = {cairo.FORMAT_ARGB32: ("RGBA", "aRGB"), cairo.FORMAT_RGB24: ("RGB", "XRGB")}
+    if fmt not in rawmodes:
+        raise Exception("Unsupported cairo surface format: %s" % str(fmt))
+    mode, rawmode = rawmodes[fmt]
+    return Image.frombuffer(mode, size, data, "raw", rawmode, stride, 1)
+
+
+def cairo_image_surface_to_output(surface, fmt):
+    """
+    @param fmt: Format of output.
                 None - Do nothing
+                "surface" - The cairo ImageSurface itself
+                "numpy" - Zero-copy NumPy view of the pixels (See cairo_image_surface_to_numpy())
                 "pil" - PIL image.
                 "bytes" - Raw PNG bytes
                 <file_path> - Save as PNG file instead of returning it
     """
-    bio = BytesIO()
-    svg_surface.write_to_png(bio)
-    im = None
-    if not alpha_channel:
-        im = Image.open(bio).convert("RGB")
-    
+    if fmt is None:
+        return None
     if fmt == "bytes" or fmt is bytes:
-        if im is not None:
-            bio = pil_image_to_png_bytesio(im)
+        bio = BytesIO()
+        surface.write_to_png(bio)
         return bio.getvalue()
+    elif fmt.upper() == "SURFACE":
+        return surface
+    elif fmt.upper() == "NUMPY":
+        return cairo_image_surface_to_numpy(surface)
     elif fmt.upper() == "PIL":
-        if im is not None:
-            return im
-        bio.seek(0)
-        return Image.open(bio)
+        return cairo_image_surface_to_pil(surface)
     elif fmt and isinstance(fmt, str):
         dirpath = os.path.dirname(fmt)
         if not dirpath or os.path.isdir(dirpath):
-            if im is not None:
-                bio = pil_image_to_png_bytesio(im)
-            open(fmt, "wb").write(bio.getvalue())
+            surface.write_to_png(fmt)
             
 def image_file_as_png_bytes(fpath):
     png_image = Image.open(fpath)
@@ -51,4 +93,204 @@ def image_file_as_png_bytes(fpath):
 def image_b64_to_pil(image_b64):
     if image_b64 is None:
         return image_b64
-    return Image.open(BytesIO(b64decode(image_b64)))
\ No newline at end of file
+    return Image.open(BytesIO(b64decode(image_b64)))
+
+
+@contextmanager
+def atomic_output_path(fpath):
+    """
+    Write a file aside and then move it in place, so readers never see a partial file.
+    Yields a temp path next to 'fpath' to write to, which is unique so concurrent writers of the same file don't
+    clash. It's moved to 'fpath' if the block completes, and removed otherwise.
+    """
+    tmp_fpath = "%s.%s.tmp" % (fpath, os.urandom(4).hex())
+    try:
+        yield tmp_fpath
+        os.replace(tmp_fpath, fpath)
+    finally:
+        if os.path.isfile(tmp_fpath):
+            os.remove(tmp_fpath)
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COLOR_TYPES = {"L": 0, "RGB": 2, "RGBA": 6}
+PNG_IDAT_SIZE = 1 << 20  # Max bytes of compressed data per IDAT chunk
+MODE_CHANNELS = {"L": 1, "RGB": 3, "RGBA": 4}
+
+
+class StreamingPngWriter(object):
+    """
+    Writes an 8-bit PNG file band by band of rows, compressing them as they come, so the whole image is never in
+    memory
+    """
+
+    def __init__(self, f, width, height, mode="RGBA", compresslevel=6):
+        """
+        @param f: Binary file object to write to
+        @param mode: PIL mode of the rows: "L", "RGB" or "RGBA"
+        """
+        if mode not in PNG_COLOR_TYPES:
+            raise Exception("Unsupported PNG mode: %s" % mode)
+        self._f = f
+        self._width = width
+        self._height = height
+        self._stride = width * MODE_CHANNELS[mode]
+        self._rows = 0
+        self._compressor = zlib.compressobj(compresslevel)
+        self._pending = []
+        self._pending_size = 0
+        f.write(PNG_SIGNATURE)
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[mode], 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self._f.write(struct.pack(">I", len(data)))
+        self._f.write(chunk_type)
+        self._f.write(data)
+        self._f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+    def _add_compressed(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= PNG_IDAT_SIZE:
+            self._flush_idat()
+
+    def _flush_idat(self):
+        if self._pending:
+            self._write_chunk(b"IDAT", b"".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def write_rows(self, data):
+        """
+        @param data: Bytes of whole rows, top to bottom
+        """
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, self._stride)
+        if self._rows + len(rows) > self._height:
+            raise Exception("More rows than the image height")
+        # Each row is prefixed by its filter type, 0 (None)
+        filtered = np.zeros((len(rows), self._stride + 1), dtype=np.uint8)
+        filtered[:, 1:] = rows
+        self._add_compressed(self._compressor.compress(filtered.tobytes()))
+        self._rows += len(rows)
+
+    def close(self):
+        if self._rows != self._height:
+            raise Exception("Got %d rows of %d" % (self._rows, self._height))
+        self._add_compressed(self._compressor.flush())
+        self._flush_idat()
+        self._write_chunk(b"IEND", b"")
+
+
+class StreamingTiffWriter(object):
+    """
+    Writes an 8-bit TIFF file band by band of rows, as strips of 'rows_per_strip' rows (optionally deflate
+    compressed), so the whole image is never in memory. The file object must be seekable.
+    """
+
+    def __init__(self, f, width, height, mode="RGBA", rows_per_strip=256, compress=True):
+        if mode not in MODE_CHANNELS:
+            raise Exception("Unsupported TIFF mode: %s" % mode)
+        self._f = f
+        self._width = width
+        self._height = height
+        self._mode = mode
+        self._stride = width * MODE_CHANNELS[mode]
+        self._rows_per_strip = max(1, min(rows_per_strip, height))
+        self._compress = compress
+        self._rows = 0
+        self._buffer = []
+        self._buffer_rows = 0
+        self._strip_offsets = []
+        self._strip_sizes = []
+        self._start = f.tell()
+        # Little-endian header, with the IFD offset written on close
+        f.write(b"II*\x00\x00\x00\x00\x00")
+
+    def _offset(self):
+        return self._f.tell() - self._start
+
+    def _write_strip(self, data):
+        if self._compress:
+            data = zlib.compress(data)
+        self._strip_offsets.append(self._offset())
+        self._strip_sizes.append(len(data))
+        self._f.write(data)
+
+    def write_rows(self, data):
+        """
+        @param data: Bytes of whole rows, top to bottom
+        """
+        n = len(data) // self._stride
+        if self._rows + n > self._height:
+            raise Exception("More rows than the image height")
+        self._rows += n
+        start = 0
+        while start < n:
+            take = min(n - start, self._rows_per_strip - self._buffer_rows)
+            self._buffer.append(data[start * self._stride:(start + take) * self._stride])
+            self._buffer_rows += take
+            start += take
+            if self._buffer_rows == self._rows_per_strip:
+                self._write_strip(b"".join(self._buffer))
+                self._buffer = []
+                self._buffer_rows = 0
+
+    def _write_array(self, fmt, values):
+        if self._offset() % 2:
+            self._f.write(b"\x00")
+        offset = self._offset()
+        self._f.write(struct.pack("<%d%s" % (len(values), fmt), *values))
+        return offset
+
+    def close(self):
+        if self._buffer_rows:
+            self._write_strip(b"".join(self._buffer))
+            self._buffer = []
+            self._buffer_rows = 0
+        if self._rows != self._height:
+            raise Exception("Got %d rows of %d" % (self._rows, self._height))
+
+        channels = MODE_CHANNELS[self._mode]
+        SHORT, LONG = 3, 4
+        # (tag, type, count, value or offset of the values)
+        entries = []
+        if channels > 1:
+            entries.append((258, SHORT, channels, self._write_array("H", [8] * channels)))
+        else:
+            entries.append((258, SHORT, 1, 8))
+        if len(self._strip_offsets) > 1:
+            strip_offsets = (LONG, len(self._strip_offsets), self._write_array("I", self._strip_offsets))
+            strip_sizes = (LONG, len(self._strip_sizes), self._write_array("I", self._strip_sizes))
+        else:
+            strip_offsets = (LONG, 1, self._strip_offsets[0])
+            strip_sizes = (LONG, 1, self._strip_sizes[0])
+        entries += [
+            (256, LONG, 1, self._width),
+            (257, LONG, 1, self._height),
+            (259, SHORT, 1, 8 if self._compress else 1),  # Adobe deflate or none
+            (262, SHORT, 1, 1 if channels == 1 else 2),  # BlackIsZero or RGB
+            (273,) + strip_offsets,
+            (277, SHORT, 1, channels),
+            (278, LONG, 1, self._rows_per_strip),
+            (279,) + strip_sizes,
+            (284, SHORT, 1, 1),  # Chunky
+        ]
+        if self._mode == "RGBA":
+            entries.append((338, SHORT, 1, 2))  # Unassociated alpha
+        entries.sort()
+
+        if self._offset() % 2:
+            self._f.write(b"\x00")
+        ifd_offset = self._offset()
+        self._f.write(struct.pack("<H", len(entries)))
+        for tag, typ, count, value in entries:
+            if typ == SHORT and count == 1:
+                self._f.write(struct.pack("<HHIHH", tag, typ, count, value, 0))
+            else:
+                self._f.write(struct.pack("<HHII", tag, typ, count, value))
+        self._f.write(struct.pack("<I", 0))
+        end = self._f.tell()
+        self._f.seek(self._start + 4)
+        self._f.write(struct.pack("<I", ifd_offset))
+        self._f.seek(end)
@@ -0,0 +1,97 @@
+import time
+import threading
+
+
+DEFAULT_MIN_INTERVAL = 0.1  # Seconds between the starts of consecutive renders of a session
+SESSION_TTL = 3600.0  # Seconds after which an idle session is forgotten
+
+
+class _Session(object):
+    def __init__(self):
+        self.seq = 0  # Sequence number of the latest call
+        self.busy = False  # Whether a call is running
+        self.waiting = 0  # Number of calls waiting for their turn
+        self.next_start = 0.0  # Earliest time the next call may start
+        self.last_used = 0.0
+
+
+class LatestWinsCoalescer(object):
+    """
+    Coalesces bursts of calls (e.g. live updates while a slider is dragged) per session key:
+    - Only one call of a session runs at a time, and calls start at most once per 'min_interval' seconds.
+    - A call that is still waiting for its turn when a later call of the same session arrives is dropped,
+      as its result would be superseded anyway.
+    - The latest call is never dropped, so the final state is always delivered.
+    Calls of different sessions don't affect each other.
+    """
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, session_ttl=SESSION_TTL):
+        self.min_interval = min_interval
+        self.session_ttl = session_ttl
+        self.calls = 0
+        self.runs = 0
+        self.dropped = 0
+        self._sessions = {}
+        self._cond = threading.Condition()
+
+    def _get_session(self, key, now):
+        session = self._sessions.get(key, None)
+        if session is None:
+            self._forget_idle_sessions(now)
+            session = self._sessions[key] = _Session()
+        session.last_used = now
+        return session
+
+    def _forget_idle_sessions(self, now):
+        for key, session in list(self._sessions.items()):
+            if not session.busy and not session.waiting and now - session.last_used > self.session_ttl:
+                del self._sessions[key]
+
+    def run(self, key, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) when it's the turn of this call, unless a later call of the same session
+        supersedes it first.
+        Returns (True, the result of func) if it was called, or (False, None) if it was dropped
+        """
+        with self._cond:
+            now = time.time()
+            self.calls += 1
+            session = self._get_session(key, now)
+            session.seq += 1
+            seq = session.seq
+            # Wake up the earlier waiting calls, so they see they're superseded
+            self._cond.notify_all()
+            session.waiting += 1
+            try:
+                while True:
+                    if session.seq != seq:
+                        self.dropped += 1
+                        return False, None
+                    if session.busy:
+                        self._cond.wait()
+                        continue
+                    delay = session.next_start - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+            finally:
+                session.waiting -= 1
+            session.busy = True
+            session.next_start = time.time() + self.min_interval
+            self.runs += 1
+
+        try:
+            return True, func(*args, **kwargs)
+        finally:
+            with self._cond:
+                session.busy = False
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "sessions": len(self._sessions),
+                "calls": self.calls,
+                "runs": self.runs,
+                "dropped": self.dropped,
+            }
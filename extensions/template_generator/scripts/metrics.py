@@ -0,0 +1,158 @@
+"""
+Lightweight in-process metrics of the wheel design flow.
+Code sections are timed with span() into the global registry, which keeps per-span counts and the recent durations
+(for percentiles). The spans timed within a trace() are also passed to the registry's sinks when the trace ends,
+so a whole design generation can be logged as a single line with its breakdown.
+"""
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+MAX_SAMPLES = 1000  # Recent durations kept per span, for the percentiles
+PERCENTILES = (50, 90, 99)
+
+
+class _SpanStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=MAX_SAMPLES)
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._spans = {}  # name -> _SpanStats
+        self._stats_funcs = {}  # name -> function that returns a JSON-able dict
+        self._sinks = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, error=False):
+        with self._lock:
+            stats = self._spans.get(name, None)
+            if stats is None:
+                stats = self._spans[name] = _SpanStats()
+            stats.count += 1
+            stats.errors += int(error)
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.recent.append(seconds)
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace.append((name, seconds))
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time the code in the with statement as span 'name'. Exceptions are counted as errors of the span.
+        """
+        t_start = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.record(name, time.perf_counter() - t_start, error)
+
+    @contextmanager
+    def trace(self, name):
+        """
+        Time the code in the with statement as span 'name', and pass it, with the spans timed within it (in this
+        thread), to the sinks
+        """
+        outer_trace = getattr(self._local, "trace", None)
+        self._local.trace = []
+        t_start = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            seconds = time.perf_counter() - t_start
+            spans = self._local.trace
+            self._local.trace = outer_trace
+            self.record(name, seconds, error)
+            for sink in list(self._sinks):
+                try:
+                    sink(name, seconds, spans, error)
+                except Exception as e:
+                    print("Error in metrics sink: %s" % str(e))
+
+    def add_sink(self, sink):
+        """
+        @param sink: Called as sink(trace name, seconds, list of (span name, seconds), error) when a trace ends
+        """
+        if sink not in self._sinks:
+            self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self._sinks:
+            self._sinks.remove(sink)
+
+    def register_stats(self, name, stats_func):
+        """
+        Include the stats of another component (e.g. a cache) in the snapshot
+        """
+        self._stats_funcs[name] = stats_func
+
+    def snapshot(self):
+        """
+        Returns dict with the stats of all spans (durations in milliseconds), and of the registered components
+        """
+        spans = {}
+        with self._lock:
+            items = [(name, stats.count, stats.errors, stats.total, stats.max, list(stats.recent))
+                     for name, stats in self._spans.items()]
+        for name, count, errors, total, max_seconds, recent in items:
+            res = {
+                "count": count,
+                "errors": errors,
+                "total_s": round(total, 3),
+                "mean_ms": round(total * 1000 / count, 3),
+                "max_ms": round(max_seconds * 1000, 3),
+            }
+            recent_ms = np.array(recent) * 1000
+            for p in PERCENTILES:
+                res["p%d_ms" % p] = round(float(np.percentile(recent_ms, p)), 3)
+            spans[name] = res
+
+        stats = {}
+        for name, stats_func in list(self._stats_funcs.items()):
+            try:
+                stats[name] = stats_func()
+            except Exception as e:
+                stats[name] = {"error": str(e)}
+        return {"spans": spans, "stats": stats}
+
+    def reset(self):
+        with self._lock:
+            self._spans = {}
+
+
+def format_trace(name, seconds, spans, error=False):
+    """
+    One line summary of a trace, with the total time of each span in it
+    """
+    totals = {}
+    for span_name, span_seconds in spans:
+        totals[span_name] = totals.get(span_name, 0.0) + span_seconds
+    breakdown = ", ".join("%s %.3fs" % (span_name, span_seconds) for span_name, span_seconds in totals.items())
+    return "%s%s %.3fs: %s" % (name, " (failed)" if error else "", seconds, breakdown or "-")
+
+
+g_metrics = MetricsRegistry()
+
+
+def span(name):
+    return g_metrics.span(name)
+
+
+def trace(name):
+    return g_metrics.trace(name)
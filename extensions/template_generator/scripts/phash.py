@@ -0,0 +1,223 @@
+"""
+Perceptual hashes of designed wheel images, for finding near-duplicates among them.
+An image's hash is 64 bits: the signs (relative to their median) of the lowest 8x8 DCT coefficients of the image,
+scaled down to 32x32 grayscale. Visually similar images have hashes within a small Hamming distance, which
+MultiIndexHash looks up without comparing against every stored hash.
+"""
+from math import pi, sqrt
+
+import numpy as np
+from PIL import Image
+
+
+DCT_SIZE = 32  # Images are scaled to DCT_SIZE x DCT_SIZE before the transform
+HASH_SIZE = 8  # The lowest HASH_SIZE x HASH_SIZE coefficients make the 64-bit hash
+DEFAULT_RADIUS = 6  # Max Hamming distance of near-duplicates
+
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II, so the transform of X is M @ X @ M.T
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(pi * (2 * i + 1) * k / (2.0 * n)) * sqrt(2.0 / n)
+    m[0] /= sqrt(2.0)
+    return m
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def image_pixels(im):
+    """
+    Returns the DCT_SIZE x DCT_SIZE grayscale pixels of a PIL image, as the input of phash_arrays()
+    """
+    return np.asarray(im.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+
+
+def phash_arrays(pixels):
+    """
+    Perceptual hashes of a stack of images, all transformed at once
+    @param pixels: (N, DCT_SIZE, DCT_SIZE) array, as returned by image_pixels()
+    Returns uint64 array of N hashes
+    """
+    pixels = np.asarray(pixels, dtype=np.float64)
+    coeffs = _DCT @ pixels @ _DCT.T
+    low = coeffs[:, :HASH_SIZE, :HASH_SIZE].reshape(len(pixels), HASH_SIZE * HASH_SIZE)
+    # The DC coefficient is the mean brightness, which would skew the median
+    median = np.median(low[:, 1:], axis=1)
+    bits = low > median[:, None]
+    return np.packbits(bits, axis=1).view(">u8").astype(np.uint64).reshape(-1)
+
+
+def phash_images(images):
+    """
+    @param images: List of PIL images
+    Returns uint64 array of their hashes
+    """
+    if not images:
+        return np.zeros(0, dtype=np.uint64)
+    return phash_arrays(np.stack([image_pixels(im) for im in images]))
+
+
+def phash_file(fpath):
+    with Image.open(fpath) as im:
+        return int(phash_arrays(image_pixels(im)[None])[0])
+
+
+def phash_to_hex(phash):
+    return "%016x" % int(phash)
+
+
+def phash_from_hex(phash_hex):
+    return int(phash_hex, 16)
+
+
+if hasattr(np, "bitwise_count"):
+    def popcount64(values):
+        return np.bitwise_count(np.asarray(values, dtype=np.uint64)).astype(np.int64)
+else:
+    _POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+    def popcount64(values):
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return _POPCOUNT8[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def hamming_distances(hashes, phash):
+    """
+    Returns int array of the Hamming distances between every hash in 'hashes' and 'phash'
+    """
+    return popcount64(np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(phash)))
+
+
+def unique_indices(hashes, radius=DEFAULT_RADIUS):
+    """
+    Drop near-duplicates from a small set of hashes (e.g. the images of one design), comparing all pairs.
+    A hash is dropped if it's within 'radius' of an earlier hash that's kept.
+    Returns list of the indices of the kept hashes, in order
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    distances = popcount64(np.bitwise_xor(hashes[:, None], hashes[None, :]))
+    kept = []
+    for i in range(len(hashes)):
+        if not kept or distances[i, kept].min() > radius:
+            kept.append(i)
+    return kept
+
+
+class MultiIndexHash(object):
+    """
+    Index of 64-bit hashes for Hamming radius lookups (multi-index hashing).
+    The hash bits are split into radius + 1 disjoint chunks, and the hashes are sorted by the value of each chunk.
+    Hashes within the radius of each other must agree exactly on at least one chunk (pigeonhole principle), so a
+    lookup only compares the query with the hashes that share a chunk value with it - a few binary searches and a
+    small vectorized comparison, rather than a scan of all hashes.
+    Lookups are valid for any radius up to the index's.
+    """
+
+    def __init__(self, hashes=(), radius=DEFAULT_RADIUS):
+        self.radius = radius
+        bounds = np.linspace(0, 64, radius + 2).astype(int).tolist()
+        # (shift, mask) of each chunk
+        self._chunks = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._tables = None  # Per chunk: (sorted chunk values, hash ids in that order). None - must be rebuilt
+        self.add(hashes)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    @property
+    def hashes(self):
+        """
+        uint64 array of the hashes, indexed by id
+        """
+        return self._hashes
+
+    def add(self, hashes):
+        """
+        Add hashes, whose ids continue the ids of the ones already added. Once the index was looked up, added
+        hashes are merged into its sorted chunk tables rather than re-sorting them, which still costs a copy of the
+        tables, so add many hashes at once rather than one by one.
+        Returns the ids of the added hashes
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+        first = len(self._hashes)
+        ids = np.arange(first, first + len(hashes))
+        if len(hashes):
+            self._hashes = np.concatenate([self._hashes, hashes])
+            if self._tables is not None:
+                self._tables = [self._merge(table, hashes, ids, shift, mask)
+                                for (shift, mask), table in zip(self._chunks, self._tables)]
+        return ids
+
+    @staticmethod
+    def _merge(table, hashes, ids, shift, mask):
+        values, order = table
+        new_values = (hashes >> np.uint64(shift)) & np.uint64(mask)
+        new_order = np.argsort(new_values, kind="stable")
+        new_values = new_values[new_order]
+        # After the equal values already in the table, as a stable sort of all the hashes would place them
+        at = values.searchsorted(new_values, side="right")
+        return np.insert(values, at, new_values), np.insert(order, at, ids[new_order])
+
+    def _build(self):
+        self._tables = []
+        for shift, mask in self._chunks:
+            values = (self._hashes >> np.uint64(shift)) & np.uint64(mask)
+            order = np.argsort(values, kind="stable")
+            self._tables.append((values[order], order))
+
+    def query(self, phash, radius=None):
+        """
+        Returns sorted int array of the ids of the hashes within 'radius' (default: the index's) of 'phash'
+        """
+        if radius is None:
+            radius = self.radius
+        elif radius > self.radius:
+            raise Exception("Radius %d is larger than the index's (%d)" % (radius, self.radius))
+        if self._tables is None:
+            self._build()
+        phash = int(phash)
+        candidates = []
+        for (shift, mask), (values, ids) in zip(self._chunks, self._tables):
+            value = (phash >> shift) & mask
+            # The range of the chunk value, i.e. [value, value + 1)
+            lo, hi = values.searchsorted(np.array([value, value + 1], dtype=np.uint64)).tolist()
+            if hi > lo:
+                candidates.append(ids[lo:hi])
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        # A near hash may share several chunks with the query, so it's deduplicated after filtering
+        candidates = np.concatenate(candidates)
+        return np.unique(candidates[hamming_distances(self._hashes[candidates], phash) <= radius])
+
+
+def group_near_duplicates(hashes, radius=DEFAULT_RADIUS, index=None):
+    """
+    Group hashes that are within 'radius' of each other, transitively (union-find over the near pairs).
+    @param index: MultiIndexHash of exactly these hashes, if already built
+    Returns list of groups of 2 or more indices (ascending), ordered by their first index
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    if index is None:
+        index = MultiIndexHash(hashes, max(radius, 0))
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, phash in enumerate(hashes.tolist()):
+        for j in index.query(phash, radius).tolist():
+            if j > i:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in range(len(hashes)):
+        groups.setdefault(find(i), []).append(i)
+    return [group for root, group in sorted(groups.items()) if len(group) > 1]
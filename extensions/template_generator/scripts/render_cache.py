@@ -0,0 +1,246 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+from cairo import ImageSurface, RecordingSurface, Context, Content, Rectangle, FORMAT_ARGB32, FORMAT_RGB24, FORMAT_A8
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate, WheelTemplateRenderer
+    from image_utils import cairo_image_surface_to_output
+    from cache_utils import LruCache
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate, WheelTemplateRenderer
+    from scripts.image_utils import cairo_image_surface_to_output
+    from scripts.cache_utils import LruCache
+
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024  # Total size of cached images (uncompressed)
+DEFAULT_LAYERS_MAX_BYTES = 256 * 1024 * 1024  # Total size of cached layer surfaces
+MAX_RECORDINGS = 32  # Recorded template drawings kept by TemplateRenderCache, for rendering more sizes later
+# Specs that don't affect how a template is drawn, left out of the keys of rendered images
+NON_RENDER_ARGS = ("required_coverage_area",)
+
+
+def _canonical(value):
+    # Make equal specs serialize equally, no matter if given as int/float or tuple/list (e.g. after a JSON round trip)
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    raise TypeError("Can't hash value of type %s" % str(type(value)))
+
+
+def template_spec_hash(wt, **extra):
+    """
+    Canonical hash of the specs of a wheel template, together with any extra (render) options
+    """
+    assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
+    return _specs_hash(wt.to_dict(), extra)
+
+
+def template_render_hash(wt, **extra):
+    """
+    Like template_spec_hash(), but only of the specs that affect the rendered image (e.g. not the required
+    coverage area), so templates that render the same share a key
+    """
+    assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
+    specs = {arg: value for arg, value in wt.to_dict().items() if arg not in NON_RENDER_ARGS}
+    return _specs_hash(specs, extra)
+
+
+def _specs_hash(specs, extra):
+    canon = {"specs": _canonical(specs), "extra": _canonical(extra)}
+    data = json.dumps(canon, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _surface_nbytes(surface):
+    return surface.get_stride() * surface.get_height()
+
+
+def _image_nbytes(im):
+    return im.width * im.height * len(im.getbands())
+
+
+class LayerCache(LruCache):
+    """
+    Bounded LRU cache of rendered layer surfaces, shared by all WheelTemplateLayeredRenderer instances
+    """
+
+    def __init__(self, max_bytes=DEFAULT_LAYERS_MAX_BYTES):
+        super().__init__(max_bytes, _surface_nbytes)
+
+
+g_layer_cache = LayerCache()
+
+
+class WheelTemplateLayeredRenderer(WheelTemplateRenderer):
+    """
+    Raster renderer that keeps each wheel component as a separately cached layer, and composites the layers
+    on output. Layers are keyed only by the specs that affect them, so e.g. changing the spokes angle
+    re-rasterizes only the spokes layer. SVG output is drawn directly, as in WheelTemplateRenderer.
+    """
+    # Specs affecting each layer (besides the canvas size and the rim diameter, which set the scale)
+    LAYER_ARGS = OrderedDict([
+        ("rim", ("rim_width",)),
+        ("hub_and_lug_nuts", ("hub_diameter", "hub_width", "lug_nut_count", "lug_nut_diameter",
+                              "lug_nuts_init_angle", "bolt_circle_diameter")),
+        ("spokes", ("rim_width", "hub_diameter", "spoke_count", "spoke_central_angle", "spokes_init_angle")),
+    ])
+    # Parts whose geometric errors change how each layer is drawn
+    LAYER_PARTS = {
+        "rim": (WheelTemplate.RIM,),
+        "hub_and_lug_nuts": (WheelTemplate.HUB, WheelTemplate.LUG_NUTS),
+        "spokes": (WheelTemplate.SPOKES,),
+    }
+
+    def __init__(self, wt, layer_cache=None):
+        super().__init__(wt)
+        self._layer_cache = layer_cache or g_layer_cache
+
+    def _layer_key(self, name):
+        specs = self._wt.to_dict()
+        key = {arg: specs[arg] for arg in ("canvas_size", "rim_diameter") + self.LAYER_ARGS[name]}
+        key["layer"] = name
+        key["err_parts"] = [part for part in self.LAYER_PARTS[name] if part in self._err_parts]
+        key["draw_color"] = self._draw_color
+        data = json.dumps(_canonical(key), sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _get_layer(self, name):
+        key = self._layer_key(name)
+        layer = self._layer_cache.get(key)
+        if layer is None:
+            layer = ImageSurface(FORMAT_ARGB32, int(round(self._canvas_w)), int(round(self._canvas_h)))
+            self._create_context(layer)
+            getattr(self, "_draw_" + name)()
+            layer.flush()
+            self._layer_cache.put(key, layer)
+        return layer
+
+    def _draw_raster(self, surface):
+        ctx = Context(surface)
+        for name in self.LAYER_ARGS:
+            ctx.set_source_surface(self._get_layer(name), 0, 0)
+            ctx.paint()
+        surface.flush()
+
+
+class WheelTemplateRecordingRenderer(WheelTemplateRenderer):
+    """
+    Records the drawing of a wheel template once, on a cairo RecordingSurface in scene units (inches), and replays
+    it at any raster size. Replaying transforms the recorded paths, so each size is as sharp as a direct render.
+    The canvas size of the template doesn't matter.
+    """
+
+    def __init__(self, wt, color_errors=False, draw_color=None):
+        super().__init__(wt)
+        # Record in scene units
+        self._x_pixels_per_inch = self._y_pixels_per_inch = 1.0
+        self._prepare_render(color_errors, draw_color)
+        self._recording = RecordingSurface(Content.COLOR_ALPHA,
+                                           Rectangle(0, 0, self._scene_length, self._scene_length))
+        self._draw_on_surface(self._recording)
+        self._ctx = None
+
+    def replay(self, size, fmt="pil", alpha_channel=True, mask=False):
+        """
+        Render the recorded drawing on a raster of the given size
+        @param size: (width, height) in pixels
+        Other params are as in WheelTemplateRenderer.generate_raster()
+        """
+        w, h = int(round(size[0])), int(round(size[1]))
+        if mask:
+            surface_fmt = FORMAT_A8
+        elif alpha_channel:
+            surface_fmt = FORMAT_ARGB32
+        else:
+            # No alpha channel - the shapes are drawn on black background
+            surface_fmt = FORMAT_RGB24
+        surface = ImageSurface(surface_fmt, w, h)
+        ctx = Context(surface)
+        ctx.scale(w / self._scene_length, h / self._scene_length)
+        ctx.set_source_surface(self._recording, 0, 0)
+        ctx.paint()
+        return cairo_image_surface_to_output(surface, fmt)
+
+
+class TemplateRenderCache(object):
+    """
+    Bounded LRU cache of rendered wheel templates (PIL images) and their calc_areas() results,
+    keyed by the canonical hash of the template specs and render options.
+    The cached images are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self._entries = LruCache(max_bytes, lambda entry: _image_nbytes(entry[0]))  # key -> (image, areas)
+        self._recordings = LruCache(MAX_RECORDINGS)  # key -> WheelTemplateRecordingRenderer
+
+    def render(self, wt, color_errors=False, draw_color=None, alpha_channel=True):
+        """
+        Render the template as a PIL image, like WheelTemplateRenderer.generate_raster("pil", ...), unless it's
+        already cached.
+        Returns (PIL image, calc_areas() result, or None if the template has geometric errors)
+        """
+        draw_color = draw_color or WheelTemplateRenderer.DEFAULT_DRAW_COLOR
+        key = template_render_hash(wt, color_errors=color_errors, draw_color=draw_color, alpha_channel=alpha_channel)
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry[0], entry[1]
+
+        image = WheelTemplateLayeredRenderer(wt).generate_raster("pil", color_errors=color_errors,
+                                                                 draw_color=draw_color, alpha_channel=alpha_channel)
+        errors, _err_parts = wt.check_errors_in_geometry()
+        areas = None if errors else wt.calc_areas()
+        self._entries.put(key, (image, areas))
+        return image, areas
+
+    def _get_recording(self, wt, color_errors, draw_color):
+        # The recording is the same for all canvas sizes, so they're all keyed as one
+        key = template_render_hash(WheelTemplate(**dict(wt.to_dict(), canvas_size=(1, 1))),
+                                 color_errors=color_errors, draw_color=draw_color)
+        recording = self._recordings.get(key)
+        if recording is None:
+            recording = WheelTemplateRecordingRenderer(wt, color_errors, draw_color)
+            self._recordings.put(key, recording)
+        return recording
+
+    def render_sizes(self, wt, sizes, color_errors=False, draw_color=None, alpha_channel=True):
+        """
+        Render the template at several canvas sizes, by replaying a single recording of its drawing (See
+        WheelTemplateRecordingRenderer), unless they're already cached. Each size is cached as render() of the
+        template with that canvas size would, so the two share their entries.
+        @param sizes: List of (width, height) in pixels
+        Returns (list of PIL images in the order of 'sizes', calc_areas() result, or None if the template has
+                 geometric errors)
+        """
+        draw_color = draw_color or WheelTemplateRenderer.DEFAULT_DRAW_COLOR
+        errors, _err_parts = wt.check_errors_in_geometry()
+        areas = None if errors else wt.calc_areas()
+        specs = wt.to_dict()
+        images = []
+        for size in sizes:
+            sized_wt = WheelTemplate(**dict(specs, canvas_size=tuple(size)))
+            key = template_render_hash(sized_wt, color_errors=color_errors, draw_color=draw_color,
+                                     alpha_channel=alpha_channel)
+            entry = self._entries.get(key)
+            if entry is not None:
+                images.append(entry[0])
+                continue
+            image = self._get_recording(wt, color_errors, draw_color).replay(size, "pil", alpha_channel)
+            self._entries.put(key, (image, areas))
+            images.append(image)
+        return images, areas
+
+    def stats(self):
+        return dict(self._entries.stats(), recordings=len(self._recordings))
+
+    def clear(self):
+        self._entries.clear()
+        self._recordings.clear()
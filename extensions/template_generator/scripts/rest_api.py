@@ -0,0 +1,251 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional
+from secrets import compare_digest
+from urllib.parse import quote
+
+from fastapi import HTTPException, Depends
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.responses import FileResponse, StreamingResponse
+
+try:
+    # For standalone mode
+    from thumbnails import template_previews, get_thumbnail, PREVIEW_PAGE_SIZE
+    from catalog import NUMERIC_COLUMNS, TEMPLATES, DESIGNS
+    from design_archive import read_design_dir, design_zip_entries, iter_zip_stream, iter_designs_zip_stream, \
+        backfill_design_phashes
+    from metrics import g_metrics
+    from phash import MultiIndexHash, group_near_duplicates, hamming_distances, phash_to_hex, DEFAULT_RADIUS
+except ImportError:
+    # For 'webui' mode
+    from scripts.thumbnails import template_previews, get_thumbnail, PREVIEW_PAGE_SIZE
+    from scripts.catalog import NUMERIC_COLUMNS, TEMPLATES, DESIGNS
+    from scripts.design_archive import read_design_dir, design_zip_entries, iter_zip_stream, \
+        iter_designs_zip_stream, backfill_design_phashes
+    from scripts.metrics import g_metrics
+    from scripts.phash import MultiIndexHash, group_near_duplicates, hamming_distances, phash_to_hex, \
+        DEFAULT_RADIUS
+
+
+API_PREFIX = "/wheel-power"
+MAX_PAGE_SIZE = 200
+MAX_PHASH_RADIUS = 16  # Of near-duplicate lookups. Larger radii match unrelated images
+MAX_ZIP_COMPRESSLEVEL = 9
+
+
+class _DesignPhashIndex(object):
+    """
+    MultiIndexHash of the perceptual hashes of all saved designed images. Hashes added to the catalog are added to
+    the index, which is rebuilt only when the catalog's hashes were removed or replaced, or for a larger radius
+    """
+
+    def __init__(self, catalog, designs_dir, blob_store):
+        self.catalog = catalog
+        self.designs_dir = designs_dir
+        self.blob_store = blob_store
+        self._lock = threading.Lock()
+        self._version = None  # The catalog's phash_version as of the index
+        self._removals = None  # The catalog's phash_removals as of the index
+        self._last_rowid = 0  # Of the last catalog hash in the index
+        self._backfilled_version = None  # The catalog's phash_version after the last backfill
+        self._entries = []  # (design dir, image index) of each hash id
+        self._ids = {}  # (design dir, image index) -> hash id
+        self._index = None
+
+    @contextmanager
+    def get(self, radius):
+        """
+        Yields (list of (design dir, image index) of each hash id, dict of the reverse mapping, MultiIndexHash
+        valid for 'radius'). They're updated in place, so they may be used only within the 'with' block.
+        """
+        with self._lock:
+            # Every design added or changed since the last backfill changed the version
+            if self.catalog.phash_version != self._backfilled_version:
+                with g_metrics.span("phash_backfill"):
+                    backfill_design_phashes(self.catalog, self.designs_dir, self.blob_store)
+                self._backfilled_version = self.catalog.phash_version
+            # Taken before reading the hashes, so a change made meanwhile is read on the next call
+            version, removals = self.catalog.phash_version, self.catalog.phash_removals
+            if self._index is None or radius > self._index.radius or removals != self._removals:
+                with g_metrics.span("phash_index"):
+                    self._entries, self._ids, self._last_rowid = [], {}, 0
+                    self._index = MultiIndexHash((), max(radius, DEFAULT_RADIUS))
+                    self._add_rows(self.catalog.design_phashes())
+            elif version != self._version:
+                with g_metrics.span("phash_index_add"):
+                    self._add_rows(self.catalog.design_phashes(self._last_rowid))
+            self._version, self._removals = version, removals
+            yield self._entries, self._ids, self._index
+
+    def _add_rows(self, rows):
+        # Must be called with the lock held
+        if not rows:
+            return
+        ids = self._index.add([phash for _rowid, _dirname, _index, phash in rows])
+        for hash_id, (_rowid, dirname, index, _phash) in zip(ids.tolist(), rows):
+            self._entries.append((dirname, index))
+            self._ids[(dirname, index)] = hash_id
+        self._last_rowid = rows[-1][0]
+
+
+def _check_radius(radius):
+    if not (0 <= radius <= MAX_PHASH_RADIUS):
+        raise HTTPException(status_code=422, detail="radius must be between 0 and %d" % MAX_PHASH_RADIUS)
+
+
+def _check_compresslevel(compresslevel):
+    if compresslevel is not None and not (0 <= compresslevel <= MAX_ZIP_COMPRESSLEVEL):
+        raise HTTPException(status_code=422, detail="compresslevel must be between 0 and %d" % MAX_ZIP_COMPRESSLEVEL)
+
+
+def _saved_dirpath(base_dir, dirname, kind_name="template"):
+    # Only direct sub-dirs of the base dir
+    if not dirname or dirname != os.path.basename(dirname) or dirname in (".", ".."):
+        raise HTTPException(status_code=404, detail="No such %s" % kind_name)
+    dirpath = os.path.join(base_dir, dirname)
+    if not os.path.isdir(dirpath):
+        raise HTTPException(status_code=404, detail="No such %s" % kind_name)
+    return dirpath
+
+
+def _auth_dependencies(api_auth):
+    """
+    Route dependencies that require the same HTTP basic credentials as the WebUI API (its --api-auth option)
+    @param api_auth: The credentials as given to --api-auth, "user:password" pairs separated by commas, or None
+    """
+    if not api_auth:
+        return []
+    credentials = dict(auth.split(":", 1) for auth in api_auth.split(","))
+
+    def auth(creds: HTTPBasicCredentials = Depends(HTTPBasic())):
+        if creds.username in credentials and compare_digest(creds.password, credentials[creds.username]):
+            return True
+        raise HTTPException(status_code=401, detail="Incorrect username or password",
+                            headers={"WWW-Authenticate": "Basic"})
+
+    return [Depends(auth)]
+
+
+def _zip_response(chunks, fname):
+    return StreamingResponse(chunks, media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="%s"' % fname})
+
+
+def mount_routes(app, catalog, templates_dir, designs_dir, blob_store, api_auth=None, zip_compresslevel=None):
+    """
+    Add the extension's HTTP API to the WebUI FastAPI app
+    @param api_auth: Credentials required by all routes, as given to the WebUI's --api-auth option, or None
+    @param zip_compresslevel: Returns the compression level of the exported ZIP archives when a request doesn't
+                              give one (See design_archive.iter_zip_stream()), or None for zlib's default
+    """
+    deps = _auth_dependencies(api_auth)
+
+    def compresslevel_or_default(compresslevel):
+        _check_compresslevel(compresslevel)
+        if compresslevel is None and zip_compresslevel is not None:
+            return zip_compresslevel()
+        return compresslevel
+    phash_index = _DesignPhashIndex(catalog, designs_dir, blob_store)
+
+    @app.get(API_PREFIX + "/templates", dependencies=deps)
+    def list_templates(search: str = "", page: int = 0, page_size: int = PREVIEW_PAGE_SIZE):
+        """
+        A page of saved templates that match the search string, most recent first, with their thumbnail URLs
+        """
+        if page < 0 or not (0 < page_size <= MAX_PAGE_SIZE):
+            raise HTTPException(status_code=422, detail="Invalid page or page_size")
+        try:
+            previews, total = template_previews(catalog, templates_dir, search, page, page_size)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        templates = []
+        for _thumb_fpath, row in previews:
+            item = {k: row[k] for k in ["dir"] + NUMERIC_COLUMNS[TEMPLATES]}
+            item["thumbnail_url"] = "%s/templates/%s/thumbnail" % (API_PREFIX, quote(row["dir"]))
+            templates.append(item)
+        return {"total": total, "page": page, "page_size": page_size, "templates": templates}
+
+    @app.get(API_PREFIX + "/templates/{dirname}/thumbnail", dependencies=deps)
+    def template_thumbnail(dirname: str):
+        dirpath = _saved_dirpath(templates_dir, dirname)
+        try:
+            fpath = get_thumbnail(dirpath)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail="Error producing thumbnail: %s" % str(e))
+        return FileResponse(fpath, media_type="image/png")
+
+    @app.get(API_PREFIX + "/metrics", dependencies=deps)
+    def metrics():
+        """
+        Timings of the stages of the design flow (See metrics.py), and stats of the caches and the job queue
+        """
+        return g_metrics.snapshot()
+
+    @app.get(API_PREFIX + "/designs/export", dependencies=deps)
+    def export_designs(search: str = "", compresslevel: Optional[int] = None):
+        """
+        ZIP archive of all saved designs that match the search string, each in a dir named as its design dir.
+        It's streamed as it's produced, one design at a time
+        """
+        compresslevel = compresslevel_or_default(compresslevel)
+        dirnames = []
+        try:
+            while True:
+                rows, total = catalog.search(DESIGNS, search, limit=MAX_PAGE_SIZE, offset=len(dirnames))
+                dirnames += [row["dir"] for row in rows]
+                if not rows or len(dirnames) >= total:
+                    break
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return _zip_response(iter_designs_zip_stream(designs_dir, dirnames, blob_store, compresslevel=compresslevel),
+                             "designs_%s.zip" % time.strftime("%Y_%m_%d_%H_%M_%S"))
+
+    @app.get(API_PREFIX + "/designs/duplicates", dependencies=deps)
+    def design_duplicates(radius: int = DEFAULT_RADIUS):
+        """
+        Groups of near-duplicate designed images among all saved designs: images whose perceptual hashes are
+        within 'radius' bits of each other, transitively
+        """
+        _check_radius(radius)
+        with phash_index.get(radius) as (entries, _ids, index):
+            with g_metrics.span("phash_grouping"):
+                groups = group_near_duplicates(index.hashes, radius, index)
+            return {
+                "radius": radius,
+                "images": len(entries),
+                "groups": [[{"dir": entries[i][0], "image": entries[i][1]} for i in group] for group in groups],
+            }
+
+    @app.get(API_PREFIX + "/designs/{dirname}/similar", dependencies=deps)
+    def similar_designs(dirname: str, image: int = 0, radius: int = DEFAULT_RADIUS):
+        """
+        The designed images of all saved designs that are near-duplicates of an image of a design, nearest first
+        """
+        _saved_dirpath(designs_dir, dirname, "design")
+        _check_radius(radius)
+        with phash_index.get(radius) as (entries, ids, index):
+            if (dirname, image) not in ids:
+                raise HTTPException(status_code=404, detail="No such design image, or it couldn't be hashed")
+            phash = int(index.hashes[ids[(dirname, image)]])
+            near_ids = index.query(phash, radius)
+            distances = hamming_distances(index.hashes[near_ids], phash)
+            similar = [{"dir": entries[i][0], "image": entries[i][1], "distance": d}
+                       for d, i in sorted(zip(distances.tolist(), near_ids.tolist()))
+                       if entries[i] != (dirname, image)]
+        return {"phash": phash_to_hex(phash), "radius": radius, "similar": similar}
+
+    @app.get(API_PREFIX + "/designs/{dirname}/zip", dependencies=deps)
+    def design_zip(dirname: str, compresslevel: Optional[int] = None):
+        """
+        The archive of a saved design, as its design.zip, streamed from its design.json and the blob store
+        """
+        dirpath = _saved_dirpath(designs_dir, dirname, "design")
+        compresslevel = compresslevel_or_default(compresslevel)
+        try:
+            full_cfg = read_design_dir(dirpath, blob_store)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail="Error reading design: %s" % str(e))
+        return _zip_response(iter_zip_stream(design_zip_entries(full_cfg, blob_store), compresslevel=compresslevel),
+                             "%s.zip" % dirname)
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from PIL import Image
+
+
+RESULT_CACHE_DIR_NAME = "result_cache"  # Dir under the output dir for the cached results
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+RESULT_FNAME_FMT = "%d.png"
+
+
+def image_content_hash(im):
+    """
+    SHA-256 of the pixels of a PIL image (with its mode and size), without encoding it
+    """
+    h = hashlib.sha256()
+    h.update(("%s %d %d " % (im.mode, im.width, im.height)).encode())
+    h.update(im.tobytes())
+    return h.hexdigest()
+
+
+def generation_key(template_img, txt2img_params, cn_params, model_hash):
+    """
+    Canonical hash of everything that determines the generated images (the seed is in 'txt2img_params')
+    """
+    canon = {
+        "template": image_content_hash(template_img),
+        "txt2img": txt2img_params,
+        "controlnet": cn_params,
+        "model": model_hash,
+    }
+    data = json.dumps(canon, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class DesignResultCache(object):
+    """
+    On-disk cache of generated designed wheel images, keyed by generation_key(), so a repeated generation with a
+    fixed seed returns the same images without running the diffusion again.
+    Each entry is a dir <root>/<key> of PNG files. When the total size exceeds 'max_bytes', the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, root_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = None  # key -> (last use time, size in bytes), loaded on first use
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root_dir, key)
+
+    def _load_entries(self):
+        # Must be called with the lock held
+        if self._entries is not None:
+            return
+        self._entries = {}
+        self._nbytes = 0
+        if not os.path.isdir(self.root_dir):
+            return
+        with os.scandir(self.root_dir) as it:
+            for entry in it:
+                if not entry.is_dir() or entry.name.startswith("."):
+                    continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                self._entries[entry.name] = (entry.stat().st_mtime, size)
+                self._nbytes += size
+
+    def get(self, key):
+        """
+        Returns list of PIL images, or None if not cached
+        """
+        with self._lock:
+            self._load_entries()
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            self._entries[key] = (now, entry[1])
+            dirpath = self._entry_path(key)
+            try:
+                # The dir mtime keeps the LRU order across restarts
+                os.utime(dirpath, (now, now))
+                count = len(os.listdir(dirpath))
+                images = []
+                for i in range(count):
+                    # Loaded now, as the entry may be evicted before the images are used
+                    with Image.open(os.path.join(dirpath, RESULT_FNAME_FMT % i)) as im:
+                        im.load()
+                    images.append(im)
+            except OSError:
+                # Removed behind our back
+                del self._entries[key]
+                self._nbytes -= entry[1]
+                return None
+        return images
+
+    def put(self, key, images):
+        os.makedirs(self.root_dir, exist_ok=True)
+        # Write the entry aside and then move it in place, so readers never see a partial entry
+        tmp_dirpath = tempfile.mkdtemp(prefix=".", dir=self.root_dir)
+        size = 0
+        for i, im in enumerate(images):
+            fpath = os.path.join(tmp_dirpath, RESULT_FNAME_FMT % i)
+            im.save(fpath, format="PNG")
+            size += os.path.getsize(fpath)
+
+        with self._lock:
+            self._load_entries()
+            dirpath = self._entry_path(key)
+            if key in self._entries or size > self.max_bytes:
+                shutil.rmtree(tmp_dirpath, ignore_errors=True)
+                return
+            os.replace(tmp_dirpath, dirpath)
+            self._entries[key] = (time.time(), size)
+            self._nbytes += size
+            self._evict()
+
+    def _evict(self):
+        # Must be called with the lock held
+        if self._nbytes <= self.max_bytes:
+            return
+        for key, (_last_used, size) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            del self._entries[key]
+            self._nbytes -= size
+            if self._nbytes <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries or {}),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.root_dir, ignore_errors=True)
+            self._entries = {}
+            self._nbytes = 0
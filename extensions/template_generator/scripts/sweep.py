@@ -0,0 +1,236 @@
+"""
+Parameter sweeps of wheel templates, for exploring the design space at a glance.
+A sweep varies some template parameters over ranges of values (e.g. "spoke_count:3..8 spoke_central_angle:10..40/4")
+and renders every combination as a labelled cell of a single contact sheet. The combinations are screened with the
+vectorized geometry checks first, so only the valid ones are rendered, in parallel worker threads (cairo releases
+the GIL while drawing).
+The sheet is streamed into a PNG file a row of cells at a time.
+"""
+import os
+import re
+import time
+from math import ceil, floor
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate, WheelTemplateBatch, WheelTemplateRenderer
+    from image_utils import StreamingPngWriter, atomic_output_path
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate, WheelTemplateBatch, WheelTemplateRenderer
+    from scripts.image_utils import StreamingPngWriter, atomic_output_path
+
+
+SWEEPS_DIR_NAME = "sweeps"  # Dir under the output dir for the contact sheets
+DEFAULT_STEPS = 5  # Values of a continuous parameter range without an explicit number of steps
+MAX_CELLS = 400  # Combinations per sweep, valid or not
+CELL_SIZE = 192  # Pixels, of the rendered template in each cell
+CELL_MARGIN = 4
+LINE_HEIGHT = 13  # Pixels, of each line of a cell's label
+SWEEP_WORKERS = min(8, os.cpu_count() or 1)
+LABEL_FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ariblk.ttf")
+
+BACKGROUND_COLOR = (32, 32, 32)
+LABEL_COLOR = (220, 220, 220)
+COVERAGE_MET_COLOR = (90, 200, 90)
+COVERAGE_SHORT_COLOR = (230, 160, 60)
+ERROR_COLOR = (220, 70, 70)
+
+# Error bit of the combinations with values out of their parameter's valid range (See
+# WheelTemplateBatch.out_of_range()), besides the part bits of WheelTemplateBatch.check_errors_in_geometry()
+OUT_OF_RANGE_ERR = 1 << 7
+
+ERROR_PART_NAMES = [
+    (WheelTemplateBatch.RIM_ERR, "rim"),
+    (WheelTemplateBatch.HUB_ERR, "hub"),
+    (WheelTemplateBatch.LUG_NUTS_ERR, "lug nuts"),
+    (WheelTemplateBatch.SPOKES_ERR, "spokes"),
+]
+
+_SWEEP_TERM_RE = re.compile(r"^(\w+):(\S+)$")
+
+
+def parse_sweep(text):
+    """
+    Parse a sweep of space separated terms, each one a parameter of WheelTemplate.ALL_ARGS and its values:
+        "<param>:<v1>,<v2>,..." - The given values
+        "<param>:<min>..<max>" - Every integer in the range for counts, or DEFAULT_STEPS evenly spaced values
+        "<param>:<min>..<max>/<n>" - n evenly spaced values (rounded and deduplicated for counts)
+    Returns list of (param, 1D array of values), one per axis of the sweep
+    """
+    axes = []
+    for term in text.split():
+        m = _SWEEP_TERM_RE.match(term)
+        if not m:
+            raise Exception("Invalid sweep term '%s'. Must be '<param>:<values>'" % term)
+        arg, value = m.groups()
+        if arg not in WheelTemplate.ALL_ARGS or arg == "canvas_size":
+            raise Exception("Unknown template parameter '%s'" % arg)
+        if arg in [a for a, _values in axes]:
+            raise Exception("Parameter '%s' is swept more than once" % arg)
+
+        is_int = arg in WheelTemplateBatch.INT_ARGS
+        try:
+            if ".." in value:
+                value_range, _sep, steps = value.partition("/")
+                low, high = (float(v) for v in value_range.split("..", 1))
+                if is_int and not steps:
+                    values = np.arange(ceil(low), floor(high) + 1, dtype=np.float64)
+                else:
+                    values = np.linspace(low, high, int(steps) if steps else DEFAULT_STEPS)
+            else:
+                values = np.array([float(v) for v in value.split(",")], dtype=np.float64)
+        except ValueError:
+            raise Exception("Invalid values of sweep parameter '%s': %s" % (arg, value)) from None
+        if is_int:
+            values = np.unique(np.round(values))
+        if not len(values):
+            raise Exception("No values to sweep for parameter '%s'" % arg)
+        axes.append((arg, values))
+
+    if not axes:
+        raise Exception("Nothing to sweep")
+    return axes
+
+
+def _format_value(arg, value):
+    if arg in WheelTemplateBatch.INT_ARGS:
+        return "%d" % value
+    return "%g" % round(value, 3)
+
+
+def _render_cell(specs):
+    # Runs in the worker threads
+    image = WheelTemplateRenderer(WheelTemplate(**specs)).generate_raster("pil", alpha_channel=False)
+    return image.convert("RGB")
+
+
+class TemplateSweep(object):
+    """
+    All combinations of the values of the swept parameters, with the other parameters of a base template.
+    The contact sheet has a cell per combination, in row-major order of the axes, with as many columns as the
+    values of the last axis. Combinations that break the geometry constraints are left as unrendered cells, named
+    by their faulty parts.
+    """
+
+    def __init__(self, wt, axes, cell_size=CELL_SIZE):
+        """
+        @param wt: Base WheelTemplate, for the parameters that aren't swept
+        @param axes: List of (param, values), as returned by parse_sweep()
+        """
+        assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
+        self.axes = axes
+        self.cell_size = cell_size
+        self.num_cells = int(np.prod([len(values) for _arg, values in axes]))
+        if self.num_cells > MAX_CELLS:
+            raise Exception("Too many combinations to sweep (%d, max %d)" % (self.num_cells, MAX_CELLS))
+
+        # Cartesian product of all axes, in row-major order
+        grids = np.meshgrid(*[values for _arg, values in axes], indexing="ij")
+        columns = wt.to_dict()
+        columns["canvas_size"] = (cell_size, cell_size)
+        # Values out of their parameter's range are pruned like invalid geometry. Their rows get the base template's
+        # value instead, so the batch can be built
+        self.swept_values = {}  # Param -> the value of each combination, even if it's out of range
+        self.out_of_range = {}  # Param -> whether its value is out of range, of each combination
+        out_of_range = np.zeros(self.num_cells, dtype=bool)
+        for (arg, _values), grid in zip(axes, grids):
+            column = grid.reshape(-1)
+            self.swept_values[arg] = column
+            bad, _msg = WheelTemplateBatch.out_of_range(arg, column)
+            if bad.any():
+                self.out_of_range[arg] = bad
+                out_of_range |= bad
+                column = np.where(bad, columns[arg], column)
+            columns[arg] = column
+        self.batch = WheelTemplateBatch(**columns)
+        self.errors = self.batch.check_errors_in_geometry()
+        self.errors[out_of_range] = OUT_OF_RANGE_ERR
+        self.coverage = self.batch.calc_areas()["coverage"]
+        self.required_coverage = self.batch.required_coverage_area * 100
+        self.num_valid = int(np.count_nonzero(self.errors == 0))
+
+        self.num_columns = len(axes[-1][1])
+        self.num_rows = self.num_cells // self.num_columns
+        self.label_height = LINE_HEIGHT * (len(axes) + 1)
+        self.cell_width = cell_size + 2 * CELL_MARGIN
+        self.cell_height = cell_size + self.label_height + 2 * CELL_MARGIN
+        self.width = self.cell_width * self.num_columns
+        self.height = self.cell_height * self.num_rows
+
+    def _label_lines(self, index):
+        lines = [("%s=%s" % (arg, _format_value(arg, self.swept_values[arg][index])), LABEL_COLOR)
+                 for arg, _values in self.axes]
+        if self.errors[index] == OUT_OF_RANGE_ERR:
+            args = [arg for arg, bad in self.out_of_range.items() if bad[index]]
+            return lines + [("out of range: %s" % ", ".join(args), ERROR_COLOR)]
+        if self.errors[index]:
+            parts = [name for bit, name in ERROR_PART_NAMES if self.errors[index] & bit]
+            return lines + [("invalid: %s" % ", ".join(parts), ERROR_COLOR)]
+        color = COVERAGE_MET_COLOR if self.coverage[index] >= self.required_coverage[index] else COVERAGE_SHORT_COLOR
+        return lines + [("coverage %.1f%%" % self.coverage[index], color)]
+
+    def _draw_row(self, row, cell_images, font):
+        image = Image.new("RGB", (self.width, self.cell_height), BACKGROUND_COLOR)
+        draw = ImageDraw.Draw(image)
+        for col in range(self.num_columns):
+            index = row * self.num_columns + col
+            x = col * self.cell_width + CELL_MARGIN
+            cell_image = cell_images.get(index, None)
+            if cell_image is not None:
+                image.paste(cell_image, (x, CELL_MARGIN))
+            y = CELL_MARGIN + self.cell_size
+            for text, color in self._label_lines(index):
+                draw.text((x, y), text, font=font, fill=color)
+                y += LINE_HEIGHT
+        return image
+
+    def iter_rows(self, workers=SWEEP_WORKERS):
+        """
+        Render the valid combinations, in worker threads unless 'workers' is 0
+        Yields (row index, PIL image of the row of cells), in order
+        """
+        try:
+            font = ImageFont.truetype(LABEL_FONT, LINE_HEIGHT - 3)
+        except OSError:
+            font = ImageFont.load_default()
+        valid = np.flatnonzero(self.errors == 0).tolist()
+        specs = [self.batch.template(i).to_dict() for i in valid]
+        executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+        try:
+            results = executor.map(_render_cell, specs) if executor else map(_render_cell, specs)
+            # The results come in the order of the cells, as the workers complete them
+            pending = zip(valid, results)
+            item = next(pending, None)
+            for row in range(self.num_rows):
+                row_end = (row + 1) * self.num_columns
+                cell_images = {}
+                while item is not None and item[0] < row_end:
+                    cell_images[item[0]] = item[1]
+                    item = next(pending, None)
+                yield row, self._draw_row(row, cell_images, font)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    def iter_contact_sheet(self, fpath, workers=SWEEP_WORKERS):
+        """
+        Render the contact sheet into a PNG file, a row of cells at a time
+        Yields (rows done, PIL image of the sheet so far) after each row
+        """
+        sheet = Image.new("RGB", (self.width, self.height), BACKGROUND_COLOR)
+        with atomic_output_path(fpath) as tmp_fpath, open(tmp_fpath, "wb") as f:
+            writer = StreamingPngWriter(f, self.width, self.height, "RGB")
+            for row, row_image in self.iter_rows(workers):
+                writer.write_rows(row_image.tobytes())
+                sheet.paste(row_image, (0, row * self.cell_height))
+                yield row + 1, sheet
+            writer.close()
+
+
+def sweep_fname(axes):
+    return "sweep_%s_%s.png" % ("_".join(arg for arg, _values in axes), time.strftime("%Y_%m_%d_%H_%M_%S"))
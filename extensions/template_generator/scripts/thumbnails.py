@@ -0,0 +1,87 @@
+"""
+Small preview images of the saved wheel templates, kept in each template dir next to its wheel.json.
+They are written when a template is saved, and (re)generated lazily when missing or older than the wheel.json,
+so browsing the saved templates costs file reads rather than full resolution renders.
+"""
+import os
+
+try:
+    # For standalone mode
+    from wheel_geometry import WheelTemplate, WheelTemplateRenderer, load_wheel_template_from_json
+    from catalog import TEMPLATES
+    from image_utils import atomic_output_path
+except ImportError:
+    # For 'webui' mode
+    from scripts.wheel_geometry import WheelTemplate, WheelTemplateRenderer, load_wheel_template_from_json
+    from scripts.catalog import TEMPLATES
+    from scripts.image_utils import atomic_output_path
+
+
+THUMBNAIL_FNAME = "thumbnail.png"
+THUMBNAIL_SIZE = 160  # Pixels, of the longer side
+TEMPLATE_JSON_FNAME = "wheel.json"
+PREVIEW_PAGE_SIZE = 24
+
+
+def thumbnail_path(dirpath):
+    return os.path.join(dirpath, THUMBNAIL_FNAME)
+
+
+def thumbnail_is_stale(dirpath):
+    try:
+        thumb_mtime = os.stat(thumbnail_path(dirpath)).st_mtime
+    except FileNotFoundError:
+        return True
+    return thumb_mtime < os.stat(os.path.join(dirpath, TEMPLATE_JSON_FNAME)).st_mtime
+
+
+def thumbnail_size(wt):
+    w, h = wt.canvas_size
+    scale = float(THUMBNAIL_SIZE) / max(w, h)
+    return max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+
+
+def write_thumbnail(wt, dirpath, image=None):
+    """
+    Render the thumbnail of a template into its dir
+    @param image: The thumbnail as a PIL image, if already rendered (at thumbnail_size())
+    Returns the thumbnail path
+    """
+    assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
+    fpath = thumbnail_path(dirpath)
+    # Concurrent requests may regenerate the same stale thumbnail
+    with atomic_output_path(fpath) as tmp_fpath:
+        if image is not None:
+            image.save(tmp_fpath, format="PNG")
+        else:
+            specs = wt.to_dict()
+            specs["canvas_size"] = thumbnail_size(wt)
+            WheelTemplateRenderer(WheelTemplate(**specs)).generate_raster(tmp_fpath)
+    return fpath
+
+
+def get_thumbnail(dirpath):
+    """
+    Returns the thumbnail path of a saved template dir, generating the thumbnail first if it's stale
+    """
+    if thumbnail_is_stale(dirpath):
+        with open(os.path.join(dirpath, TEMPLATE_JSON_FNAME), "rb") as f:
+            wt = load_wheel_template_from_json(f.read())
+        return write_thumbnail(wt, dirpath)
+    return thumbnail_path(dirpath)
+
+
+def template_previews(catalog, templates_dir, search="", page=0, page_size=PREVIEW_PAGE_SIZE):
+    """
+    A page of saved templates that match the search string (See catalog.parse_query()), most recent first.
+    Templates whose thumbnails can't be produced are skipped.
+    Returns (list of (thumbnail path, catalog row), total number of matches)
+    """
+    rows, total = catalog.search(TEMPLATES, search, limit=page_size, offset=page * page_size)
+    res = []
+    for row in rows:
+        try:
+            res.append((get_thumbnail(os.path.join(templates_dir, row["dir"])), row))
+        except Exception as e:
+            print("Error producing thumbnail of template '%s': %s" % (row["dir"], str(e)))
+    return res, total
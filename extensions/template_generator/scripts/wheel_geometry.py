@@ -3,16 +3,22 @@ import os
 import json
 import pprint
 import sys
-from cairo import SVGSurface, FillRule, Context
+import numpy as np
+from cairo import SVGSurface, ImageSurface, FillRule, Context, FORMAT_ARGB32, FORMAT_RGB24, FORMAT_A8
 
 try:
     # For standalone mode
-    from image_utils import cairo_svg_surface_to_png
+    from image_utils import cairo_image_surface_to_output, cairo_image_surface_to_pil, StreamingPngWriter, \
+        StreamingTiffWriter, atomic_output_path
 except ImportError:
     # For 'webui' mode
-    from scripts.image_utils import cairo_svg_surface_to_png
+    from scripts.image_utils import cairo_image_surface_to_output, cairo_image_surface_to_pil, StreamingPngWriter, \
+        StreamingTiffWriter, atomic_output_path
 
 
+TILED_RENDER_MIN_PIXELS = 4096 * 4096  # produce_wheel_outputs() renders larger canvases in bands
+TILED_BAND_BYTES = 16 << 20  # Default size of a band of a tiled render
+
 
 class WheelTemplate(object):
     # Parts of the wheel
@@ -209,6 +215,246 @@ class WheelTemplate(object):
         return dict(self._dict)
 
 
+def _map_unique(values, func):
+    """
+    Apply a scalar python function to every element of 'values', evaluating it only once per unique value.
+    Used for math functions of small-domain columns (e.g. counts), so results are bit-identical to the
+    scalar code path rather than to NumPy's own (possibly SIMD) implementations.
+    """
+    uniques, inverse = np.unique(values, return_inverse=True)
+    mapped = np.array([func(v) for v in uniques.tolist()], dtype=np.float64)
+    return mapped[inverse.reshape(np.shape(values))]
+
+
+def _py_round(values, ndigits):
+    """
+    Vectorized equivalent of python's round(x, ndigits).
+    np.round() only disagrees with python when the scaled value lands (almost) exactly on a half, so those
+    few elements are rounded by python itself.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    res = np.round(scaled) / scale
+    with np.errstate(invalid="ignore"):
+        near_half = np.abs(scaled - np.floor(scaled) - 0.5) <= (np.abs(scaled) + 1.0) * 1e-12
+    idx = np.flatnonzero(near_half)
+    if idx.size:
+        flat = res.reshape(-1)
+        flat[idx] = [round(v, ndigits) for v in values.reshape(-1)[idx].tolist()]
+    return res
+
+
+class WheelTemplateBatch(object):
+    """
+    Structure-of-arrays counterpart of WheelTemplate, for screening large design spaces.
+    Every WheelTemplate.ALL_ARGS field is held as a NumPy column (canvas_size as an (N, 2) array), and the
+    geometry checks and area calculations run over all rows in one vectorized pass.
+    Results match the scalar WheelTemplate methods row by row.
+    """
+    # Bit of each wheel part in the error masks returned by check_errors_in_geometry()
+    RIM_ERR = 1 << WheelTemplate.RIM
+    HUB_ERR = 1 << WheelTemplate.HUB
+    LUG_NUTS_ERR = 1 << WheelTemplate.LUG_NUTS
+    SPOKES_ERR = 1 << WheelTemplate.SPOKES
+
+    INT_ARGS = ("lug_nut_count", "spoke_count")
+
+    def __init__(self, **columns):
+        """
+        Params are as defined by WheelTemplate.ALL_ARGS, each given as a scalar or a 1D column
+        (canvas_size as a (w, h) pair or an (N, 2) array). Scalars are broadcast over all rows.
+        """
+        unknown = set(columns) - set(WheelTemplate.ALL_ARGS)
+        if unknown:
+            raise TypeError("got unexpected arguments: %s" % ", ".join(sorted(unknown)))
+
+        arrays = {}
+        for arg, default_value in WheelTemplate.ALL_ARGS.items():
+            value = columns.get(arg, None)
+            if value is None:
+                value = default_value
+            arrays[arg] = np.asarray(value, dtype=np.float64)
+
+        canvas_size = arrays.pop("canvas_size")
+        lengths = set(a.shape[0] for a in arrays.values() if a.ndim)
+        if canvas_size.ndim == 2:
+            lengths.add(canvas_size.shape[0])
+        if len(lengths) > 1:
+            raise Exception("All columns must have the same length, got lengths %s" % sorted(lengths))
+        self._len = lengths.pop() if lengths else 1
+
+        self._columns = {}
+        for arg in WheelTemplate.ALL_ARGS:
+            if arg == "canvas_size":
+                value = np.broadcast_to(canvas_size, (self._len, 2))
+            else:
+                value = np.broadcast_to(arrays[arg], (self._len,))
+            bad, msg = self.out_of_range(arg, value)
+            if bad.any():
+                raise Exception("%s (row %d)" % (msg, np.flatnonzero(bad)[0]))
+
+            self._columns[arg] = value
+            setattr(self, arg, value)
+
+    @staticmethod
+    def out_of_range(arg, values):
+        """
+        Check the values of an argument against its valid range, as the constructor does.
+        Returns (bool array, True for the out of range values, error message)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if arg == "canvas_size":
+            return ~((values[:, 0] > 0) & (values[:, 1] > 0)), "Canvas width/height must be positive"
+        if arg == "required_coverage_area":
+            return ~((0 <= values) & (values <= 1.0)), "Required coverage area must be in range [0, 1]"
+        if arg in ["lug_nuts_init_angle", "spokes_init_angle"]:
+            return ~((0 <= values) & (values <= 360.0)), "'%s' must be in range [0, 360]" % arg
+        return ~(values > 0), "Argument '%s' must be positive" % arg
+
+    @classmethod
+    def from_templates(cls, templates):
+        dicts = [wt.to_dict() for wt in templates]
+        return cls(**{arg: [d[arg] for d in dicts] for arg in WheelTemplate.ALL_ARGS})
+
+    def __len__(self):
+        return self._len
+
+    def template(self, index):
+        """
+        Build the scalar WheelTemplate of a single row
+        """
+        kwargs = {}
+        for arg, column in self._columns.items():
+            value = column[index].tolist()
+            if arg == "canvas_size":
+                value = tuple(value)
+            elif arg in self.INT_ARGS:
+                value = int(value)
+            kwargs[arg] = value
+        return WheelTemplate(**kwargs)
+
+    def to_columns(self):
+        return dict(self._columns)
+
+    @property
+    def rim_radius(self):
+        return self.rim_diameter / 2.0
+
+    @property
+    def rim_inner_radius(self):
+        return self.rim_radius - self.rim_width
+
+    @property
+    def hub_radius(self):
+        return self.hub_diameter / 2.0
+
+    @property
+    def hub_inner_radius(self):
+        return self.hub_radius - self.hub_width
+
+    @property
+    def lug_nut_radius(self):
+        return self.lug_nut_diameter / 2.0
+
+    @property
+    def bolt_circle_radius(self):
+        return self.bolt_circle_diameter / 2.0
+
+    def check_errors_in_geometry(self):
+        """
+        Vectorized WheelTemplate.check_errors_in_geometry().
+        Returns a uint8 array with one error mask per row, made of the *_ERR bits of the parts that had errors.
+        """
+        errors = np.zeros(self._len, dtype=np.uint8)
+
+        # --- Rim ---
+        errors[self.rim_inner_radius < 0] |= self.RIM_ERR
+
+        # --- Hub ---
+        errors[(self.hub_inner_radius < 0) | (self.hub_radius > self.rim_inner_radius)] |= self.HUB_ERR
+
+        # --- Lug nuts ---
+        nut_too_big = self.lug_nut_diameter > self.hub_width
+        nut_fits = (self.hub_inner_radius + self.lug_nut_radius <= self.bolt_circle_radius) & \
+                   (self.bolt_circle_radius <= self.hub_radius - self.lug_nut_radius)
+        nut_gap = 2 * self.bolt_circle_radius * _map_unique(self.lug_nut_count,
+                                                            lambda n: sin(radians(360 / n / 2.0)))
+        errors[nut_too_big | ~nut_fits | (self.lug_nut_diameter > nut_gap)] |= self.LUG_NUTS_ERR
+
+        # --- Spokes ---
+        errors[self.spoke_central_angle > 360.0 / self.spoke_count] |= self.SPOKES_ERR
+
+        return errors
+
+    def valid_mask(self):
+        return self.check_errors_in_geometry() == 0
+
+    def calc_areas(self, rounded=True):
+        """
+        Vectorized WheelTemplate.calc_areas().
+        Returns the same dict, with one array per figure.
+        @param rounded: Whether to round the figures like the scalar version does. Unrounded figures are
+                        useful for further computations (e.g. solving for a required coverage)
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            wheel_area = pi * self.rim_radius ** 2
+            rim_area = wheel_area - pi * self.rim_inner_radius ** 2
+            rim_coverage = rim_area / wheel_area
+            lug_nut_area = pi * self.lug_nut_radius ** 2
+            lug_nuts_area = lug_nut_area * self.lug_nut_count
+            center_bore_area = pi * self.hub_inner_radius ** 2
+            hub_area = pi * self.hub_radius ** 2 - center_bore_area - lug_nuts_area
+            hub_coverage = hub_area / wheel_area
+            rim_deadzone_area = pi * (self.rim_inner_radius ** 2 - self.hub_radius ** 2)
+            spoke_area = rim_deadzone_area * self.spoke_central_angle / 360.0
+            spokes_area = spoke_area * self.spoke_count
+            spokes_coverage = spokes_area / wheel_area
+            solid_area = rim_area + hub_area + spokes_area
+            solid_coverage = solid_area / wheel_area
+
+            sum1 = rim_coverage + hub_coverage + spokes_coverage
+            sum2 = solid_area + rim_deadzone_area - spokes_area + lug_nuts_area + center_bore_area
+            assert np.all(~(np.abs(solid_coverage - sum1) >= 1e-4)), "internal geometric error1"
+            assert np.all(~(np.abs(sum2 - wheel_area) >= 1e-4)), "internal geometric error2"
+
+            rim_solid_coverage = rim_area / solid_area
+            hub_solid_coverage = hub_area / solid_area
+            spokes_solid_coverage = spokes_area / solid_area
+
+        if rounded:
+            def perc(f):
+                return _py_round(f * 100, 1)
+
+            def area(f):
+                return _py_round(f, 3)
+        else:
+            def perc(f):
+                return f * 100
+
+            def area(f):
+                return f
+
+        res = {
+            "wheel_area": area(wheel_area),
+            "solid_area": area(solid_area),
+            "coverage": perc(solid_coverage),
+
+            "rim_area": area(rim_area),
+            "hub_area": area(hub_area),
+            "spokes_area": area(spokes_area),
+
+            "rim_coverage": perc(rim_coverage),
+            "hub_coverage": perc(hub_coverage),
+            "spokes_coverage": perc(spokes_coverage),
+
+            "rim_solid_coverage": perc(rim_solid_coverage),
+            "hub_solid_coverage": perc(hub_solid_coverage),
+            "spokes_solid_coverage": perc(spokes_solid_coverage),
+        }
+        return res
+
+
 class WheelTemplateRenderer:
     DRAW_NUTS_AS_HUB_HOLES = True
     """
@@ -234,6 +480,7 @@ class WheelTemplateRenderer:
         self._alpha_channel = None
         
         self._ctx = None  # Temporary cairo drawing context
+        self._band_top = 0  # Temporary canvas row at the top of the surface, for tiled renders
         self._err_parts = []  # Temporary list of wheel parts that have geometric errors and should be highlighted
 
         # Both width and height of the scene, in inches. It is slightly larger than the wheel rim
@@ -319,6 +566,9 @@ class WheelTemplateRenderer:
 
         ctx = self._ctx
         if draw_nuts_as_hub_holes:
+            # Set explicitly rather than relying on the color left by the previous part, as each part may be drawn
+            # on a context of its own (e.g. as a cached layer)
+            self._set_color()
             # [Preferred method] Prepare paths for outer and inner hub circles and lug nut circles.
             # Then just fill it all and magic happens.
             self._prepare_ring_path(self.hub_radius, self.hub_width)
@@ -345,30 +595,20 @@ class WheelTemplateRenderer:
             "scene_rim_margin": self.SCENE_RIM_MARGIN,
         }
 
-    def generate_svg(self, svg_fpath=None, png=None, color_errors=False,
-                     draw_color=None, alpha_channel=True):
-        """
-        Generate SVG representation of the wheel template, and optionally return PNG output.
-        @param svg_fpath: path of output SVG file, or None
-        @param png: Format of output PNG.
-                    None - no PNG output. 
-                    "pil" - PIL image. 
-                    "bytes" - Raw PNG bytes
-                    <file_path> - Save as PNG file instead of returning it
-        @param color_errors: Whether to color wheel components that had geometric errors
-        @param draw_color: RGB-tuple of color of all solid shapes
-        @param alpha_channel: Only for the PNG - whether to keep the alpha channel
-        """
+    def _prepare_render(self, color_errors=False, draw_color=None, alpha_channel=True):
         self._draw_color = draw_color or self.DEFAULT_DRAW_COLOR
         self._alpha_channel = alpha_channel
-        
+
         self._err_parts = []
         if color_errors:
             _error_strs, self._err_parts = self.check_errors_in_geometry()
 
-        svg_surface = SVGSurface(svg_fpath, self._canvas_w, self._canvas_h)
-        ctx = Context(svg_surface)
+    def _create_context(self, surface):
+        ctx = Context(surface)
         self._ctx = ctx
+        if self._band_top:
+            # The surface is a band of the canvas. Whatever falls outside of it is clipped by the surface bounds
+            ctx.translate(0, -self._band_top)
 
         # First, transform the coordinate system to be centered at 0 and use inches.
         # (-w/2,-w/2) -- (0,-w/2) -- (w/2,-w/2)
@@ -388,20 +628,128 @@ class WheelTemplateRenderer:
         # where w is the scene width (and height), in inches.
         ctx.scale(self._x_pixels_per_inch, self._y_pixels_per_inch)
         ctx.translate(self._scene_length / 2, self._scene_length / 2)
+        return ctx
 
+    def _draw_on_surface(self, surface):
+        self._create_context(surface)
         self._draw_rim()
         self._draw_hub_and_lug_nuts()
         self._draw_spokes()
 
-        # Create the output PNG if requested
-        return cairo_svg_surface_to_png(svg_surface, png, alpha_channel)
+    def _create_image_surface(self, alpha_channel=True, mask=False, height=None):
+        """
+        @param height: Rows of the surface, if it's a band of the canvas rather than all of it
+        """
+        if mask:
+            fmt = FORMAT_A8
+        elif alpha_channel:
+            fmt = FORMAT_ARGB32
+        else:
+            # No alpha channel - the shapes are drawn on black background
+            fmt = FORMAT_RGB24
+        if height is None:
+            height = int(round(self._canvas_h))
+        return ImageSurface(fmt, int(round(self._canvas_w)), height)
+
+    def generate_raster(self, fmt="pil", color_errors=False, draw_color=None, alpha_channel=True, mask=False):
+        """
+        Render the wheel template directly on a raster (cairo ImageSurface), without any SVG/PNG round trip.
+        @param fmt: Format of output.
+                    "surface" - The cairo ImageSurface itself
+                    "numpy" - Zero-copy NumPy view of the pixels (See image_utils.cairo_image_surface_to_numpy())
+                    "pil" - PIL image.
+                    "bytes" - Raw PNG bytes
+                    <file_path> - Save as PNG file instead of returning it
+        @param color_errors: Whether to color wheel components that had geometric errors
+        @param draw_color: RGB-tuple of color of all solid shapes
+        @param alpha_channel: Whether to keep the alpha channel (ARGB32), or draw on black background (RGB24)
+        @param mask: Render only the coverage of the solid shapes, as a single channel (A8)
+        """
+        self._prepare_render(color_errors, draw_color, alpha_channel)
+        surface = self._create_image_surface(alpha_channel, mask)
+        self._draw_raster(surface)
+        return cairo_image_surface_to_output(surface, fmt)
+
+    def _draw_raster(self, surface):
+        # Overridden by renderers that compose the raster differently (e.g. from cached layers)
+        self._draw_on_surface(surface)
+
+    def generate_tiled(self, fpath, fmt=None, band_height=None, color_errors=False, draw_color=None,
+                       alpha_channel=True, mask=False, compresslevel=6):
+        """
+        Render the wheel template in horizontal bands, each on a surface of its own that is streamed into a PNG or
+        TIFF file, so the peak memory is a few bands regardless of the canvas size.
+        The output has the same pixels as generate_raster() with the same params.
+        @param fmt: "png" or "tiff". Default: By the file extension
+        @param band_height: Rows per band. Default: As many as fit in TILED_BAND_BYTES
+        Other params are as in generate_raster()
+        """
+        fmt = (fmt or os.path.splitext(fpath)[1].lstrip(".")).lower()
+        if fmt not in ("png", "tif", "tiff"):
+            raise Exception("Unsupported tiled render format: %s" % fmt)
+        w, h = int(round(self._canvas_w)), int(round(self._canvas_h))
+        mode = "L" if mask else ("RGBA" if alpha_channel else "RGB")
+        if not band_height:
+            band_height = max(1, TILED_BAND_BYTES // (w * 4))
+        band_height = min(band_height, h)
+
+        self._prepare_render(color_errors, draw_color, alpha_channel)
+        try:
+            with atomic_output_path(fpath) as tmp_fpath, open(tmp_fpath, "wb") as f:
+                if fmt == "png":
+                    writer = StreamingPngWriter(f, w, h, mode, compresslevel)
+                else:
+                    writer = StreamingTiffWriter(f, w, h, mode, rows_per_strip=band_height,
+                                                 compress=compresslevel > 0)
+                for top in range(0, h, band_height):
+                    surface = self._create_image_surface(alpha_channel, mask, height=min(band_height, h - top))
+                    self._band_top = top
+                    self._draw_on_surface(surface)
+                    writer.write_rows(cairo_image_surface_to_pil(surface).tobytes())
+                    surface.finish()
+                writer.close()
+        finally:
+            self._band_top = 0
+        return fpath
+
+    def generate_svg(self, svg_fpath=None, png=None, color_errors=False,
+                     draw_color=None, alpha_channel=True):
+        """
+        Generate SVG representation of the wheel template, and optionally return PNG output.
+        @param svg_fpath: path of output SVG file, or None
+        @param png: Format of output PNG.
+                    None - no PNG output. 
+                    "pil" - PIL image. 
+                    "bytes" - Raw PNG bytes
+                    <file_path> - Save as PNG file instead of returning it
+        @param color_errors: Whether to color wheel components that had geometric errors
+        @param draw_color: RGB-tuple of color of all solid shapes
+        @param alpha_channel: Only for the PNG - whether to keep the alpha channel
+        """
+        if svg_fpath is not None:
+            self._prepare_render(color_errors, draw_color, alpha_channel)
+            svg_surface = SVGSurface(svg_fpath, self._canvas_w, self._canvas_h)
+            self._draw_on_surface(svg_surface)
+            svg_surface.finish()
+
+        if png is None:
+            return None
+
+        # The PNG is rasterized directly rather than converted from the SVG surface
+        return self.generate_raster(png, color_errors, draw_color, alpha_channel)
 
 
 def produce_wheel_outputs(wt, svg_path, png_path, json_path, **kwargs):
     assert isinstance(wt, WheelTemplate), "'wt' must be instance of WheelTemplate'"
     wt.validate_geometry()
     renderer = WheelTemplateRenderer(wt)
-    renderer.generate_svg(svg_path, png=png_path, **kwargs)
+    w, h = wt.canvas_size
+    if isinstance(png_path, str) and w * h > TILED_RENDER_MIN_PIXELS:
+        # Too large for a single surface (and PNG encoding in memory)
+        renderer.generate_svg(svg_path, **kwargs)
+        renderer.generate_tiled(png_path, "png", **kwargs)
+    else:
+        renderer.generate_svg(svg_path, png=png_path, **kwargs)
     cfg = {
         "specs": wt.to_dict(),
         "image": renderer.to_dict(),
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The extension's modules, imported in their standalone mode
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "extensions", "template_generator",
+                                           "scripts"))
+if SCRIPTS_DIR not in sys.path:
+  sys.path.insert(0, SCRIPTS_DIR)
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from wheel_geometry import WheelTemplate
+from batch_generate import expand_grid, read_specs_file
+
+
+class ExpandGridTests(unittest.TestCase):
+  def test_prunes_invalid_geometry(self):
+    grid_cfg = {
+      "base": {"rim_diameter": 18, "hub_diameter": 6},
+      "grid": {"spoke_count": [3, 5], "hub_width": {"start": 0.5, "stop": 4, "num": 8}},
+    }
+    items, pruned = expand_grid(grid_cfg)
+    self.assertEqual(len(items) + pruned, 16)
+    self.assertGreater(pruned, 0)
+    for name, specs in items:
+      self.assertIsNone(name)
+      self.assertEqual(specs["rim_diameter"], 18)
+      errors, _err_parts = WheelTemplate(**specs).check_errors_in_geometry()
+      self.assertEqual(errors, [])
+
+  def test_prunes_out_of_range_values(self):
+    grid_cfg = {
+      "base": {},
+      "grid": {"spoke_count": [0, 3, 5], "spoke_central_angle": [-5, 20, 30],
+               "canvas_size": [[512, 512], [0, 512]]},
+    }
+    items, pruned = expand_grid(grid_cfg)
+    self.assertEqual(len(items) + pruned, 18)
+    combos = sorted((specs["spoke_count"], specs["spoke_central_angle"], specs["canvas_size"]) for _, specs in items)
+    self.assertEqual(combos, [(3, 20.0, (512.0, 512.0)), (3, 30.0, (512.0, 512.0)),
+                              (5, 20.0, (512.0, 512.0)), (5, 30.0, (512.0, 512.0))])
+
+  def test_unknown_argument(self):
+    with self.assertRaises(Exception):
+      expand_grid({"grid": {"spoke_width": [1, 2]}})
+
+
+class ReadSpecsFileTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def _write(self, fname, text):
+    fpath = os.path.join(self.dirpath, fname)
+    with open(fpath, "w") as f:
+      f.write(text)
+    return fpath
+
+  def test_csv(self):
+    fpath = self._write("specs.csv", "name,spoke_count,rim_width,canvas_width,canvas_height\n"
+                                     "a,6,2.5,640,480\n"
+                                     ",4.0,,,\n")
+    items = read_specs_file(fpath)
+    self.assertEqual(items[0], ("a", {"spoke_count": 6, "rim_width": 2.5, "canvas_size": (640.0, 480.0)}))
+    self.assertEqual(items[1], ("", {"spoke_count": 4}))
+
+  def test_jsonl(self):
+    wheel_json = {"specs": WheelTemplate(spoke_count=7).to_dict()}
+    fpath = self._write("specs.jsonl", json.dumps(wheel_json) + "\n\n" +
+                        json.dumps({"name": "b", "canvas_size": "800x600"}) + "\n")
+    items = read_specs_file(fpath)
+    self.assertEqual(len(items), 2)
+    self.assertEqual(WheelTemplate(**items[0][1]).to_dict(), wheel_json["specs"])
+    self.assertEqual(items[1], ("b", {"canvas_size": (800.0, 600.0)}))
+
+
+if __name__ == "__main__":
+  unittest.main()
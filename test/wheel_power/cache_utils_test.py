@@ -0,0 +1,63 @@
+import threading
+import unittest
+
+from cache_utils import LruCache
+
+
+class LruCacheTests(unittest.TestCase):
+  def test_evicts_least_recently_used(self):
+    cache = LruCache(3)
+    for key in "abc":
+      self.assertTrue(cache.put(key, key.upper()))
+    self.assertEqual(cache.get("a"), "A")
+    cache.put("d", "D")
+    self.assertIsNone(cache.get("b"))
+    self.assertEqual([cache.get(key) for key in "acd"], ["A", "C", "D"])
+    self.assertEqual(len(cache), 3)
+
+  def test_bounded_by_cost(self):
+    cache = LruCache(10, len)
+    cache.put("a", b"x" * 4)
+    cache.put("b", b"x" * 4)
+    cache.put("c", b"x" * 4)
+    self.assertIsNone(cache.get("a"))
+    self.assertEqual(cache.stats()["bytes"], 8)
+    # Costs more than the whole cache
+    self.assertFalse(cache.put("d", b"x" * 11))
+    self.assertEqual(len(cache), 2)
+
+  def test_keeps_the_first_value(self):
+    cache = LruCache(3)
+    cache.put("a", 1)
+    self.assertFalse(cache.put("a", 2))
+    self.assertEqual(cache.get("a"), 1)
+
+  def test_stats(self):
+    cache = LruCache(3)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    self.assertEqual(cache.stats(), {"entries": 1, "max_entries": 3, "hits": 1, "misses": 1})
+    cache.clear()
+    self.assertEqual(len(cache), 0)
+    self.assertIsNone(cache.get("a"))
+
+  def test_concurrent_puts(self):
+    cache = LruCache(100, len)
+
+    def put_many(prefix):
+      for i in range(500):
+        cache.put("%s%d" % (prefix, i), b"x" * (i % 7 + 1))
+        cache.get("%s%d" % (prefix, i // 2))
+
+    threads = [threading.Thread(target=put_many, args=(prefix,)) for prefix in "abcd"]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertLessEqual(cache.stats()["bytes"], 100)
+    self.assertEqual(cache.stats()["bytes"], sum(len(cache.get(key)) for key in list(cache._entries)))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,184 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from catalog import Catalog, parse_query, TEMPLATES, DESIGNS, CATALOG_DB_NAME
+from wheel_geometry import WheelTemplate
+
+
+class ParseQueryTests(unittest.TestCase):
+  def test_words_and_ranges(self):
+    words, ranges = parse_query("chrome spoke_count:5 coverage:40..60 mtime:..100 rim_width:1.5..")
+    self.assertEqual(words, ["chrome"])
+    self.assertEqual(ranges, {"spoke_count": (5, 5), "coverage": (40, 60), "mtime": (None, 100),
+                              "rim_width": (1.5, None)})
+
+  def test_empty(self):
+    self.assertEqual(parse_query(None), ([], {}))
+
+  def test_invalid_value(self):
+    with self.assertRaises(Exception):
+      parse_query("spoke_count:five")
+
+
+class CatalogTestCase(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.templates_dir = os.path.join(self.dirpath, "templates")
+    self.designs_dir = os.path.join(self.dirpath, "designs")
+    os.makedirs(self.templates_dir)
+    os.makedirs(self.designs_dir)
+    self.catalog = Catalog(os.path.join(self.dirpath, CATALOG_DB_NAME), self.templates_dir, self.designs_dir)
+
+  def tearDown(self):
+    self.catalog.close()
+    shutil.rmtree(self.dirpath)
+
+  def _save_template(self, dirname, **specs):
+    dirpath = os.path.join(self.templates_dir, dirname)
+    os.makedirs(dirpath)
+    with open(os.path.join(dirpath, "wheel.json"), "w") as f:
+      json.dump({"specs": WheelTemplate(**specs).to_dict()}, f)
+
+  def _save_design(self, dirname, author="", prompt="", images=None, **specs):
+    dirpath = os.path.join(self.designs_dir, dirname)
+    os.makedirs(dirpath, exist_ok=True)
+    cfg = {
+      "format_version": 2,
+      "template_specs": WheelTemplate(**specs).to_dict(),
+      "design": {"attr": {"author": author}, "render": {"prompt": prompt}, "images": images or []},
+    }
+    with open(os.path.join(dirpath, "design.json"), "w") as f:
+      json.dump(cfg, f)
+
+
+class CatalogTests(CatalogTestCase):
+  def test_rescan(self):
+    self._save_template("t1", spoke_count=5)
+    self._save_template("t2", spoke_count=8)
+    self._save_design("d1", author="Ann", prompt="chrome wheel", images=[{"sha256": "a", "name": "design_0.png"}])
+    self.assertEqual(self.catalog.rescan(), 3)
+    # Nothing changed
+    self.assertEqual(self.catalog.rescan(), 0)
+    self.assertEqual(self.catalog.rescan(full=True), 0)
+
+    rows, total = self.catalog.search(TEMPLATES, "spoke_count:6..")
+    self.assertEqual(total, 1)
+    self.assertEqual(rows[0]["dir"], "t2")
+    self.assertAlmostEqual(rows[0]["coverage"], WheelTemplate(spoke_count=8).calc_areas()["coverage"])
+    self.assertEqual(rows[0]["canvas_width"], 512)
+
+    rows, total = self.catalog.search(DESIGNS, "CHROME ann")
+    self.assertEqual(total, 1)
+    self.assertEqual(rows[0]["image_count"], 1)
+    self.assertEqual(self.catalog.search(DESIGNS, "steel")[1], 0)
+
+  def test_rescan_finds_removed_dirs(self):
+    self._save_template("t1")
+    self._save_template("t2")
+    self.catalog.rescan()
+    shutil.rmtree(os.path.join(self.templates_dir, "t1"))
+    self.assertEqual(self.catalog.rescan(), 1)
+    rows, total = self.catalog.query(TEMPLATES)
+    self.assertEqual([row["dir"] for row in rows], ["t2"])
+
+  def test_skips_invalid_dirs(self):
+    os.makedirs(os.path.join(self.templates_dir, "empty"))
+    self._save_template("t1")
+    self.assertEqual(self.catalog.rescan(), 1)
+    self.assertEqual(self.catalog.query(TEMPLATES)[1], 1)
+
+  def test_update(self):
+    self._save_design("d1", prompt="gold")
+    self.catalog.update(DESIGNS, "d1")
+    self.assertEqual(self.catalog.search(DESIGNS, "gold")[1], 1)
+    shutil.rmtree(os.path.join(self.designs_dir, "d1"))
+    self.catalog.update(DESIGNS, "d1")
+    self.assertEqual(self.catalog.query(DESIGNS)[1], 0)
+
+  def test_paging(self):
+    for i in range(5):
+      self._save_template("t%d" % i)
+      os.utime(os.path.join(self.templates_dir, "t%d" % i), (1000 + i, 1000 + i))
+    self.catalog.rescan()
+    rows, total = self.catalog.query(TEMPLATES, limit=2, offset=1)
+    self.assertEqual(total, 5)
+    self.assertEqual([row["dir"] for row in rows], ["t3", "t2"])
+
+  def test_escapes_like_wildcards(self):
+    self._save_design("d1", prompt="100% chrome")
+    self._save_design("d2", prompt="100 chrome")
+    self.catalog.rescan()
+    self.assertEqual(self.catalog.search(DESIGNS, "100%")[1], 1)
+
+  def test_unknown_range_column(self):
+    with self.assertRaises(Exception):
+      self.catalog.search(TEMPLATES, "prompt:1..2")
+
+  def test_persists(self):
+    self._save_template("t1")
+    self.catalog.rescan()
+    self.catalog.close()
+    self.catalog = Catalog(os.path.join(self.dirpath, CATALOG_DB_NAME), self.templates_dir, self.designs_dir)
+    self.assertEqual(self.catalog.query(TEMPLATES)[1], 1)
+    self.assertEqual(self.catalog.rescan(), 0)
+
+
+class DesignPhashesTests(CatalogTestCase):
+  def _save_hashed_design(self, dirname, phashes):
+    images = [{"sha256": "%d" % i, "name": "design_%d.png" % i, "phash": phash}
+              for i, phash in enumerate(phashes)]
+    self._save_design(dirname, images=images)
+
+  def test_hashes_of_saved_designs(self):
+    self._save_hashed_design("d1", ["8000000000000001", "00000000000000ff"])
+    self.catalog.update(DESIGNS, "d1")
+    rows = self.catalog.design_phashes()
+    self.assertEqual([(dirname, index, phash) for _rowid, dirname, index, phash in rows],
+                     [("d1", 0, (1 << 63) + 1), ("d1", 1, 0xff)])
+    version = self.catalog.phash_version
+    # Re-reading an unchanged design doesn't change the hashes
+    self.catalog.rescan(full=True)
+    os.utime(os.path.join(self.designs_dir, "d1"), (1, 1))
+    self.catalog.rescan(full=True)
+    self.assertEqual(self.catalog.phash_version, version)
+    self.assertEqual(self.catalog.phash_removals, 0)
+
+  def test_only_added_hashes_after_rowid(self):
+    self._save_hashed_design("d1", ["01"])
+    self.catalog.update(DESIGNS, "d1")
+    last_rowid = self.catalog.design_phashes()[-1][0]
+    self._save_hashed_design("d2", ["02", "03"])
+    self.catalog.update(DESIGNS, "d2")
+    self.assertEqual([phash for _rowid, _dirname, _index, phash in self.catalog.design_phashes(last_rowid)], [2, 3])
+    self.assertEqual(self.catalog.phash_removals, 0)
+
+  def test_removed_designs(self):
+    self._save_hashed_design("d1", ["01"])
+    self.catalog.update(DESIGNS, "d1")
+    version = self.catalog.phash_version
+    shutil.rmtree(os.path.join(self.designs_dir, "d1"))
+    self.catalog.rescan()
+    self.assertEqual(self.catalog.design_phashes(), [])
+    self.assertEqual(self.catalog.phash_removals, 1)
+    self.assertGreater(self.catalog.phash_version, version)
+
+  def test_backfilled_hashes_are_kept(self):
+    # Saved before the hashes were added
+    self._save_design("d1", images=[{"sha256": "0", "name": "design_0.png"}, None])
+    self.catalog.rescan()
+    self.assertEqual(self.catalog.dirs_missing_phashes(), ["d1"])
+    self.catalog.set_design_phashes("d1", [(0, 5)])
+    self.assertEqual(self.catalog.dirs_missing_phashes(), [])
+    version = self.catalog.phash_version
+    os.utime(os.path.join(self.designs_dir, "d1"), (1, 1))
+    self.catalog.rescan(full=True)
+    self.assertEqual([phash for _rowid, _dirname, _index, phash in self.catalog.design_phashes()], [5])
+    self.assertEqual(self.catalog.phash_version, version)
+    self.assertEqual(self.catalog.phash_removals, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from wheel_geometry import WheelTemplate
+from coverage_solver import solve_coverage
+
+
+class CoverageSolverTests(unittest.TestCase):
+  def test_meets_targets(self):
+    wt = WheelTemplate()
+    targets = [0.3, 0.45, 0.6]
+    results = solve_coverage(wt, targets)
+    self.assertEqual(len(results), len(targets))
+    for target, solutions in zip(targets, results):
+      self.assertTrue(solutions, "no solution for %g" % target)
+      for solution in solutions:
+        errors, _err_parts = solution.check_errors_in_geometry()
+        self.assertEqual(errors, [])
+        self.assertEqual(solution.required_coverage_area, target)
+        self.assertAlmostEqual(solution.calc_areas()["coverage"], target * 100, delta=0.1)
+
+  def test_only_free_params_vary(self):
+    wt = WheelTemplate()
+    for solution in solve_coverage(wt, 0.4, free_params=("spoke_central_angle",)):
+      specs = solution.to_dict()
+      for arg, value in wt.to_dict().items():
+        if arg not in ("spoke_central_angle", "required_coverage_area"):
+          self.assertEqual(specs[arg], value, arg)
+
+  def test_invalid_target(self):
+    with self.assertRaises(Exception):
+      solve_coverage(WheelTemplate(), 1.5)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import coverage_verify
+from coverage_verify import monte_carlo_coverage, verify_coverage, verify_coverage_batch
+from wheel_geometry import WheelTemplate, WheelTemplateBatch
+
+
+def _templates():
+  return [WheelTemplate(**specs) for specs in [
+    {},
+    {"spoke_count": 3, "spoke_central_angle": 30, "canvas_size": (384, 384)},
+    {"spoke_count": 8, "spoke_central_angle": 12, "hub_diameter": 5, "canvas_size": (384, 384)},
+  ]]
+
+
+def _shifted_analytic(points):
+  # Analytic coverage that misses the actual shapes by 'points' percentage points
+  analytic_coverage = coverage_verify._analytic_coverage
+
+  def shifted(batch):
+    res = analytic_coverage(batch)
+    res["coverage"] = res["coverage"] + points
+    return res
+  return shifted
+
+
+class MonteCarloCoverageTests(unittest.TestCase):
+  def test_estimates_the_analytic_coverage(self):
+    batch = WheelTemplateBatch.from_templates(_templates())
+    estimated = monte_carlo_coverage(batch, samples=1 << 16)
+    analytic = batch.calc_areas(rounded=False)
+    for key in coverage_verify.COVERAGE_KEYS:
+      np.testing.assert_array_less(np.abs(estimated[key] - analytic[key]), 1.0)
+    np.testing.assert_array_less(np.abs(estimated["coverage"] - analytic["coverage"]), 5 * estimated["std_error"])
+
+  def test_is_deterministic_for_a_seed(self):
+    batch = WheelTemplateBatch.from_templates(_templates())
+    a = monte_carlo_coverage(batch, seed=7)
+    b = monte_carlo_coverage(batch, seed=7)
+    np.testing.assert_array_equal(a["coverage"], b["coverage"])
+
+
+class VerifyCoverageTests(unittest.TestCase):
+  def test_raster_matches_analytic(self):
+    for wt in _templates():
+      res = verify_coverage(wt)
+      self.assertTrue(res["ok"], res["deviation"])
+
+  def test_batch_passes_the_raster_verified_templates(self):
+    templates = _templates()
+    ok, deviation = verify_coverage_batch(WheelTemplateBatch.from_templates(templates))
+    self.assertTrue(ok.all())
+    for wt, dev in zip(templates, deviation):
+      self.assertAlmostEqual(dev, verify_coverage(wt)["deviation"]["coverage"])
+
+  def test_batch_rejects_deviations_within_the_monte_carlo_error(self):
+    # 1.5 points is beyond the tolerance, but within three standard errors of a 4096 samples estimate
+    with mock.patch.object(coverage_verify, "_analytic_coverage", _shifted_analytic(1.5)):
+      ok, deviation = verify_coverage_batch(WheelTemplateBatch.from_templates(_templates()))
+    self.assertFalse(ok.any())
+    np.testing.assert_allclose(deviation, -1.5, atol=coverage_verify.DEFAULT_TOLERANCE)
+
+  def test_batch_screens_out_clear_failures_without_rendering(self):
+    with mock.patch.object(coverage_verify, "_analytic_coverage", _shifted_analytic(20)), \
+         mock.patch.object(coverage_verify, "verify_coverage") as verify:
+      ok, _deviation = verify_coverage_batch(WheelTemplateBatch.from_templates(_templates()))
+    self.assertFalse(ok.any())
+    verify.assert_not_called()
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+
+from PIL import Image, ImageDraw
+
+from design_archive import BlobStore, save_design, iter_zip_stream, write_zip_file, DESIGN_JSON
+from wheel_geometry import WheelTemplate
+
+
+def _write_png(fpath, seed, size=128):
+  image = Image.new("RGB", (size, size), (255, 255, 255))
+  draw = ImageDraw.Draw(image)
+  for i in range(8):
+    x = (seed * 37 + i * 53) % size
+    y = (seed * 91 + i * 29) % size
+    draw.ellipse((x, y, x + size // 4, y + size // 4), fill=(0, 0, 0))
+  image.save(fpath)
+  return fpath
+
+
+class BlobStoreTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.blob_store = BlobStore(os.path.join(self.dirpath, "blobs"))
+    self.fpath = _write_png(os.path.join(self.dirpath, "image.png"), 1)
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def test_put_file_copies(self):
+    sha256 = self.blob_store.put_file(self.fpath)
+    self.assertFalse(os.path.samefile(self.fpath, self.blob_store.path(sha256)))
+    # Changing the source later doesn't change the stored content
+    with open(self.fpath, "rb") as f:
+      data = f.read()
+    _write_png(self.fpath, 2)
+    with open(self.blob_store.path(sha256), "rb") as f:
+      self.assertEqual(f.read(), data)
+
+  def test_put_file_links(self):
+    sha256 = self.blob_store.put_file(self.fpath, link=True)
+    self.assertTrue(os.path.samefile(self.fpath, self.blob_store.path(sha256)))
+    self.assertEqual(self.blob_store.put_file(self.fpath), sha256)
+
+
+class SaveDesignTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.blob_store = BlobStore(os.path.join(self.dirpath, "blobs"))
+    with open(_write_png(os.path.join(self.dirpath, "template.png"), 0), "rb") as f:
+      self.template_png = f.read()
+    self.fpaths = [_write_png(os.path.join(self.dirpath, "design_%d.png" % i), seed)
+                   for i, seed in enumerate([1, 2, 1])]
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def _save(self, dedup_radius, link_images=False):
+    return save_design(os.path.join(self.dirpath, "design"), self.blob_store, WheelTemplate(), self.template_png,
+                       self.fpaths + [None], {}, {}, dedup_radius, link_images)
+
+  def _image_paths(self, d_json_fpath):
+    with open(d_json_fpath, "r") as f:
+      images = json.load(f)["design"]["images"]
+    return [self.blob_store.path(ref["sha256"]) for ref in images if ref is not None]
+
+  def test_copies_images(self):
+    d_json_fpath, _zip_fpath, _num_dropped = self._save(dedup_radius=None)
+    for fpath, blob_fpath in zip(self.fpaths, self._image_paths(d_json_fpath)):
+      self.assertFalse(os.path.samefile(fpath, blob_fpath))
+
+  def test_links_owned_images(self):
+    d_json_fpath, _zip_fpath, _num_dropped = self._save(dedup_radius=None, link_images=True)
+    self.assertTrue(os.path.samefile(self.fpaths[0], self._image_paths(d_json_fpath)[0]))
+
+  def test_counts_dropped_near_duplicates(self):
+    d_json_fpath, zip_fpath, num_dropped = self._save(dedup_radius=4)
+    self.assertEqual(num_dropped, 1)
+    self.assertTrue(os.path.isfile(zip_fpath))
+    with open(d_json_fpath, "r") as f:
+      images = json.load(f)["design"]["images"]
+    # The missing image keeps its place
+    self.assertEqual(len(images), 3)
+    self.assertIsNone(images[-1])
+
+  def test_keeps_all_images_without_dedup(self):
+    d_json_fpath, _zip_fpath, num_dropped = self._save(dedup_radius=None)
+    self.assertEqual(num_dropped, 0)
+    self.assertEqual(os.path.basename(d_json_fpath), DESIGN_JSON)
+    with open(d_json_fpath, "r") as f:
+      self.assertEqual(len(json.load(f)["design"]["images"]), 4)
+
+
+class ZipStreamTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    # Larger than a copy chunk, so the file is streamed in several parts
+    self.png_data = os.urandom(3 * 1024 * 1024 // 2)
+    self.png_fpath = os.path.join(self.dirpath, "image.png")
+    with open(self.png_fpath, "wb") as f:
+      f.write(self.png_data)
+    self.json_data = b'{"spoke_count": 5}' * 100
+    self.entries = [("design.json", self.json_data), ("images/design_0.png", self.png_fpath),
+                    ("notes.txt", b"text")]
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def _check(self, z):
+    self.assertEqual(z.namelist(), [name for name, _src in self.entries])
+    self.assertEqual(z.read("design.json"), self.json_data)
+    self.assertEqual(z.read("images/design_0.png"), self.png_data)
+    self.assertEqual(z.read("notes.txt"), b"text")
+    self.assertEqual(z.getinfo("images/design_0.png").compress_type, ZIP_STORED)
+    self.assertEqual(z.getinfo("design.json").compress_type, ZIP_DEFLATED)
+    self.assertEqual(z.getinfo("notes.txt").compress_type, ZIP_DEFLATED)
+    self.assertIsNone(z.testzip())
+
+  def test_stream(self):
+    chunks = list(iter_zip_stream(self.entries))
+    self.assertGreater(len([chunk for chunk in chunks if chunk]), 2)
+    with ZipFile(BytesIO(b"".join(chunks))) as z:
+      self._check(z)
+
+  def test_compression_override(self):
+    data = b"".join(iter_zip_stream(self.entries, compression={".png": ZIP_DEFLATED}))
+    with ZipFile(BytesIO(data)) as z:
+      self.assertEqual(z.getinfo("images/design_0.png").compress_type, ZIP_DEFLATED)
+      self.assertEqual(z.read("images/design_0.png"), self.png_data)
+
+  def test_compresslevel(self):
+    entries = [("design.json", b'{"spoke_count": 5, "spoke_central_angle": 10}' * 5000)]
+    sizes = [len(b"".join(iter_zip_stream(entries, compresslevel=level))) for level in (0, 9)]
+    self.assertGreater(sizes[0], sizes[1])
+    with ZipFile(BytesIO(b"".join(iter_zip_stream(entries, compresslevel=0)))) as z:
+      self.assertEqual(z.read("design.json"), entries[0][1])
+
+  def test_write_zip_file(self):
+    zip_fpath = os.path.join(self.dirpath, "design.zip")
+    self.assertEqual(write_zip_file(zip_fpath, self.entries), zip_fpath)
+    with ZipFile(zip_fpath) as z:
+      self._check(z)
+    self.assertEqual(sorted(os.listdir(self.dirpath)), ["design.zip", "image.png"])
+
+
+if __name__ == "__main__":
+  unittest.main()
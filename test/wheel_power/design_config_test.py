@@ -0,0 +1,100 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from design_config import CowDict, CachedJsonConfig
+
+
+SHARED = {
+  "template": {"spoke_count": 5, "canvas_size": [512, 512]},
+  "design": {"attr": {"prompt": "chrome"}, "images": ["a.png", "b.png"]},
+  "name": "base",
+}
+
+
+class CowDictTests(unittest.TestCase):
+  def setUp(self):
+    self.shared = copy.deepcopy(SHARED)
+    self.view = CowDict(self.shared)
+
+  def test_reads(self):
+    self.assertEqual(self.view["name"], "base")
+    self.assertEqual(self.view["template"]["spoke_count"], 5)
+    self.assertEqual(self.view.to_dict(), SHARED)
+    self.assertEqual(len(self.view), 3)
+
+  def test_writes_stay_in_view(self):
+    self.view["name"] = "mine"
+    self.view["added"] = 1
+    self.view["template"]["spoke_count"] = 7
+    self.view["template"]["canvas_size"].append(3)
+    self.view["design"]["attr"]["prompt"] = "gold"
+    self.view["design"]["images"][0] = "c.png"
+    del self.view["design"]["images"][1]
+    del self.view["template"]["canvas_size"]
+    self.assertEqual(self.shared, SHARED)
+
+    expected = copy.deepcopy(SHARED)
+    expected["name"] = "mine"
+    expected["added"] = 1
+    expected["template"] = {"spoke_count": 7}
+    expected["design"] = {"attr": {"prompt": "gold"}, "images": ["c.png"]}
+    self.assertEqual(self.view.to_dict(), expected)
+
+  def test_views_are_independent(self):
+    other = CowDict(self.shared)
+    self.view["template"]["spoke_count"] = 7
+    self.assertEqual(other["template"]["spoke_count"], 5)
+
+  def test_delete(self):
+    del self.view["name"]
+    self.assertNotIn("name", self.view)
+    self.assertEqual(sorted(self.view), ["design", "template"])
+    with self.assertRaises(KeyError):
+      self.view["name"]
+    with self.assertRaises(KeyError):
+      del self.view["name"]
+    self.view["name"] = "back"
+    self.assertEqual(self.view["name"], "back")
+    self.assertEqual(self.shared["name"], "base")
+
+  def test_to_dict_is_plain_copy(self):
+    res = self.view.to_dict()
+    self.assertIs(type(res["template"]), dict)
+    res["template"]["spoke_count"] = 9
+    self.assertEqual(self.view["template"]["spoke_count"], 5)
+    json.dumps(res)
+
+
+class CachedJsonConfigTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.fpath = os.path.join(self.dirpath, "config.json")
+    self._write(SHARED)
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def _write(self, cfg):
+    with open(self.fpath, "w") as f:
+      json.dump(cfg, f)
+
+  def test_reloads_on_change(self):
+    config = CachedJsonConfig(self.fpath)
+    self.assertEqual(config.get().to_dict(), SHARED)
+    config.get()["name"] = "mine"
+    self.assertEqual(config.get()["name"], "base")
+    self.assertEqual(config.derived("name", lambda cfg: cfg["name"]), "base")
+    self.assertEqual(config.loads, 1)
+
+    self._write(dict(SHARED, name="changed, and longer"))
+    self.assertEqual(config.get()["name"], "changed, and longer")
+    self.assertEqual(config.derived("name", lambda cfg: cfg["name"]), "changed, and longer")
+    self.assertEqual(config.loads, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,124 @@
+import threading
+import unittest
+
+from design_jobs import DesignJobQueue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_CANCELLED, JOB_FAILED
+
+
+def _wait_finished(queue, job):
+  for job in queue.follow(job, poll_interval=0.05):
+    pass
+  return job
+
+
+class DesignJobQueueTests(unittest.TestCase):
+  def test_generates_in_chunks(self):
+    calls = []
+
+    def generate(start, n):
+      calls.append((start, n))
+      return ["image %d" % i for i in range(start, start + n)]
+
+    queue = DesignJobQueue(chunk_size=4)
+    job = _wait_finished(queue, queue.submit(generate, 10))
+    self.assertEqual(job.status, JOB_DONE)
+    self.assertEqual(calls, [(0, 4), (4, 4), (8, 2)])
+    self.assertEqual(job.images, ["image %d" % i for i in range(10)])
+    self.assertEqual(queue.progress(job), 1.0)
+    self.assertIn("10/10 images", queue.status_text(job))
+
+  def test_job_chunk_size(self):
+    calls = []
+    queue = DesignJobQueue(chunk_size=4)
+    _wait_finished(queue, queue.submit(lambda start, n: calls.append(n) or [None] * n, 3, chunk_size=1))
+    self.assertEqual(calls, [1, 1, 1])
+
+  def test_runs_one_job_at_a_time_in_order(self):
+    release = threading.Event()
+    started = threading.Event()
+    order = []
+
+    def blocking(start, n):
+      started.set()
+      release.wait(5)
+      order.append("first")
+      return [None] * n
+
+    queue = DesignJobQueue()
+    first = queue.submit(blocking, 1)
+    second = queue.submit(lambda start, n: order.append("second") or [None] * n, 1)
+    third = queue.submit(lambda start, n: order.append("third") or [None] * n, 1)
+    started.wait(5)
+    self.assertEqual(first.status, JOB_RUNNING)
+    self.assertEqual(second.status, JOB_QUEUED)
+    self.assertEqual(queue.position(second), 1)
+    self.assertEqual(queue.position(third), 2)
+    self.assertIn("2 job(s) ahead", queue.status_text(third))
+    release.set()
+    _wait_finished(queue, third)
+    self.assertEqual(order, ["first", "second", "third"])
+    self.assertEqual(queue.stats(), {JOB_DONE: 3})
+
+  def test_cancel_queued_job(self):
+    release = threading.Event()
+    queue = DesignJobQueue()
+    first = queue.submit(lambda start, n: release.wait(5) and [None] * n, 1)
+    second = queue.submit(lambda start, n: self.fail("Cancelled job ran"), 1)
+    self.assertTrue(queue.cancel(second.id))
+    self.assertEqual(second.status, JOB_CANCELLED)
+    self.assertFalse(queue.cancel(second.id))
+    release.set()
+    self.assertEqual(_wait_finished(queue, first).status, JOB_DONE)
+
+  def test_cancel_running_job_keeps_completed_chunks(self):
+    interrupted = threading.Event()
+    queue = DesignJobQueue(interrupt_func=interrupted.set, chunk_size=2)
+    job_ids = []
+
+    def generate(start, n):
+      if start == 0:
+        return ["a", "b"]
+      queue.cancel(job_ids[0])
+      interrupted.wait(5)
+      return ["unfinished"] * n
+
+    job = queue.submit(generate, 6)
+    job_ids.append(job.id)
+    job = _wait_finished(queue, job)
+    self.assertEqual(job.status, JOB_CANCELLED)
+    self.assertTrue(interrupted.is_set())
+    self.assertEqual(job.images, ["a", "b"])
+
+  def test_failed_job(self):
+    def generate(start, n):
+      raise RuntimeError("out of memory")
+
+    queue = DesignJobQueue()
+    job = _wait_finished(queue, queue.submit(generate, 2))
+    self.assertEqual(job.status, JOB_FAILED)
+    self.assertIn("out of memory", job.error)
+    # The worker goes on with the next jobs
+    self.assertEqual(_wait_finished(queue, queue.submit(lambda start, n: [None] * n, 1)).status, JOB_DONE)
+
+  def test_no_images_fails(self):
+    queue = DesignJobQueue()
+    self.assertEqual(_wait_finished(queue, queue.submit(lambda start, n: [], 2)).status, JOB_FAILED)
+
+  def test_progress_of_running_chunk(self):
+    release = threading.Event()
+    started = threading.Event()
+
+    def generate(start, n):
+      started.set()
+      release.wait(5)
+      return [None] * n
+
+    queue = DesignJobQueue(progress_func=lambda: 0.5, chunk_size=4)
+    job = queue.submit(generate, 8)
+    started.wait(5)
+    self.assertAlmostEqual(queue.progress(job), 0.25)
+    release.set()
+    _wait_finished(queue, job)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from PIL import Image
+
+from design_pipeline import build_txt2img_request, templates_per_run, template_grid, pack_template_tiles, \
+  unpack_design_tiles, generated_images_only, CONTROL_MODES, MAX_GRID_ASPECT, MAX_RUN_PIXELS
+
+
+class BuildTxt2imgRequestTests(unittest.TestCase):
+  def test_non_square_canvas(self):
+    txt2img_params, _cn_params = build_txt2img_request({"canvas_width": 768, "canvas_height": 512, "batch_size": 2})
+    self.assertEqual((txt2img_params["width"], txt2img_params["height"]), (768, 512))
+    self.assertEqual(txt2img_params["batch_size"], 2)
+
+  def test_defaults(self):
+    txt2img_params, cn_params = build_txt2img_request({"prompt": "chrome\nwheel"})
+    self.assertEqual((txt2img_params["width"], txt2img_params["height"]), (256, 256))
+    self.assertTrue(txt2img_params["prompt"].startswith("chromewheel"))
+    self.assertEqual(cn_params["control_mode"], CONTROL_MODES[0])
+
+
+class TemplateTilingTests(unittest.TestCase):
+  def test_templates_per_run(self):
+    self.assertEqual(templates_per_run(512, 512), MAX_RUN_PIXELS // (512 * 512))
+    self.assertEqual(templates_per_run(4096, 4096), 1)
+
+  def test_template_grid(self):
+    self.assertEqual(template_grid(1), (1, 1))
+    self.assertEqual(template_grid(4), (2, 2))
+    self.assertEqual(template_grid(6), (2, 3))
+    for count in range(1, 40):
+      cols, rows = template_grid(count)
+      self.assertGreaterEqual(cols * rows, count)
+      self.assertLess(cols * rows - count, min(cols, rows))
+      if count > 2:
+        self.assertLessEqual(max(cols, rows), MAX_GRID_ASPECT * min(cols, rows), count)
+
+  def test_pack_and_unpack(self):
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+    tiles = [Image.new("RGB", (64, 32), color) for color in colors]
+    grid = template_grid(len(tiles))
+    packed = pack_template_tiles(tiles, grid)
+    self.assertEqual(packed.size, (64 * grid[0], 32 * grid[1]))
+    # The unused tile is black
+    self.assertEqual(packed.getpixel((packed.width - 1, packed.height - 1)), (0, 0, 0))
+
+    # Generated at a different scale than the packed input
+    generated = [packed.resize((packed.width * 2, packed.height * 2), Image.NEAREST), packed]
+    designs = unpack_design_tiles(generated, len(tiles), grid)
+    self.assertEqual(len(designs), len(tiles))
+    for color, images in zip(colors, designs):
+      self.assertEqual([image.size for image in images], [(128, 64), (64, 32)])
+      for image in images:
+        self.assertEqual(image.getcolors(), [(image.width * image.height, color)])
+
+  def test_generated_images_only(self):
+    images = list(range(7))
+    self.assertEqual(generated_images_only(images, {"batch_size": 3, "n_iter": 2}), list(range(6)))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+import hint_maps
+from hint_maps import HintMapCache, WheelTemplateHintRenderer, hint_type_for_module, _outline, _dilate, \
+  HINT_CANNY, HINT_SCRIBBLE, HINT_SEG, SEG_COMPONENTS
+from wheel_geometry import WheelTemplate
+
+
+class MaskOpsTests(unittest.TestCase):
+  def test_outline(self):
+    mask = np.zeros((7, 7), dtype=bool)
+    mask[1:6, 1:6] = True
+    expected = mask.copy()
+    expected[2:5, 2:5] = False
+    np.testing.assert_array_equal(_outline(mask), expected)
+
+  def test_outline_at_the_border(self):
+    mask = np.ones((4, 4), dtype=bool)
+    expected = mask.copy()
+    expected[1:3, 1:3] = False
+    np.testing.assert_array_equal(_outline(mask), expected)
+
+  def test_dilate(self):
+    mask = np.zeros((9, 9), dtype=bool)
+    mask[4, 4] = True
+    dilated = _dilate(mask, 2)
+    ys, xs = np.nonzero(dilated)
+    np.testing.assert_array_equal((ys - 4) ** 2 + (xs - 4) ** 2 <= 4, True)
+    self.assertEqual(np.count_nonzero(dilated), 13)
+    # Doesn't wrap around the edges
+    mask = np.zeros((5, 5), dtype=bool)
+    mask[0, 0] = True
+    self.assertEqual(np.count_nonzero(_dilate(mask, 1)), 3)
+
+
+class HintTypeTests(unittest.TestCase):
+  def test_hint_type_for_module(self):
+    self.assertEqual(hint_type_for_module("canny"), HINT_CANNY)
+    self.assertEqual(hint_type_for_module("scribble_pidinet"), HINT_SCRIBBLE)
+    self.assertEqual(hint_type_for_module("seg_ofade20k"), HINT_SEG)
+    self.assertIsNone(hint_type_for_module("depth_midas"))
+    self.assertIsNone(hint_type_for_module(None))
+
+
+class WheelTemplateHintRendererTests(unittest.TestCase):
+  def test_size_follows_the_canvas_aspect(self):
+    renderer = WheelTemplateHintRenderer(WheelTemplate(canvas_size=(768, 512)), 256)
+    self.assertEqual((renderer._canvas_w, renderer._canvas_h), (384, 256))
+
+  def test_canny(self):
+    image = WheelTemplateHintRenderer(WheelTemplate(canvas_size=(384, 256)), 256).generate_hint(HINT_CANNY)
+    self.assertEqual(image.size, (384, 256))
+    pixels = np.asarray(image)
+    self.assertEqual(set(np.unique(pixels)), {0, 255})
+    # Thin lines only
+    self.assertLess(np.count_nonzero(pixels[:, :, 0]), pixels.shape[0] * pixels.shape[1] // 10)
+
+  def test_scribble_is_thicker_than_canny(self):
+    renderer = WheelTemplateHintRenderer(WheelTemplate(), 512)
+    canny = np.count_nonzero(np.asarray(renderer.generate_hint(HINT_CANNY)))
+    scribble = np.count_nonzero(np.asarray(renderer.generate_hint(HINT_SCRIBBLE)))
+    self.assertGreater(scribble, canny)
+
+  def test_seg_colors(self):
+    image = WheelTemplateHintRenderer(WheelTemplate(), 256).generate_hint(HINT_SEG)
+    colors = {tuple(c) for c in np.asarray(image).reshape(-1, 3)}
+    self.assertEqual(colors, {(0, 0, 0)} | {color for _name, color in SEG_COMPONENTS})
+
+  def test_unknown_hint_type(self):
+    with self.assertRaises(Exception):
+      WheelTemplateHintRenderer(WheelTemplate(), 256).generate_hint("depth")
+
+
+class HintMapCacheTests(unittest.TestCase):
+  def _mock_renderer(self):
+    renderer = mock.MagicMock()
+    renderer.return_value.generate_hint.side_effect = lambda hint_type: Image.new("RGB", (8, 8))
+    return mock.patch.object(hint_maps, "WheelTemplateHintRenderer", renderer)
+
+  def test_caches_hints(self):
+    cache = HintMapCache(max_entries=2)
+    with self._mock_renderer() as renderer:
+      hint = cache.get_hint(WheelTemplate(), HINT_CANNY, 512)
+      # The required coverage doesn't change the drawing
+      self.assertIs(cache.get_hint(WheelTemplate(required_coverage_area=0.9), HINT_CANNY, 512), hint)
+      cache.get_hint(WheelTemplate(), HINT_CANNY, 256)
+      cache.get_hint(WheelTemplate(), HINT_SEG, 512)
+      cache.get_hint(WheelTemplate(), HINT_CANNY, 512)
+    self.assertEqual(renderer.call_count, 4)
+    self.assertEqual(cache.stats()["entries"], 2)
+    self.assertEqual(cache.stats()["hits"], 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
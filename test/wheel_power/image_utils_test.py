@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from image_utils import StreamingPngWriter, StreamingTiffWriter, atomic_output_path
+
+
+def random_image(mode, width, height, seed=0):
+  channels = {"L": 1, "RGB": 3, "RGBA": 4}[mode]
+  pixels = np.random.default_rng(seed).integers(0, 256, (height, width, channels), dtype=np.uint8)
+  return pixels.reshape(height, width * channels).tobytes()
+
+
+def write_in_bands(writer, data, stride, band_rows):
+  for start in range(0, len(data), band_rows * stride):
+    writer.write_rows(data[start:start + band_rows * stride])
+  writer.close()
+
+
+class StreamingWritersTests(unittest.TestCase):
+  WIDTH = 37
+  HEIGHT = 53
+
+  def _check(self, f, mode, data):
+    f.seek(0)
+    with Image.open(f) as im:
+      self.assertEqual(im.mode, mode)
+      self.assertEqual(im.size, (self.WIDTH, self.HEIGHT))
+      self.assertEqual(im.tobytes(), data)
+
+  def test_png(self):
+    for mode, channels in (("L", 1), ("RGB", 3), ("RGBA", 4)):
+      data = random_image(mode, self.WIDTH, self.HEIGHT)
+      f = BytesIO()
+      write_in_bands(StreamingPngWriter(f, self.WIDTH, self.HEIGHT, mode), data, self.WIDTH * channels, 10)
+      self._check(f, mode, data)
+
+  def test_tiff(self):
+    for mode, channels in (("L", 1), ("RGB", 3), ("RGBA", 4)):
+      for compress in (False, True):
+        data = random_image(mode, self.WIDTH, self.HEIGHT)
+        f = BytesIO()
+        # Bands that don't line up with the strips
+        writer = StreamingTiffWriter(f, self.WIDTH, self.HEIGHT, mode, rows_per_strip=8, compress=compress)
+        write_in_bands(writer, data, self.WIDTH * channels, 11)
+        self._check(f, mode, data)
+
+  def test_row_count(self):
+    data = random_image("L", self.WIDTH, self.HEIGHT)
+    writer = StreamingPngWriter(BytesIO(), self.WIDTH, self.HEIGHT, "L")
+    writer.write_rows(data[:self.WIDTH])
+    with self.assertRaises(Exception):
+      writer.close()
+    with self.assertRaises(Exception):
+      writer.write_rows(data)
+
+
+class AtomicOutputPathTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.fpath = os.path.join(self.dirpath, "out.bin")
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def test_replaces_on_success(self):
+    with open(self.fpath, "wb") as f:
+      f.write(b"old")
+    with atomic_output_path(self.fpath) as tmp_fpath:
+      self.assertNotEqual(tmp_fpath, self.fpath)
+      with open(tmp_fpath, "wb") as f:
+        f.write(b"new")
+    with open(self.fpath, "rb") as f:
+      self.assertEqual(f.read(), b"new")
+    self.assertEqual(os.listdir(self.dirpath), ["out.bin"])
+
+  def test_removes_on_error(self):
+    with self.assertRaises(ValueError):
+      with atomic_output_path(self.fpath) as tmp_fpath:
+        with open(tmp_fpath, "wb") as f:
+          f.write(b"partial")
+        raise ValueError()
+    self.assertEqual(os.listdir(self.dirpath), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
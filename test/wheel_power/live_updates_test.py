@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+
+from live_updates import LatestWinsCoalescer
+
+
+def _wait_for(predicate, timeout=5.0):
+  deadline = time.time() + timeout
+  while not predicate():
+    if time.time() > deadline:
+      raise AssertionError("Timed out")
+    time.sleep(0.001)
+
+
+class LatestWinsCoalescerTests(unittest.TestCase):
+  def _start(self, coalescer, key, func, results):
+    thread = threading.Thread(target=lambda: results.append(coalescer.run(key, func)))
+    thread.start()
+    return thread
+
+  def _waiting(self, coalescer, key):
+    return coalescer._sessions[key].waiting
+
+  def test_runs_a_single_call(self):
+    coalescer = LatestWinsCoalescer(min_interval=0)
+    self.assertEqual(coalescer.run("a", lambda x: x * 2, 21), (True, 42))
+
+  def test_drops_superseded_waiting_calls(self):
+    coalescer = LatestWinsCoalescer(min_interval=0)
+    release = threading.Event()
+    first, second, third = [], [], []
+    threads = [self._start(coalescer, "a", lambda: release.wait(5) and "first", first)]
+    _wait_for(lambda: coalescer.runs == 1)
+    threads.append(self._start(coalescer, "a", lambda: "second", second))
+    _wait_for(lambda: self._waiting(coalescer, "a") == 1)
+    threads.append(self._start(coalescer, "a", lambda: "third", third))
+    # The second call sees it's superseded while the first still runs
+    _wait_for(lambda: coalescer.dropped == 1)
+    release.set()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(first, [(True, "first")])
+    self.assertEqual(second, [(False, None)])
+    self.assertEqual(third, [(True, "third")])
+    self.assertEqual(coalescer.stats(), {"sessions": 1, "calls": 3, "runs": 2, "dropped": 1})
+
+  def test_sessions_are_independent(self):
+    coalescer = LatestWinsCoalescer(min_interval=0)
+    release = threading.Event()
+    results = []
+    thread = self._start(coalescer, "a", lambda: release.wait(5), results)
+    _wait_for(lambda: coalescer.runs == 1)
+    # Doesn't wait for session "a"
+    self.assertEqual(coalescer.run("b", lambda: "b"), (True, "b"))
+    release.set()
+    thread.join()
+    self.assertEqual(results, [(True, True)])
+
+  def test_min_interval(self):
+    coalescer = LatestWinsCoalescer(min_interval=0.2)
+    coalescer.run("a", lambda: None)
+    start = time.time()
+    coalescer.run("a", lambda: None)
+    self.assertGreaterEqual(time.time() - start, 0.15)
+
+  def test_releases_the_session_on_error(self):
+    coalescer = LatestWinsCoalescer(min_interval=0)
+
+    def fail():
+      raise ValueError()
+
+    with self.assertRaises(ValueError):
+      coalescer.run("a", fail)
+    self.assertEqual(coalescer.run("a", lambda: 1), (True, 1))
+
+  def test_forgets_idle_sessions(self):
+    coalescer = LatestWinsCoalescer(min_interval=0, session_ttl=0)
+    coalescer.run("a", lambda: None)
+    time.sleep(0.01)
+    coalescer.run("b", lambda: None)
+    self.assertEqual(coalescer.stats()["sessions"], 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,93 @@
+import threading
+import unittest
+
+from metrics import MetricsRegistry, format_trace
+
+
+class MetricsRegistryTests(unittest.TestCase):
+  def test_span_stats(self):
+    metrics = MetricsRegistry()
+    for seconds in (0.001, 0.002, 0.003, 0.004):
+      metrics.record("render", seconds)
+    with self.assertRaises(ValueError):
+      with metrics.span("render"):
+        raise ValueError()
+    stats = metrics.snapshot()["spans"]["render"]
+    self.assertEqual(stats["count"], 5)
+    self.assertEqual(stats["errors"], 1)
+    self.assertGreaterEqual(stats["max_ms"], 4.0)
+    self.assertAlmostEqual(stats["p50_ms"], 2.0, delta=0.5)
+    metrics.reset()
+    self.assertEqual(metrics.snapshot()["spans"], {})
+
+  def test_trace_passes_its_spans_to_sinks(self):
+    metrics = MetricsRegistry()
+    traces = []
+    sink = lambda *args: traces.append(args)
+    metrics.add_sink(sink)
+    metrics.add_sink(sink)
+    with metrics.trace("generate"):
+      with metrics.span("txt2img"):
+        pass
+      metrics.record("save", 0.5)
+    # Spans outside of a trace aren't traced
+    metrics.record("save", 0.5)
+    self.assertEqual(len(traces), 1)
+    name, _seconds, spans, error = traces[0]
+    self.assertEqual(name, "generate")
+    self.assertEqual([span_name for span_name, _span_seconds in spans], ["txt2img", "save"])
+    self.assertFalse(error)
+    self.assertEqual(metrics.snapshot()["spans"]["save"]["count"], 2)
+
+    metrics.remove_sink(sink)
+    with metrics.trace("generate"):
+      pass
+    self.assertEqual(len(traces), 1)
+
+  def test_nested_traces(self):
+    metrics = MetricsRegistry()
+    traces = []
+    metrics.add_sink(lambda name, seconds, spans, error: traces.append((name, [s for s, _t in spans])))
+    with metrics.trace("outer"):
+      metrics.record("a", 0.1)
+      with metrics.trace("inner"):
+        metrics.record("b", 0.1)
+      metrics.record("c", 0.1)
+    self.assertEqual(traces, [("inner", ["b"]), ("outer", ["a", "inner", "c"])])
+
+  def test_traces_are_per_thread(self):
+    metrics = MetricsRegistry()
+    traces = []
+    metrics.add_sink(lambda name, seconds, spans, error: traces.append(spans))
+    with metrics.trace("generate"):
+      thread = threading.Thread(target=metrics.record, args=("other", 0.1))
+      thread.start()
+      thread.join()
+    self.assertEqual(traces, [[]])
+
+  def test_failing_sink_and_stats(self):
+    metrics = MetricsRegistry()
+
+    def failing_sink(*args):
+      raise Exception("sink")
+
+    def failing_stats():
+      raise Exception("stats")
+
+    metrics.add_sink(failing_sink)
+    with metrics.trace("generate"):
+      pass
+    metrics.register_stats("cache", lambda: {"entries": 3})
+    metrics.register_stats("broken", failing_stats)
+    self.assertEqual(metrics.snapshot()["stats"], {"cache": {"entries": 3}, "broken": {"error": "stats"}})
+
+
+class FormatTraceTests(unittest.TestCase):
+  def test_format_trace(self):
+    line = format_trace("generate", 1.5, [("txt2img", 1.0), ("save", 0.2), ("save", 0.1)])
+    self.assertEqual(line, "generate 1.500s: txt2img 1.000s, save 0.300s")
+    self.assertEqual(format_trace("generate", 0.1, [], error=True), "generate (failed) 0.100s: -")
+
+
+if __name__ == "__main__":
+  unittest.main()
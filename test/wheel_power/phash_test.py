@@ -0,0 +1,130 @@
+import unittest
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from phash import (MultiIndexHash, hamming_distances, popcount64, unique_indices, group_near_duplicates,
+                   phash_images)
+
+
+def random_hashes(n, seed=0):
+  return np.random.default_rng(seed).integers(0, 1 << 63, n, dtype=np.uint64) * np.uint64(2)
+
+
+def flip_bits(phash, count, rng):
+  for bit in rng.choice(64, count, replace=False).tolist():
+    phash ^= 1 << bit
+  return phash
+
+
+class PopcountTests(unittest.TestCase):
+  def test_popcount(self):
+    values = random_hashes(1000)
+    expected = [bin(v).count("1") for v in values.tolist()]
+    self.assertEqual(popcount64(values).tolist(), expected)
+    self.assertEqual(popcount64(np.array([0, (1 << 64) - 1], dtype=np.uint64)).tolist(), [0, 64])
+
+
+class MultiIndexHashTests(unittest.TestCase):
+  def setUp(self):
+    rng = np.random.default_rng(1)
+    hashes = random_hashes(5000).tolist()
+    # Plant near neighbours of some hashes, at every distance up to past the radius
+    for i in range(200):
+      hashes.append(flip_bits(hashes[i], i % 10, rng))
+    self.hashes = np.array(hashes, dtype=np.uint64)
+    self.queries = [flip_bits(h, k, rng) for h, k in zip(hashes[:100], rng.integers(0, 8, 100).tolist())]
+
+  def test_matches_brute_force(self):
+    for radius in (6, 3):
+      index = MultiIndexHash(self.hashes, radius)
+      for query_radius in sorted({radius, 2}):
+        for query in self.queries + self.hashes[-50:].tolist():
+          expected = np.flatnonzero(hamming_distances(self.hashes, query) <= query_radius)
+          self.assertEqual(index.query(query, query_radius).tolist(), expected.tolist())
+
+  def test_add(self):
+    index = MultiIndexHash(self.hashes[:1000])
+    index.query(0)
+    ids = index.add(self.hashes[1000:])
+    self.assertEqual(ids.tolist(), list(range(1000, len(self.hashes))))
+    query = self.queries[0]
+    expected = np.flatnonzero(hamming_distances(self.hashes, query) <= index.radius)
+    self.assertEqual(index.query(query).tolist(), expected.tolist())
+
+  def test_add_merges_like_a_rebuild(self):
+    # Chunk values repeat, so equal values must keep the order of their ids
+    hashes = self.hashes % np.uint64(1 << 20)
+    index = MultiIndexHash(hashes[:500], 3)
+    index.query(0)
+    for start, stop in ((500, 501), (501, 2000), (2000, len(hashes))):
+      index.add(hashes[start:stop])
+    rebuilt = MultiIndexHash(hashes, 3)
+    rebuilt.query(0)
+    for (values, order), (expected_values, expected_order) in zip(index._tables, rebuilt._tables):
+      self.assertEqual(values.tolist(), expected_values.tolist())
+      self.assertEqual(order.tolist(), expected_order.tolist())
+
+  def test_radius_larger_than_index(self):
+    with self.assertRaises(Exception):
+      MultiIndexHash(self.hashes, 3).query(0, 4)
+
+  def test_empty(self):
+    self.assertEqual(MultiIndexHash().query(123).tolist(), [])
+
+
+class NearDuplicatesTests(unittest.TestCase):
+  def test_unique_indices(self):
+    a, b = random_hashes(2).tolist()
+    hashes = [a, a ^ 1, b, a ^ 0xff00, b ^ 0b111]
+    self.assertEqual(unique_indices(hashes, radius=6), [0, 2, 3])
+    self.assertEqual(unique_indices(hashes, radius=0), [0, 1, 2, 3, 4])
+
+  def test_groups_are_transitive(self):
+    a, b, c = random_hashes(3).tolist()
+    # a - 4 bits - a1 - 4 bits - a2, where a and a2 are 8 bits apart
+    a1 = a ^ 0xf
+    a2 = a1 ^ 0xf0
+    hashes = [a, b, a2, c, a1, b ^ 1]
+    self.assertEqual(group_near_duplicates(hashes, radius=4), [[0, 2, 4], [1, 5]])
+
+  def test_groups_match_brute_force(self):
+    rng = np.random.default_rng(2)
+    hashes = random_hashes(300).tolist()
+    hashes += [flip_bits(hashes[i], int(rng.integers(0, 9)), rng) for i in range(100)]
+    hashes = np.array(hashes, dtype=np.uint64)
+    # Connected components over the near pairs, by flood fill
+    near = popcount64(np.bitwise_xor(hashes[:, None], hashes[None, :])) <= 6
+    seen = set()
+    expected = []
+    for i in range(len(hashes)):
+      if i in seen:
+        continue
+      group, stack = set(), [i]
+      while stack:
+        j = stack.pop()
+        if j not in group:
+          group.add(j)
+          stack.extend(np.flatnonzero(near[j]).tolist())
+      seen |= group
+      if len(group) > 1:
+        expected.append(sorted(group))
+    self.assertEqual(group_near_duplicates(hashes, radius=6), expected)
+
+
+class ImageHashTests(unittest.TestCase):
+  def test_similar_images_are_near(self):
+    rng = np.random.default_rng(3)
+    pixels = np.kron(rng.integers(0, 256, (16, 16, 3)), np.ones((32, 32, 1))).astype(np.uint8)
+    im = Image.fromarray(pixels, "RGB")
+    other = Image.fromarray(np.kron(rng.integers(0, 256, (16, 16, 3)), np.ones((32, 32, 1))).astype(np.uint8), "RGB")
+    hashes = phash_images([im, im.filter(ImageFilter.GaussianBlur(2)), im.resize((300, 300)), other])
+    self.assertEqual(hashes.dtype, np.uint64)
+    distances = hamming_distances(hashes, hashes[0]).tolist()
+    self.assertLessEqual(distances[1], 6)
+    self.assertLessEqual(distances[2], 6)
+    self.assertGreater(distances[3], 6)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,151 @@
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+import render_cache
+from render_cache import TemplateRenderCache, LayerCache, WheelTemplateLayeredRenderer, template_spec_hash, \
+  template_render_hash
+from wheel_geometry import WheelTemplate, WheelTemplateRenderer
+
+
+def _mock_renderer():
+  renderer = mock.MagicMock()
+  renderer.return_value.generate_raster.side_effect = lambda *args, **kwargs: Image.new("RGBA", (64, 64))
+  return renderer
+
+
+class TemplateHashTests(unittest.TestCase):
+  def test_json_round_trip(self):
+    wt = WheelTemplate(spoke_count=6, canvas_size=(512, 384))
+    specs = json.loads(json.dumps(wt.to_dict()))
+    self.assertEqual(template_spec_hash(WheelTemplate(**specs)), template_spec_hash(wt))
+
+  def test_specs_and_options(self):
+    wt = WheelTemplate()
+    self.assertNotEqual(template_spec_hash(WheelTemplate(spoke_count=6)), template_spec_hash(wt))
+    self.assertNotEqual(template_spec_hash(wt, alpha_channel=False), template_spec_hash(wt, alpha_channel=True))
+
+  def test_render_hash_ignores_non_render_specs(self):
+    a = WheelTemplate(required_coverage_area=0.3)
+    b = WheelTemplate(required_coverage_area=0.6)
+    self.assertNotEqual(template_spec_hash(a), template_spec_hash(b))
+    self.assertEqual(template_render_hash(a), template_render_hash(b))
+
+
+class TemplateRenderCacheTests(unittest.TestCase):
+  def test_caches_renders(self):
+    cache = TemplateRenderCache()
+    with mock.patch.object(render_cache, "WheelTemplateLayeredRenderer", _mock_renderer()) as renderer:
+      image, areas = cache.render(WheelTemplate())
+      self.assertIs(cache.render(WheelTemplate(required_coverage_area=0.9))[0], image)
+      self.assertEqual(areas, WheelTemplate().calc_areas())
+      cache.render(WheelTemplate(), alpha_channel=False)
+    self.assertEqual(renderer.call_count, 2)
+    self.assertEqual(cache.stats()["hits"], 1)
+
+  def test_evicts_by_image_size(self):
+    # Room for one 64x64 RGBA image
+    cache = TemplateRenderCache(max_bytes=64 * 64 * 4)
+    with mock.patch.object(render_cache, "WheelTemplateLayeredRenderer", _mock_renderer()) as renderer:
+      cache.render(WheelTemplate(spoke_count=5))
+      cache.render(WheelTemplate(spoke_count=6))
+      cache.render(WheelTemplate(spoke_count=5))
+    self.assertEqual(renderer.call_count, 3)
+    self.assertEqual(cache.stats()["entries"], 1)
+
+  def test_no_areas_for_invalid_geometry(self):
+    wt = WheelTemplate(hub_diameter=20)
+    self.assertTrue(wt.check_errors_in_geometry()[0])
+    with mock.patch.object(render_cache, "WheelTemplateLayeredRenderer", _mock_renderer()):
+      _image, areas = TemplateRenderCache().render(wt)
+    self.assertIsNone(areas)
+
+  def test_matches_uncached_render(self):
+    wt = WheelTemplate(spoke_count=7, canvas_size=(256, 256))
+    image, _areas = TemplateRenderCache().render(wt, alpha_channel=False)
+    expected = render_cache.WheelTemplateLayeredRenderer(wt).generate_raster("pil", alpha_channel=False)
+    self.assertEqual(image.tobytes(), expected.tobytes())
+
+
+class RenderSizesTests(unittest.TestCase):
+  def _mock_recording(self):
+    recording = mock.MagicMock()
+    recording.return_value.replay.side_effect = lambda size, *args: Image.new("RGBA", size)
+    return mock.patch.object(render_cache, "WheelTemplateRecordingRenderer", recording)
+
+  def test_records_once_for_all_sizes(self):
+    cache = TemplateRenderCache()
+    sizes = [(64, 64), (128, 96), (256, 256)]
+    with self._mock_recording() as recording:
+      images, areas = cache.render_sizes(WheelTemplate(), sizes)
+      self.assertEqual([image.size for image in images], sizes)
+      self.assertEqual(areas, WheelTemplate().calc_areas())
+      # Another canvas size of the same template, and a size that's already cached
+      other_images, _areas = cache.render_sizes(WheelTemplate(canvas_size=(1024, 1024)), [(64, 64), (32, 32)])
+    self.assertEqual(recording.call_count, 1)
+    self.assertEqual(recording.return_value.replay.call_count, 4)
+    self.assertIs(other_images[0], images[0])
+
+  def test_shares_entries_with_render(self):
+    cache = TemplateRenderCache()
+    with self._mock_recording(), \
+         mock.patch.object(render_cache, "WheelTemplateLayeredRenderer", _mock_renderer()) as renderer:
+      images, _areas = cache.render_sizes(WheelTemplate(), [(128, 128)])
+      image, _areas = cache.render(WheelTemplate(canvas_size=(128, 128)))
+    self.assertIs(image, images[0])
+    renderer.assert_not_called()
+
+  def test_replay_matches_direct_render(self):
+    wt = WheelTemplate(spoke_count=7)
+    images, _areas = TemplateRenderCache().render_sizes(wt, [(128, 128), (300, 200)])
+    for image, size in zip(images, [(128, 128), (300, 200)]):
+      expected = WheelTemplateRenderer(WheelTemplate(**dict(wt.to_dict(), canvas_size=size))).generate_raster("pil")
+      self.assertEqual(image.size, size)
+      diff = np.abs(np.asarray(image, dtype=np.int16) - np.asarray(expected, dtype=np.int16))
+      self.assertLess(diff.mean(), 0.5)
+
+
+class WheelTemplateLayeredRendererTests(unittest.TestCase):
+  def _layer_keys(self, wt, color_errors=False):
+    renderer = WheelTemplateLayeredRenderer(wt, LayerCache())
+    renderer._prepare_render(color_errors)
+    return {name: renderer._layer_key(name) for name in WheelTemplateLayeredRenderer.LAYER_ARGS}
+
+  def test_layer_keys(self):
+    keys = self._layer_keys(WheelTemplate(spoke_central_angle=20))
+    spokes_changed = self._layer_keys(WheelTemplate(spoke_central_angle=30))
+    self.assertEqual(spokes_changed["rim"], keys["rim"])
+    self.assertEqual(spokes_changed["hub_and_lug_nuts"], keys["hub_and_lug_nuts"])
+    self.assertNotEqual(spokes_changed["spokes"], keys["spokes"])
+    resized = self._layer_keys(WheelTemplate(spoke_central_angle=20, canvas_size=(256, 256)))
+    self.assertFalse(set(resized.values()) & set(keys.values()))
+
+  def test_layer_keys_of_colored_errors(self):
+    wt = WheelTemplate(spoke_count=40, spoke_central_angle=20)
+    _errors, err_parts = wt.check_errors_in_geometry()
+    self.assertEqual(set(err_parts), {WheelTemplate.SPOKES})
+    keys = self._layer_keys(wt)
+    colored = self._layer_keys(wt, color_errors=True)
+    self.assertEqual(colored["rim"], keys["rim"])
+    self.assertNotEqual(colored["spokes"], keys["spokes"])
+
+  def test_reuses_unchanged_layers(self):
+    layer_cache = LayerCache()
+    WheelTemplateLayeredRenderer(WheelTemplate(spoke_central_angle=20), layer_cache).generate_raster("pil")
+    WheelTemplateLayeredRenderer(WheelTemplate(spoke_central_angle=30), layer_cache).generate_raster("pil")
+    self.assertEqual(layer_cache.stats()["hits"], 2)
+    self.assertEqual(len(layer_cache), 4)
+
+  def test_close_to_direct_render(self):
+    # Compositing the layers blends their shared anti-aliased edges slightly differently
+    wt = WheelTemplate(spoke_count=7, canvas_size=(256, 256))
+    layered = np.asarray(WheelTemplateLayeredRenderer(wt, LayerCache()).generate_raster("pil"), dtype=np.int16)
+    direct = np.asarray(WheelTemplateRenderer(wt).generate_raster("pil"), dtype=np.int16)
+    self.assertLess(np.abs(layered - direct).mean(), 0.5)
+
+
+if __name__ == "__main__":
+  unittest.main()
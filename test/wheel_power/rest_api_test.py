@@ -0,0 +1,179 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from zipfile import ZipFile
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw
+
+from catalog import Catalog, CATALOG_DB_NAME, DESIGNS
+from design_archive import BlobStore, save_design, DESIGN_JSON, TEMPLATE_JSON
+from metrics import g_metrics
+from rest_api import mount_routes, API_PREFIX
+from thumbnails import write_thumbnail, TEMPLATE_JSON_FNAME
+from wheel_geometry import WheelTemplate
+
+
+def _png_bytes(seed, size=64):
+  image = Image.new("RGB", (size, size), (255, 255, 255))
+  draw = ImageDraw.Draw(image)
+  for i in range(8):
+    x, y = (seed * 37 + i * 53) % size, (seed * 91 + i * 29) % size
+    draw.ellipse((x, y, x + size // 4, y + size // 4), fill=(0, 0, 0))
+  buf = BytesIO()
+  image.save(buf, format="PNG")
+  return buf.getvalue()
+
+
+class RestApiTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.templates_dir = os.path.join(self.dirpath, "templates")
+    self.designs_dir = os.path.join(self.dirpath, "designs")
+    os.makedirs(self.templates_dir)
+    os.makedirs(self.designs_dir)
+    self.blob_store = BlobStore(os.path.join(self.dirpath, "blobs"))
+    self.catalog = Catalog(os.path.join(self.dirpath, CATALOG_DB_NAME), self.templates_dir, self.designs_dir)
+    self.zip_compresslevel = 6
+
+    for dirname, spoke_count in (("t1", 5), ("t2", 8)):
+      dirpath = os.path.join(self.templates_dir, dirname)
+      os.makedirs(dirpath)
+      wt = WheelTemplate(spoke_count=spoke_count)
+      with open(os.path.join(dirpath, TEMPLATE_JSON_FNAME), "w") as f:
+        json.dump({"specs": wt.to_dict()}, f)
+      write_thumbnail(wt, dirpath, Image.new("RGBA", (16, 16)))
+    self._save_design("d1", "chrome", [1])
+    self._save_design("d2", "gold", [2])
+    self.catalog.rescan()
+
+  def tearDown(self):
+    self.catalog.close()
+    shutil.rmtree(self.dirpath)
+
+  def _save_design(self, dirname, prompt, seeds):
+    fpaths = []
+    for i, seed in enumerate(seeds):
+      fpaths.append(os.path.join(self.dirpath, "%s_%d.png" % (dirname, i)))
+      with open(fpaths[-1], "wb") as f:
+        f.write(_png_bytes(seed))
+    save_design(os.path.join(self.designs_dir, dirname), self.blob_store, WheelTemplate(), _png_bytes(0), fpaths,
+                {}, {"prompt": prompt})
+    self.catalog.update(DESIGNS, dirname)
+
+  def _client(self, api_auth=None):
+    app = FastAPI()
+    mount_routes(app, self.catalog, self.templates_dir, self.designs_dir, self.blob_store, api_auth,
+                 lambda: self.zip_compresslevel)
+    return TestClient(app)
+
+  def test_list_templates(self):
+    client = self._client()
+    r = client.get(API_PREFIX + "/templates", params={"search": "spoke_count:6..", "page_size": 5})
+    self.assertEqual(r.status_code, 200)
+    res = r.json()
+    self.assertEqual(res["total"], 1)
+    self.assertEqual(res["templates"][0]["dir"], "t2")
+    self.assertEqual(res["templates"][0]["spoke_count"], 8)
+    r = client.get(res["templates"][0]["thumbnail_url"])
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(r.headers["content-type"], "image/png")
+
+    self.assertEqual(client.get(API_PREFIX + "/templates", params={"page_size": 0}).status_code, 422)
+    self.assertEqual(client.get(API_PREFIX + "/templates", params={"search": "prompt:1"}).status_code, 400)
+
+  def test_only_saved_dirs(self):
+    client = self._client()
+    self.assertEqual(client.get(API_PREFIX + "/templates/t3/thumbnail").status_code, 404)
+    self.assertEqual(client.get(API_PREFIX + "/templates/%2E%2E/thumbnail").status_code, 404)
+    self.assertEqual(client.get(API_PREFIX + "/designs/t1/zip").status_code, 404)
+
+  def test_metrics(self):
+    r = self._client().get(API_PREFIX + "/metrics")
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(set(r.json().keys()), {"spans", "stats"})
+
+  def test_design_zip(self):
+    client = self._client()
+    r = client.get(API_PREFIX + "/designs/d1/zip")
+    self.assertEqual(r.status_code, 200)
+    self.assertIn('filename="d1.zip"', r.headers["content-disposition"])
+    with ZipFile(BytesIO(r.content)) as z:
+      self.assertEqual(z.namelist(), [TEMPLATE_JSON, "template.png", "design_0.png", DESIGN_JSON])
+      self.assertEqual(json.loads(z.read(DESIGN_JSON))["design"]["render"]["prompt"], "chrome")
+      self.assertIsNone(z.testzip())
+
+  def test_zip_compresslevel(self):
+    client = self._client()
+
+    def json_size(params=None):
+      r = client.get(API_PREFIX + "/designs/d1/zip", params=params)
+      self.assertEqual(r.status_code, 200)
+      with ZipFile(BytesIO(r.content)) as z:
+        return z.getinfo(DESIGN_JSON).compress_size
+
+    self.assertGreater(json_size({"compresslevel": 0}), json_size({"compresslevel": 9}))
+    # The setting applies when the request doesn't give a level
+    self.zip_compresslevel = 0
+    self.assertEqual(json_size(), json_size({"compresslevel": 0}))
+    self.assertEqual(client.get(API_PREFIX + "/designs/d1/zip", params={"compresslevel": 10}).status_code, 422)
+    self.assertEqual(client.get(API_PREFIX + "/designs/export", params={"compresslevel": -1}).status_code, 422)
+
+  def test_export(self):
+    client = self._client()
+    r = client.get(API_PREFIX + "/designs/export")
+    self.assertEqual(r.status_code, 200)
+    with ZipFile(BytesIO(r.content)) as z:
+      self.assertEqual(sorted({name.split("/")[0] for name in z.namelist()}), ["d1", "d2"])
+    r = client.get(API_PREFIX + "/designs/export", params={"search": "gold"})
+    with ZipFile(BytesIO(r.content)) as z:
+      self.assertEqual({name.split("/")[0] for name in z.namelist()}, {"d2"})
+      self.assertEqual(json.loads(z.read("d2/" + DESIGN_JSON))["design"]["render"]["prompt"], "gold")
+
+  def test_auth(self):
+    client = self._client("ann:secret,bob:pass:word")
+    self.assertEqual(client.get(API_PREFIX + "/metrics").status_code, 401)
+    self.assertEqual(client.get(API_PREFIX + "/metrics", auth=("ann", "wrong")).status_code, 401)
+    self.assertEqual(client.get(API_PREFIX + "/metrics", auth=("ann", "secret")).status_code, 200)
+    self.assertEqual(client.get(API_PREFIX + "/designs/d1/zip", auth=("bob", "pass:word")).status_code, 200)
+
+  def test_near_duplicates(self):
+    client = self._client()
+    self._save_design("d3", "chrome again", [3, 1])
+    r = client.get(API_PREFIX + "/designs/duplicates")
+    self.assertEqual(r.status_code, 200)
+    res = r.json()
+    self.assertEqual(res["images"], 4)
+    self.assertEqual(res["groups"], [[{"dir": "d1", "image": 0}, {"dir": "d3", "image": 1}]])
+
+    r = client.get(API_PREFIX + "/designs/d1/similar", params={"image": 0})
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(r.json()["similar"], [{"dir": "d3", "image": 1, "distance": 0}])
+    self.assertEqual(client.get(API_PREFIX + "/designs/d1/similar", params={"image": 5}).status_code, 404)
+    self.assertEqual(client.get(API_PREFIX + "/designs/duplicates", params={"radius": 64}).status_code, 422)
+
+  def test_index_follows_the_catalog(self):
+    client = self._client()
+    duplicates = lambda: client.get(API_PREFIX + "/designs/duplicates").json()
+    builds = lambda: g_metrics.snapshot()["spans"].get("phash_index", {}).get("count", 0)
+    self.assertEqual(duplicates()["groups"], [])
+    num_builds = builds()
+    # Added designs are added to the index, without rebuilding it
+    self._save_design("d3", "gold again", [2])
+    self.assertEqual(duplicates()["groups"], [[{"dir": "d2", "image": 0}, {"dir": "d3", "image": 0}]])
+    self.assertEqual(builds(), num_builds)
+    # Removed ones are removed from it
+    shutil.rmtree(os.path.join(self.designs_dir, "d2"))
+    self.catalog.rescan()
+    res = duplicates()
+    self.assertEqual(res["images"], 2)
+    self.assertEqual(res["groups"], [])
+    self.assertEqual(builds(), num_builds + 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
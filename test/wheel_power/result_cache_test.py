@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from result_cache import DesignResultCache, generation_key, image_content_hash
+
+
+def _image(seed, size=32):
+  pixels = np.random.default_rng(seed).integers(0, 256, (size, size, 3), dtype=np.uint8)
+  return Image.fromarray(pixels, "RGB")
+
+
+class GenerationKeyTests(unittest.TestCase):
+  def test_image_content_hash(self):
+    self.assertEqual(image_content_hash(_image(1)), image_content_hash(_image(1)))
+    self.assertNotEqual(image_content_hash(_image(1)), image_content_hash(_image(2)))
+    self.assertNotEqual(image_content_hash(Image.new("L", (4, 2))), image_content_hash(Image.new("L", (2, 4))))
+
+  def test_generation_key(self):
+    txt2img_params = {"prompt": "chrome", "seed": 1, "width": 512}
+    cn_params = {"module": "canny", "weight": 1.0}
+    key = generation_key(_image(1), txt2img_params, cn_params, "abc")
+    self.assertEqual(generation_key(_image(1), dict(reversed(list(txt2img_params.items()))), cn_params, "abc"), key)
+    self.assertNotEqual(generation_key(_image(2), txt2img_params, cn_params, "abc"), key)
+    self.assertNotEqual(generation_key(_image(1), dict(txt2img_params, seed=2), cn_params, "abc"), key)
+    self.assertNotEqual(generation_key(_image(1), txt2img_params, dict(cn_params, weight=0.5), "abc"), key)
+    self.assertNotEqual(generation_key(_image(1), txt2img_params, cn_params, "def"), key)
+
+
+class DesignResultCacheTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.root_dir = os.path.join(self.dirpath, "result_cache")
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def _entry_size(self):
+    cache = DesignResultCache(os.path.join(self.dirpath, "sizes"))
+    cache.put("k", [_image(0)])
+    return cache.stats()["bytes"]
+
+  def test_round_trip(self):
+    cache = DesignResultCache(self.root_dir)
+    self.assertIsNone(cache.get("k"))
+    images = [_image(1), _image(2)]
+    cache.put("k", images)
+    cached = cache.get("k")
+    self.assertEqual([im.tobytes() for im in cached], [im.tobytes() for im in images])
+    stats = cache.stats()
+    self.assertEqual((stats["entries"], stats["hits"], stats["misses"]), (1, 1, 1))
+    # No temp dirs are left behind
+    self.assertEqual(os.listdir(self.root_dir), ["k"])
+
+  def test_evicts_least_recently_used(self):
+    size = self._entry_size()
+    cache = DesignResultCache(self.root_dir, max_bytes=2 * size)
+    cache.put("a", [_image(0)])
+    time.sleep(0.01)
+    cache.put("b", [_image(0)])
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", [_image(0)])
+    self.assertIsNone(cache.get("b"))
+    self.assertIsNotNone(cache.get("a"))
+    self.assertIsNotNone(cache.get("c"))
+    self.assertEqual(sorted(os.listdir(self.root_dir)), ["a", "c"])
+    self.assertLessEqual(cache.stats()["bytes"], 2 * size)
+
+  def test_too_large(self):
+    cache = DesignResultCache(self.root_dir, max_bytes=10)
+    cache.put("k", [_image(1)])
+    self.assertIsNone(cache.get("k"))
+    self.assertEqual(os.listdir(self.root_dir), [])
+
+  def test_persists(self):
+    DesignResultCache(self.root_dir).put("k", [_image(1)])
+    # A partial entry of an interrupted put
+    os.makedirs(os.path.join(self.root_dir, ".tmp"))
+    cache = DesignResultCache(self.root_dir)
+    self.assertEqual(cache.get("k")[0].tobytes(), _image(1).tobytes())
+    self.assertEqual(cache.stats()["entries"], 1)
+
+  def test_entry_removed_externally(self):
+    cache = DesignResultCache(self.root_dir)
+    cache.put("k", [_image(1)])
+    shutil.rmtree(os.path.join(self.root_dir, "k"))
+    self.assertIsNone(cache.get("k"))
+    self.assertEqual(cache.stats()["bytes"], 0)
+
+  def test_clear(self):
+    cache = DesignResultCache(self.root_dir)
+    cache.put("k", [_image(1)])
+    cache.clear()
+    self.assertIsNone(cache.get("k"))
+    self.assertFalse(os.path.exists(self.root_dir))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+import sweep
+from sweep import parse_sweep, TemplateSweep, sweep_fname, OUT_OF_RANGE_ERR, DEFAULT_STEPS
+from wheel_geometry import WheelTemplate
+
+
+def _fake_render_cell(specs):
+  return Image.new("RGB", tuple(int(v) for v in specs["canvas_size"]), (int(specs["spoke_count"]) * 20, 100, 100))
+
+
+class ParseSweepTests(unittest.TestCase):
+  def test_values(self):
+    axes = parse_sweep("spoke_count:3..6 spoke_central_angle:10..40/4 rim_width:1,1.5")
+    self.assertEqual([arg for arg, _values in axes], ["spoke_count", "spoke_central_angle", "rim_width"])
+    np.testing.assert_array_equal(axes[0][1], [3, 4, 5, 6])
+    np.testing.assert_allclose(axes[1][1], [10, 20, 30, 40])
+    np.testing.assert_allclose(axes[2][1], [1, 1.5])
+
+  def test_default_steps(self):
+    (_arg, values), = parse_sweep("hub_width:1..3")
+    self.assertEqual(len(values), DEFAULT_STEPS)
+
+  def test_counts_are_rounded_and_unique(self):
+    (_arg, values), = parse_sweep("spoke_count:3..5/7")
+    np.testing.assert_array_equal(values, [3, 4, 5])
+
+  def test_invalid(self):
+    for text in ["", "spoke_count", "unknown:1", "canvas_size:1", "spoke_count:a..b", "spoke_count:3 spoke_count:4",
+                 "spoke_count:6..3"]:
+      with self.assertRaises(Exception, msg=text):
+        parse_sweep(text)
+
+
+class TemplateSweepTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    patcher = mock.patch.object(sweep, "_render_cell", _fake_render_cell)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def test_layout(self):
+    s = TemplateSweep(WheelTemplate(), parse_sweep("spoke_count:3..5 spoke_central_angle:10..40/4"), cell_size=32)
+    self.assertEqual(s.num_cells, 12)
+    self.assertEqual((s.num_columns, s.num_rows), (4, 3))
+    self.assertEqual((s.width, s.height), (4 * s.cell_width, 3 * s.cell_height))
+    # Row-major order of the axes
+    self.assertEqual(s.swept_values["spoke_count"].tolist(), [3] * 4 + [4] * 4 + [5] * 4)
+    self.assertEqual(s.swept_values["spoke_central_angle"].tolist(), [10, 20, 30, 40] * 3)
+
+  def test_invalid_combinations(self):
+    s = TemplateSweep(WheelTemplate(), parse_sweep("spoke_count:0,5 spoke_central_angle:20,-5"), cell_size=32)
+    self.assertEqual(s.errors[0], OUT_OF_RANGE_ERR)
+    self.assertEqual(s.errors[3], OUT_OF_RANGE_ERR)
+    self.assertEqual(s.errors[2], 0)
+    self.assertEqual(s.num_valid, 1)
+    self.assertEqual(s._label_lines(0)[0][0], "spoke_count=0")
+    self.assertIn("out of range: spoke_count", s._label_lines(1)[-1][0])
+    self.assertEqual(s._label_lines(3)[-1][0], "out of range: spoke_central_angle")
+    self.assertTrue(s._label_lines(2)[-1][0].startswith("coverage"))
+
+  def test_invalid_geometry(self):
+    s = TemplateSweep(WheelTemplate(), parse_sweep("hub_diameter:5,20"), cell_size=32)
+    self.assertEqual(s.errors[0], 0)
+    self.assertNotIn(s.errors[1], (0, OUT_OF_RANGE_ERR))
+    self.assertTrue(s._label_lines(1)[-1][0].startswith("invalid: "))
+
+  def test_too_many_cells(self):
+    with self.assertRaises(Exception):
+      TemplateSweep(WheelTemplate(), parse_sweep("spoke_count:3..30 spoke_central_angle:1..40/20"))
+
+  def test_contact_sheet(self):
+    s = TemplateSweep(WheelTemplate(), parse_sweep("spoke_count:3..6 hub_diameter:5,20"), cell_size=32)
+    for workers in (0, 2):
+      fpath = os.path.join(self.dirpath, "sheet%d.png" % workers)
+      progress = []
+      for rows, sheet in s.iter_contact_sheet(fpath, workers):
+        progress.append(rows)
+      self.assertEqual(progress, list(range(1, s.num_rows + 1)))
+      with Image.open(fpath) as im:
+        self.assertEqual(im.size, (s.width, s.height))
+        self.assertEqual(im.tobytes(), sheet.tobytes())
+      # The rendered cells are in place, and the invalid ones are left empty
+      for index in range(s.num_cells):
+        row, col = divmod(index, s.num_columns)
+        x, y = col * s.cell_width + sweep.CELL_MARGIN + 1, row * s.cell_height + sweep.CELL_MARGIN + 1
+        pixel = sheet.getpixel((x, y))
+        if s.errors[index]:
+          self.assertEqual(pixel, sweep.BACKGROUND_COLOR)
+        else:
+          self.assertEqual(pixel, (int(s.swept_values["spoke_count"][index]) * 20, 100, 100))
+    self.assertEqual(sorted(os.listdir(self.dirpath)), ["sheet0.png", "sheet2.png"])
+
+  def test_sweep_fname(self):
+    fname = sweep_fname(parse_sweep("spoke_count:3,4 rim_width:1"))
+    self.assertTrue(fname.startswith("sweep_spoke_count_rim_width_"))
+    self.assertTrue(fname.endswith(".png"))
+
+
+if __name__ == "__main__":
+  unittest.main()
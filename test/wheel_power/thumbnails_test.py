@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import thumbnails
+from catalog import Catalog, CATALOG_DB_NAME
+from thumbnails import thumbnail_path, thumbnail_is_stale, thumbnail_size, write_thumbnail, get_thumbnail, \
+  template_previews, THUMBNAIL_SIZE, TEMPLATE_JSON_FNAME
+from wheel_geometry import WheelTemplate
+
+
+class ThumbnailsTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.templates_dir = os.path.join(self.dirpath, "templates")
+    os.makedirs(self.templates_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def _save_template(self, dirname, mtime=None, **specs):
+    dirpath = os.path.join(self.templates_dir, dirname)
+    os.makedirs(dirpath)
+    json_fpath = os.path.join(dirpath, TEMPLATE_JSON_FNAME)
+    with open(json_fpath, "w") as f:
+      json.dump({"specs": WheelTemplate(**specs).to_dict()}, f)
+    if mtime is not None:
+      os.utime(json_fpath, (mtime, mtime))
+      os.utime(dirpath, (mtime, mtime))
+    return dirpath
+
+  def test_thumbnail_size(self):
+    self.assertEqual(thumbnail_size(WheelTemplate(canvas_size=(1024, 512))), (THUMBNAIL_SIZE, THUMBNAIL_SIZE // 2))
+    self.assertEqual(thumbnail_size(WheelTemplate(canvas_size=(64, 64))), (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+
+  def test_staleness(self):
+    dirpath = self._save_template("t1", mtime=1000)
+    self.assertTrue(thumbnail_is_stale(dirpath))
+    write_thumbnail(WheelTemplate(), dirpath, Image.new("RGBA", (8, 8)))
+    self.assertFalse(thumbnail_is_stale(dirpath))
+    # The template was saved again
+    os.utime(os.path.join(dirpath, TEMPLATE_JSON_FNAME), None)
+    os.utime(thumbnail_path(dirpath), (999, 999))
+    self.assertTrue(thumbnail_is_stale(dirpath))
+
+  def test_write_given_image(self):
+    dirpath = self._save_template("t1")
+    fpath = write_thumbnail(WheelTemplate(), dirpath, Image.new("RGBA", (THUMBNAIL_SIZE, THUMBNAIL_SIZE)))
+    self.assertEqual(fpath, thumbnail_path(dirpath))
+    with Image.open(fpath) as im:
+      self.assertEqual(im.size, (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    self.assertEqual(sorted(os.listdir(dirpath)), sorted([TEMPLATE_JSON_FNAME, os.path.basename(fpath)]))
+
+  def test_get_thumbnail_renders_stale_ones(self):
+    dirpath = self._save_template("t1", canvas_size=(1024, 512))
+    fpath = get_thumbnail(dirpath)
+    with Image.open(fpath) as im:
+      self.assertEqual(im.size, (THUMBNAIL_SIZE, THUMBNAIL_SIZE // 2))
+    mtime = os.stat(fpath).st_mtime
+    self.assertEqual(get_thumbnail(dirpath), fpath)
+    self.assertEqual(os.stat(fpath).st_mtime, mtime)
+
+  def test_previews(self):
+    self._save_template("t1", mtime=1000)
+    self._save_template("t2", mtime=1001)
+    self._save_template("broken", mtime=1002)
+    catalog = Catalog(os.path.join(self.dirpath, CATALOG_DB_NAME), self.templates_dir,
+                      os.path.join(self.dirpath, "designs"))
+
+    def fake_write(wt, dirpath, image=None):
+      if dirpath.endswith("broken"):
+        raise Exception("Can't render")
+      return write_thumbnail(wt, dirpath, Image.new("RGBA", thumbnail_size(wt)))
+
+    try:
+      catalog.rescan()
+      with mock.patch.object(thumbnails, "write_thumbnail", side_effect=fake_write):
+        previews, total = template_previews(catalog, self.templates_dir, page_size=2)
+        next_previews, _total = template_previews(catalog, self.templates_dir, page=1, page_size=2)
+    finally:
+      catalog.close()
+    self.assertEqual(total, 3)
+    # The broken template is skipped
+    self.assertEqual([row["dir"] for _fpath, row in previews], ["t2"])
+    self.assertEqual([row["dir"] for _fpath, row in next_previews], ["t1"])
+    for fpath, row in previews + next_previews:
+      self.assertEqual(fpath, thumbnail_path(os.path.join(self.templates_dir, row["dir"])))
+      self.assertTrue(os.path.isfile(fpath))
+
+if __name__ == "__main__":
+  unittest.main()
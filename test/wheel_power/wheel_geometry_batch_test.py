@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+
+from wheel_geometry import WheelTemplate, WheelTemplateBatch
+
+
+def random_templates(n, seed=0):
+  # Parameter sets around the UI slider ranges, many of them with geometric errors
+  rng = np.random.default_rng(seed)
+  templates = []
+  for _i in range(n):
+    rim_diameter = rng.uniform(10, 30)
+    hub_diameter = rng.uniform(3, rim_diameter)
+    templates.append(WheelTemplate(
+      rim_diameter=rim_diameter,
+      rim_width=rng.uniform(0.1, rim_diameter / 2),
+      hub_diameter=hub_diameter,
+      hub_width=rng.uniform(0.5, hub_diameter / 2),
+      lug_nut_count=int(rng.integers(3, 10)),
+      lug_nut_diameter=rng.uniform(0.2, 2.0),
+      lug_nuts_init_angle=rng.uniform(0, 360),
+      bolt_circle_diameter=rng.uniform(1, hub_diameter),
+      spoke_count=int(rng.integers(3, 10)),
+      spoke_central_angle=rng.uniform(5, 80),
+      spokes_init_angle=rng.uniform(0, 360),
+    ))
+  return templates
+
+
+class WheelTemplateBatchTests(unittest.TestCase):
+  def setUp(self):
+    self.templates = random_templates(2000)
+    self.batch = WheelTemplateBatch.from_templates(self.templates)
+
+  def test_errors_match_scalar(self):
+    errors = self.batch.check_errors_in_geometry()
+    self.assertTrue(0 < np.count_nonzero(errors) < len(errors))
+    for i, wt in enumerate(self.templates):
+      _error_strs, err_parts = wt.check_errors_in_geometry()
+      self.assertEqual(int(errors[i]), sum(1 << part for part in err_parts), "row %d" % i)
+
+  def test_areas_match_scalar_exactly(self):
+    valid = self.batch.valid_mask()
+    areas = self.batch.calc_areas()
+    for i in np.flatnonzero(valid).tolist():
+      expected = self.templates[i].calc_areas()
+      for key, value in expected.items():
+        self.assertEqual(float(areas[key][i]), value, "%s of row %d" % (key, i))
+
+  def test_template_round_trip(self):
+    for i in (0, 1, len(self.templates) - 1):
+      self.assertEqual(self.batch.template(i).to_dict(), self.templates[i].to_dict())
+
+  def test_out_of_range_values(self):
+    with self.assertRaises(Exception):
+      WheelTemplateBatch(spoke_count=[3, 0, 5])
+    bad, _msg = WheelTemplateBatch.out_of_range("spoke_count", [3, 0, 5])
+    self.assertEqual(bad.tolist(), [False, True, False])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from wheel_geometry import WheelTemplate, WheelTemplateRenderer
+
+
+class GenerateTiledTests(unittest.TestCase):
+  def setUp(self):
+    self.dirpath = tempfile.mkdtemp()
+    self.wt = WheelTemplate(spoke_count=7, canvas_size=(300, 200))
+
+  def tearDown(self):
+    shutil.rmtree(self.dirpath)
+
+  def _check(self, fname, band_height, **kwargs):
+    fpath = os.path.join(self.dirpath, fname)
+    self.assertEqual(WheelTemplateRenderer(self.wt).generate_tiled(fpath, band_height=band_height, **kwargs), fpath)
+    expected = WheelTemplateRenderer(self.wt).generate_raster("pil", **kwargs)
+    with Image.open(fpath) as im:
+      self.assertEqual(im.size, (300, 200))
+      self.assertEqual(im.mode, expected.mode)
+      self.assertEqual(im.tobytes(), expected.tobytes())
+
+  def test_png_bands(self):
+    # Bands that don't divide the height, and a single band
+    for band_height in (37, 200, None):
+      self._check("wheel.png", band_height)
+
+  def test_tiff(self):
+    self._check("wheel.tif", 64, alpha_channel=False)
+
+  def test_mask(self):
+    self._check("wheel.png", 50, mask=True)
+
+  def test_unsupported_format(self):
+    with self.assertRaises(Exception):
+      WheelTemplateRenderer(self.wt).generate_tiled(os.path.join(self.dirpath, "wheel.jpg"))
+    self.assertEqual(os.listdir(self.dirpath), [])
+
+
+if __name__ == "__main__":
+  unittest.main()